@@ -1,7 +1,14 @@
 import re
+import sys
+import json
 from collections import Counter,defaultdict
+from itertools import accumulate,islice
+from bisect import bisect_left
 import random
 import math
+import multiprocessing
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 class Ngram_Language_Model:
     """The class implements a Markov Language Model that learns amodel from a given text.
@@ -9,12 +16,15 @@ class Ngram_Language_Model:
         The class can be applied on both word level and caracter level.
     """
 
-    def __init__(self, n=3, chars=False):
+    def __init__(self, n=3, chars=False, min_count=1, max_entries=None, max_bytes=None):
         """Initializing a language model object.
         Arges:
             n (int): the length of the markov unit (the n of the n-gram). Defaults to 3.
             chars (bool): True iff the model consists of ngrams of characters rather then word tokens.
                           Defaults to False
+            min_count (int): ngrams counted less then min_count times are pruned from the model. Defaults to 1
+            max_entries (int): the maximal number of ngrams kept in the model. Defaults to None (no limit)
+            max_bytes (int): a memory budget for the count tables. Defaults to None (no limit)
         """
         self.n_grams = n
         self.split_by_char = chars
@@ -26,39 +36,50 @@ class Ngram_Language_Model:
         # self.special_word = "<S>"
         self.oov = True
         self.generate_bool = True
-    def build_model(self, text):  #should be called build_model
+        self.next_token_index = {}
+        self.ngram_distribution = ([],[])
+        self.short_context_index = {} #: seed shorter then n-1 -> next tokens, see short_context_distribution()
+        self.sorted_keys = None #: (keys, model order), built on the first short seed
+        self.head = [] #: first n words, for merge
+        self.carry = [] #: last n words, carried to the next chunk
+        self.pending_text = "" #: the text after the last token boundary, waits for the next chunk
+        self.pending_token = None #: the last token read, counted once a token follows it
+        self.text_started = False #: True once the first token of the text was read
+        self.min_count = min_count
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.prune_interval = 100000 #: windows counted between two checks of the limits
+        self.generation_arrays = None #: built on the first generate_batch
+        self.lower_order_models = {} #: n -> model derived from the counts, see lower_order_model()
+    def build_model(self, text, workers=1):  #should be called build_model
         """populates a dictionary counting all ngrams in the specified text.
         
             Args:
                 text (str): the text to construct the model from.
+                workers (int): the number of processes counting the ngrams. Defaults to 1.
         """
    
         
-        if self.split_by_char:
-            list_of_words = list(text)
-            self.join_note = "#@"
-        else:
-            list_of_words = normalize_text(text).split(" ")
-            list_of_words = list_of_words[:-1]
-        
+        #: a new model of the text, update() is the one that adds to the counts
+        self.model = Counter()
+        self.model_n_min_1 = Counter()
+        self.total_words_in_corpos = 0
+        self.head = []
+        self.carry = []
+        self.pending_text = ""
+        self.pending_token = None
         
-               
-        self.total_words_in_corpos = len(list_of_words) #: for normalization
+        #: the tokens are read lazily from the text, only the parallel mode needs them all
+        tokens = self.corpus_tokens(text)
         
         #: add <s> in the begging for calculate window easy
         # self.add_special_char(list_of_words)
         
-        if self.n_grams == 1: #: easy case uni-gram
-            self.model = Counter(list_of_words)
+        if workers > 1:
+            self.count_parallel(list(tokens), workers)
         else:
-            for first_window_index in range(len(list_of_words) - self.n_grams+1):
-                word_window = list_of_words[first_window_index:first_window_index+self.n_grams]
-                string_window = self.join_note.join(word_window)
-                self.model[string_window] += 1
-            for first_window_index in range(len(list_of_words) - (self.n_grams)):
-                word_window = list_of_words[first_window_index:first_window_index+(self.n_grams-1)]
-                string_window = self.join_note.join(word_window)
-                self.model_n_min_1[string_window] += 1
+            self.add_tokens(tokens)
+        self.text_started = self.total_words_in_corpos > 0
         
         
         
@@ -69,21 +90,376 @@ class Ngram_Language_Model:
         #     if self.special_word not in key:
         #         self.model_without_special_word[key] = value
         
-        self.model_defultdict = counter_to_defultdict(self.model)
-        self.sorted_model = dict(self.model.most_common())
+        self.finish_model()
 
+    def update(self, chunks):
+        """adds the ngrams of a stream of text chunks to the model.
             
-                
+            the chunks are normalized and counted one at a time. the text after the last
+            token boundary (maybe a cut word) and the last token wait for the next chunk,
+            also of the next update() call, and the last n words are carried over, so no
+            word or window is lost on a boundary. close() counts what waits at the end of
+            the text. on a new model update(chunks) and close() count the same ngrams as
+            build_model("".join(chunks)).
+            
+            Args:
+                chunks (iterable): the text chunks (str) to add to the model.
+        """
+        self.add_tokens(self.stream_tokens(chunks))
+        self.finish_model()
+
+    def close(self):
+        """counts the text that waits for the next update() as the end of the text.
+            like build_model the last token (the empty token after a final space) is not counted.
+        """
+        self.count_pending()
+        self.finish_model()
+
+    def stream_tokens(self, chunks):
+        """Returns a generator of the tokens of the chunks that are known to be complete,
+            all the tokens before the last token boundary but the last one. the rest waits
+            in pending_text and pending_token.
+
+            Args:
+                chunks (str or iterable): the text or a stream of text chunks.
+        """
+        if isinstance(chunks, str):
+            chunks = [chunks]
+        if self.split_by_char:
+            self.join_note = "#@"
+            for chunk in chunks:
+                yield from chunk
+            return
+        for chunk in chunks:
+            text,self.pending_text = split_at_token_boundary(self.pending_text + chunk)
+            if not text:
+                continue
+            first = not self.text_started
+            self.text_started = True
+            for token in text_tokens(text, first=first):
+                if self.pending_token is not None:
+                    yield self.pending_token
+                self.pending_token = token
+
+    def count_pending(self):
+        """counts the pending token and text as the end of the text, without the last token.
+        """
+        tokens = [] if self.pending_token is None else [self.pending_token]
+        if not self.split_by_char:
+            tokens.extend(text_tokens(self.pending_text, first=not self.text_started, last=True))
+        self.add_tokens(tokens[:-1])
+        self.pending_text = ""
+        self.pending_token = None
+        self.text_started = self.total_words_in_corpos > 0
+
+    def corpus_tokens(self, chunks):
+        """Returns a generator of the tokens that build_model counts in the text:
+            the characters in char mode, else the normalized words without the last
+            one (the empty token after the final space of normalize_text).
+
+            Args:
+                chunks (str or iterable): the text or a stream of text chunks.
+        """
+        if self.split_by_char:
+            self.join_note = "#@"
+            return iter_tokens(chunks, chars=True)
+        return drop_last(iter_tokens(chunks))
+
+    def add_tokens(self, tokens, block_size=10000):
+        """counts a stream of tokens block_size tokens at a time.
+
+            Args:
+                tokens (iterable): the next tokens of the text.
+                block_size (int): the number of tokens counted together.
+        """
+        tokens = iter(tokens)
+        block = list(islice(tokens, block_size))
+        while block:
+            self.add_words(block)
+            block = list(islice(tokens, block_size))
+
+    def update_from_files(self, paths, chunk_size=1 << 20):
+        """adds the ngrams of the specified files to the model, reading chunk_size characters at a time.
+            the last words of the files wait for the next update() or close() like the end of any chunk.
+
+            Args:
+                paths (iterable): the text files to add to the model, read as one stream (a file ends a word).
+                chunk_size (int): the number of characters read per chunk.
+        """
+        self.update(read_text_chunks(paths, chunk_size))
+
+    def merge(self, other):
+        """adds the counts of another partially built model to this model, as if
+            the text of the other model followed the text of this model. the texts meet on
+            a token boundary: the text that waits in this model is counted as the end of
+            its text first, the windows that cross the boundary are counted from the
+            carried words of both models, and the text that waits in the other model
+            waits in the merged model.
+
+            Args:
+                other (Ngram_Language_Model): a model with the same n and chars.
+
+            Returns:
+                The merged model (self).
+        """
+        if other.n_grams != self.n_grams or other.split_by_char != self.split_by_char:
+            raise ValueError("can only merge models with the same n and chars")
+        self.join_note = other.join_note
+        self.count_pending()
         
+        window = self.carry + other.head
+        self.count_windows(window, len(self.carry), boundary=len(self.carry))
+        self.model.update(other.model)
+        self.model_n_min_1.update(other.model_n_min_1)
+        self.total_words_in_corpos += other.total_words_in_corpos
+        self.head = (self.head + other.head)[:self.n_grams]
+        self.carry = (self.carry + other.carry)[-self.n_grams:]
+        self.pending_text = other.pending_text
+        self.pending_token = other.pending_token
+        self.text_started = self.text_started or other.text_started
+        self.finish_model()
+        return self
+
+    def add_words(self, words):
+        """counts the windows that end in the specified words, continuing the carried words.
+
+            Args:
+                words (list): the next words of the text.
+        """
+        self.count_windows(self.carry + words, len(self.carry))
+        self.track_words(words)
+
+    def track_words(self, words):
+        """updates the head, the carried words and the number of words after counting words.
+        """
+        if len(self.head) < self.n_grams:
+            self.head = (self.head + words)[:self.n_grams]
+        self.carry = (self.carry + words[-self.n_grams:])[-self.n_grams:]
+        self.total_words_in_corpos += len(words)
+
+    def count_windows(self, words, start, boundary=None):
+        """counts the ngrams and (n-1)-grams of the words that end at index start or later.
+            like build_model the (n-1)-gram of a window is counted only if a word follows the window.
+
+            Args:
+                words (list): the words, words[:start] were already counted.
+                start (int): the index of the first new word.
+                boundary (int): if set, count only the windows that start before this index
+                                (the windows that the two sides of a merge could not count).
+        """
+        if self.n_grams == 1 and boundary is None: #: easy case uni-gram
+            self.model.update(words[start:])
+            self.prune_to_limits()
+            return
+        step = self.prune_interval if self.is_pruning() else max(len(words), 1)
+        for block_start in range(start, len(words), step):
+            for end in range(block_start, min(block_start + step, len(words))):
+                if end >= self.n_grams - 1 and (boundary is None or end - boundary < self.n_grams - 1):
+                    self.model[self.join_note.join(words[end-self.n_grams+1:end+1])] += 1
+                if self.n_grams > 1 and end >= self.n_grams and (boundary is None or end - boundary < self.n_grams):
+                    self.model_n_min_1[self.join_note.join(words[end-self.n_grams:end-1])] += 1
+            self.prune_to_limits()
+
+    def count_parallel(self, list_of_words, workers):
+        """counts the ngrams of the words with a pool of processes.
+            the words are cut to one shard per worker, every shard gets the n words before
+            it so the windows that cross a shard boundary are counted exactly once, and the
+            Counters of the shards are summed into the model. the shards are not pruned, in
+            pruning mode finish_model prunes the summed counts once, so the model does not
+            depend on the number of workers.
+
+            Args:
+                list_of_words (list): the words of the text.
+                workers (int): the number of processes.
+        """
+        shard_size = max(1, -(-len(list_of_words) // workers))
+        shards = []
+        for start in range(0, len(list_of_words), shard_size):
+            carry = (self.carry + list_of_words[:start])[-self.n_grams:]
+            shards.append((self.n_grams, self.join_note, carry, list_of_words[start:start + shard_size]))
         
-            
-            
+        with multiprocessing.Pool(workers) as pool:
+            for model,model_n_min_1 in pool.imap(count_shard, shards):
+                self.model.update(model)
+                self.model_n_min_1.update(model_n_min_1)
+        self.track_words(list_of_words)
+
+    def is_pruning(self):
+        """Returns True iff the model is built in pruning mode.
+        """
+        return self.min_count > 1 or self.max_entries is not None or self.max_bytes is not None
+
+    def table_bytes(self):
+        """Returns the estimated memory of the count tables, the dicts and the average
+            size of (a sample of) the keys and counts.
+        """
+        size = 0
+        for table in (self.model, self.model_n_min_1):
+            size += sys.getsizeof(table)
+            sample = list(islice(table.items(), 100))
+            if sample:
+                entry_size = sum(sys.getsizeof(key) + sys.getsizeof(value) for key,value in sample) / len(sample)
+                size += int(len(table) * entry_size)
+        return size
+
+    def prune_to_limits(self):
+        """prunes the count tables while counting if they passed max_entries or max_bytes.
+            the ngrams are pruned to half of the limit (so counting can go on for a while
+            before the next prune) by the smallest count threshold that gets there, and the
+            (n-1)-grams are pruned by the same threshold.
+        """
+        target = None
+        if self.max_entries is not None and len(self.model) > self.max_entries:
+            target = self.max_entries // 2
+        if self.max_bytes is not None:
+            size = self.table_bytes()
+            if size > self.max_bytes:
+                bytes_target = int(len(self.model) * self.max_bytes / size) // 2
+                target = bytes_target if target is None else min(target, bytes_target)
+        if target is None:
+            return
+        
+        #: smallest threshold that keeps at most target ngrams
+        counts_histogram = Counter(self.model.values())
+        kept = len(self.model)
+        threshold = 1
+        for count in sorted(counts_histogram):
+            if kept <= target and threshold >= self.min_count:
+                break
+            kept -= counts_histogram[count]
+            threshold = count + 1
+        self.prune(threshold)
+
+    def prune(self, threshold):
+        """removes the ngrams and (n-1)-grams counted less then threshold times.
+
+            Args:
+                threshold (int): the minimal count to keep.
+        """
+        self.model = Counter({key: value for key,value in self.model.items() if value >= threshold})
+        self.model_n_min_1 = Counter({key: value for key,value in self.model_n_min_1.items() if value >= threshold})
+
+    def finish_model(self):
+        """populates the tables derived from the counts (get_model dict, sorted model and context index).
+            in pruning mode the tables are pruned like while counting if they passed max_entries
+            or max_bytes (summed parallel or merged counts), the ngrams under min_count are
+            pruned, the model is cut to the max_entries most common ngrams, and every kept
+            ngram keeps a context count at
+            least as big as the counts of its kept continuations, so evaluate never divides by
+            a pruned (n-1)-gram and smooth() works on the pruned tables as on a full model.
+        """
+        if self.is_pruning():
+            self.prune_to_limits()
+            if self.min_count > 1:
+                self.prune(self.min_count)
+            if self.max_entries is not None and len(self.model) > self.max_entries:
+                self.model = Counter(dict(self.model.most_common(self.max_entries)))
+            if self.n_grams > 1:
+                continuation_counts = Counter()
+                for key,value in self.model.items():
+                    continuation_counts[key.rsplit(self.join_note, 1)[0]] += value
+                for context,value in continuation_counts.items():
+                    if self.model_n_min_1[context] < value:
+                        self.model_n_min_1[context] = value
+        self.model_defultdict = counter_to_defultdict(self.model)
+        self.sorted_model = dict(self.model.most_common())
+        self.build_next_token_index()
+        self.generation_arrays = None
+        self.lower_order_models = {}
 
     def get_model(self):
         """Returns the model as a dictionary of the form {ngram:count}
         """
         return self.model_defultdict
 
+    def get_probabilities(self):
+        """Returns the probability and the smoothed probability of every ngram of the model,
+            as a dictionary of the form {ngram:(probability, smoothed)} (see probability() and smooth()).
+            the probability of the last ngram of the text is inf if its context is never followed by a word.
+        """
+        probabilities = {}
+        for key in self.model:
+            ngram = key.split(self.join_note)
+            try:
+                probability = self.probability(ngram)
+            except ZeroDivisionError:
+                probability = math.inf
+            probabilities[key] = (probability, self.smooth(ngram))
+        return probabilities
+
+    def lower_order_model(self, n=1):
+        """Returns a model of a lower order derived from the ngram counts, without the text.
+            every ngram adds its count to each of the n-grams inside it, so the model counts
+            the same as a model built on the text of all the ngrams (with no windows that
+            cross two ngrams). the model is cached until this model changes.
+
+            Args:
+                n (int): the order of the derived model, smaller than the order of this model. Defaults to 1
+
+            Returns:
+                Ngram_Language_Model.
+        """
+        if not 0 < n < self.n_grams:
+            raise ValueError("can only derive a model of order 1 to %d" % (self.n_grams - 1))
+        if n not in self.lower_order_models:
+            lm = Ngram_Language_Model(n, chars=self.split_by_char)
+            lm.join_note = self.join_note
+            for key,count in self.get_model().items():
+                words = key.split(self.join_note)
+                for start in range(len(words) - n + 1):
+                    lm.model[self.join_note.join(words[start:start + n])] += count
+                    #: like count_windows, a context is counted only if a word follows the window
+                    if n > 1 and start + n < len(words):
+                        lm.model_n_min_1[self.join_note.join(words[start:start + n - 1])] += count
+                lm.total_words_in_corpos += count * len(words)
+            lm.finish_model()
+            self.lower_order_models[n] = lm
+        return self.lower_order_models[n]
+
+    def build_next_token_index(self):
+        """populates the context index used by generate.
+
+            every context (the first n-1 tokens of an ngram, the empty string for uni-gram)
+            is mapped to the tokens that follow it and their cumulative counts, so the next
+            token is sampled with one dict lookup and a bisect instead of a scan of the model.
+        """
+        distribution = defaultdict(dict)
+        for key,value in self.model.items():
+            list_key = key.split(self.join_note)
+            distribution[self.join_note.join(list_key[:-1])][list_key[-1]] = value
+
+        self.next_token_index = {}
+        for context,next_tokens in distribution.items():
+            self.next_token_index[context] = (list(next_tokens.keys()), list(accumulate(next_tokens.values())))
+        self.ngram_distribution = (list(self.model.keys()), list(accumulate(self.model.values())))
+        self.short_context_index = {}
+        self.sorted_keys = None
+
+    def short_context_distribution(self, context):
+        """Returns the tokens that may follow a seed shorter then n-1 tokens and their
+            cumulative counts. like the scan of the model before the context index, these
+            are the last tokens of the ngrams whose text starts with the seed, in the order
+            of the model and with the count of the last such ngram. the ngrams are found by
+            a bisect of the sorted keys and the distribution is kept per seed.
+
+            Args:
+                context (str): the joined tokens of the seed.
+        """
+        if context not in self.short_context_index:
+            if self.sorted_keys is None:
+                keys = list(self.model.keys())
+                order = sorted(range(len(keys)), key=keys.__getitem__)
+                self.sorted_keys = ([keys[position] for position in order], order)
+            keys,order = self.sorted_keys
+            low = high = bisect_left(keys, context)
+            while high < len(keys) and keys[high].startswith(context):
+                high += 1
+            distribution_dict = {}
+            for position,key in sorted(zip(order[low:high], keys[low:high])):
+                distribution_dict[key.split(self.join_note)[-1]] = self.model[key]
+            self.short_context_index[context] = (list(distribution_dict.keys()), list(accumulate(distribution_dict.values())))
+        return self.short_context_index[context]
+
     def generate(self, context=None, n=20):
         """Returns a string of the specified length, generated by applying the language model
         to the specified seed context. If no context is specified the context should be sampled
@@ -113,11 +489,11 @@ class Ngram_Language_Model:
             genrated_text = context
            
         else: #: context dosent exist
-            genrated_text = random.choices(list(self.model.keys()), weights=list(self.model.values()), k=1)[0].split(" ")
+            genrated_text = self.sample_ngram()
         
         if self.n_grams == 1:
             while(len(genrated_text) < n and self.generate_bool):
-                random_choise = random.choices(list(self.model.keys()), weights=list(self.model.values()), k=1)[0].split(" ")[0]
+                random_choise = self.sample_ngram()[0]
                 genrated_text.append(random_choise)
         else:
             while(len(genrated_text) < n and self.generate_bool):
@@ -141,7 +517,9 @@ class Ngram_Language_Model:
                Float. The float should reflect the (log) probability.
         """
         
-        if self.split_by_char:
+        if not isinstance(text, str): #: already tokenized
+            text = list(text)
+        elif self.split_by_char:
             text = list(text)
         else:
             text = text.split(" ")
@@ -171,6 +549,80 @@ class Ngram_Language_Model:
             
         return math.log(likelihod)
 
+    def evaluate_many(self, texts):
+        """Returns the log-likelihods of the specified texts, like evaluate() for each text.
+           the probabilities are summed in log space (no underflow on long texts) and the
+           log probability of every window is computed once for the whole batch.
+
+           Args:
+               texts (iterable): Texts (str) to evaluate.
+
+           Returns:
+               np.array. The (log) probability of every text.
+        """
+        log_probabilities = {} #: window -> log probability, None if the window is not in the model
+        log_smoothed = {} #: window -> smoothed log probability
+        scores = []
+        for text in texts:
+            if not isinstance(text, str): #: already tokenized
+                text = list(text)
+            elif self.split_by_char:
+                text = list(text)
+            else:
+                text = text.split(" ")
+            
+            smooth = False
+            log_likelihod = 0.0
+            for first_window_index in range(len(text)-self.n_grams+1):
+                words = text[first_window_index:first_window_index+self.n_grams]
+                window = self.join_note.join(words)
+                if not smooth:
+                    if window not in log_probabilities:
+                        log_probabilities[window] = self.log_probability(words)
+                    if log_probabilities[window] is not None:
+                        log_likelihod += log_probabilities[window]
+                        continue
+                    smooth = True
+                
+                if window not in log_smoothed:
+                    log_smoothed[window] = math.log(self.smooth(words))
+                log_likelihod += log_smoothed[window]
+            scores.append(log_likelihod)
+        return np.array(scores)
+
+    def probability(self, ngram):
+        """Returns the (not smoothed) probability of the specified ngram, the factor
+            evaluate() multiplies for it before any window was smoothed.
+
+            Args:
+                ngram (list): the ngram words.
+
+            Returns:
+                float. The probability, None if the ngram is not in the model.
+        """
+        count_n_gram = self.model[self.join_note.join(ngram)]
+        if count_n_gram == 0:
+            return None
+        if self.n_grams > 1:
+            count_n_min_1_gram = self.model_n_min_1[self.join_note.join(ngram[:-1])]
+        else:
+            count_n_min_1_gram = self.total_words_in_corpos
+        return count_n_gram/count_n_min_1_gram
+
+    def log_probability(self, ngram):
+        """Returns the log of the (not smoothed) probability of the specified ngram.
+
+            Args:
+                ngram (list): the ngram words.
+
+            Returns:
+                float. The log probability, None if the ngram is not in the model.
+        """
+        probability = self.probability(ngram)
+        if probability is None:
+            return None
+        return math.log(probability)
+
     def smooth(self, ngram):
         """Returns the smoothed (Laplace) probability of the specified ngram.
 
@@ -188,36 +640,171 @@ class Ngram_Language_Model:
         return smoothed_probability
         
     def search_next_phrase(self,phrase):
-        """Returns the smoothed (Laplace) probability of the specified ngram.
+        """append the next token to the phrase.
             
-            check the next word distribution from the model.
+            check the next word distribution of the phrase context in the context index.
+            a phrase shorter then n-1 tokens is not a context of the index, it is sampled
+            like before the index: the last token of an ngram that starts with the phrase text
+            (see short_context_distribution).
             
             in addition we check if we have oov more then once to see if the model
             exhausted.
             
             Args:
-                phrase (str): the phrase we need to check for calculate next phrase
+                phrase (list): the phrase we need to check for calculate next phrase
 
   
         """
-        distribution_dict = {}
-        
-        
         phrase_part = phrase[-self.n_grams+1:]
+        context = self.join_note.join(phrase_part)
         
-        for key,value in self.model.items():
-            list_key = key.split(self.join_note)
-            if self.join_note.join(list_key).startswith(self.join_note.join(phrase_part)):
-                distribution_dict[list_key[-1]] = value
-        if distribution_dict: #: found next word
-            phrase.append(random.choices(list(distribution_dict.keys()), weights=list(distribution_dict.values()), k=1)[0])
+        if len(phrase_part) < self.n_grams - 1: #: seed shorter then n-1
+            next_tokens,cum_weights = self.short_context_distribution(context)
+            if next_tokens: #: found next word
+                phrase.append(random.choices(next_tokens, cum_weights=cum_weights, k=1)[0])
+                return
+        elif context in self.next_token_index: #: found next word
+            next_tokens,cum_weights = self.next_token_index[context]
+            phrase.append(random.choices(next_tokens, cum_weights=cum_weights, k=1)[0])
             return
         
         #: check if model exhausted by the idea of having only 1 oov in the begging of the context
-        phrase.extend(random.choices(list(self.model.keys()), weights=list(self.model.values()), k=1)[0].split(" "))
+        phrase.extend(self.sample_ngram())
         if len(phrase) > (self.n_grams -1):
             self.generate_bool = False
         
+    def sample_ngram(self):
+        """Returns the tokens of an ngram sampled from the model by its counts.
+        """
+        ngrams,cum_weights = self.ngram_distribution
+        return random.choices(ngrams, cum_weights=cum_weights, k=1)[0].split(self.join_note)
+
+    def generate_batch(self, contexts, n=20, seed=None):
+        """Returns a generated string for every context, like generate() for each context.
+        
+            the sequences are generated in lockstep: the contexts of the model are the states
+            of an automaton, every step samples the next token of all the sequences with one
+            searchsorted over the cumulative counts and moves them to their next state.
+            every sequence draws from its own random stream (spawned from seed), so it is
+            reproducible whatever the other sequences of the batch are. a sequence stops when
+            it reaches a context that is not in the model (or a seed context of less then n-1 tokens).
+
+            Args:
+                contexts (list): the seed contexts (str), None to sample the context from the model.
+                n (int): the length of the strings to be generated.
+                seed (int): the seed of the random streams. Defaults to None
+
+            Return:
+                list. The generated texts.
+        """
+        arrays = self.get_generation_arrays()
+        uniforms = self.sequence_uniforms(len(contexts), n + 1, seed)
+        sequences = []
+        states = np.full(len(contexts), -1, dtype=np.int64)
+        sampled = [] #: sequences without a context start from a sampled ngram
+        for sequence_index,context in enumerate(contexts):
+            words = []
+            if context:
+                words = self.context_words(context)
+                context_key = self.join_note.join(words[-self.n_grams+1:]) if self.n_grams > 1 else ""
+                states[sequence_index] = arrays["context_ids"].get(context_key, -1)
+            elif arrays["cum_counts"].size:
+                sampled.append(sequence_index)
+            sequences.append(words)
+        if sampled:
+            points = (uniforms[sampled, 0] * arrays["cum_counts"][-1]).astype(np.int64)
+            entries = np.searchsorted(arrays["cum_counts"], points, side='right')
+            for sequence_index,entry in zip(sampled, entries.tolist()):
+                sequences[sequence_index] = arrays["contexts"][arrays["entry_context"][entry]] + [arrays["tokens"][arrays["entry_tokens"][entry]]]
+            states[sampled] = arrays["next_state"][entries]
+        
+        lengths = np.array([len(words) for words in sequences], dtype=np.int64)
+        generated = np.full((len(contexts), n), -1, dtype=np.int64)
+        for step in range(n):
+            active = np.flatnonzero((states >= 0) & (lengths + step < n))
+            if active.size == 0:
+                break
+            active_states = states[active]
+            points = arrays["before"][active_states] + (uniforms[active, step + 1] * arrays["totals"][active_states]).astype(np.int64)
+            entries = np.searchsorted(arrays["cum_counts"], points, side='right')
+            generated[active, step] = arrays["entry_tokens"][entries]
+            states[active] = arrays["next_state"][entries]
+        
+        return [self.join_words(words + [arrays["tokens"][token_id] for token_id in row if token_id >= 0])
+                for words,row in zip(sequences, generated.tolist())]
+
+    def get_generation_arrays(self):
+        """Returns the arrays of the generation automaton, built from the context index.
+            every (context, next token) pair of the index is one entry of the flat arrays:
+            its token id, its count (as a global cumulative count) and the state (context id)
+            reached after the token, -1 if that context is not in the model.
+        """
+        if self.generation_arrays is not None:
+            return self.generation_arrays
+        
+        contexts = list(self.next_token_index.keys())
+        context_ids = {context: context_id for context_id,context in enumerate(contexts)}
+        token_ids = {}
+        entry_tokens = []
+        entry_context = []
+        next_state = []
+        counts = []
+        before = []
+        for context_id,context in enumerate(contexts):
+            context_words = context.split(self.join_note) if self.n_grams > 1 else []
+            next_tokens,cum_weights = self.next_token_index[context]
+            before.append(len(counts))
+            previous = 0
+            for token,cum_weight in zip(next_tokens, cum_weights):
+                entry_tokens.append(token_ids.setdefault(token, len(token_ids)))
+                entry_context.append(context_id)
+                next_state.append(context_ids.get(self.join_note.join((context_words + [token])[1:]), -1) if self.n_grams > 1 else 0)
+                counts.append(cum_weight - previous)
+                previous = cum_weight
+        
+        cum_counts = np.cumsum(np.array(counts, dtype=np.int64))
+        starts = np.array(before, dtype=np.int64)
+        ends = np.append(starts[1:], len(counts)).astype(np.int64)
+        before_counts = np.where(starts > 0, cum_counts[np.maximum(starts - 1, 0)], 0) if len(counts) else starts
+        self.generation_arrays = {
+            "contexts": [context.split(self.join_note) if self.n_grams > 1 else [] for context in contexts],
+            "context_ids": context_ids,
+            "tokens": list(token_ids.keys()),
+            "entry_tokens": np.array(entry_tokens, dtype=np.int64),
+            "entry_context": np.array(entry_context, dtype=np.int64),
+            "next_state": np.array(next_state, dtype=np.int64),
+            "cum_counts": cum_counts,
+            "before": before_counts,
+            "totals": cum_counts[ends - 1] - before_counts if len(counts) else starts,
+        }
+        return self.generation_arrays
+
+    def sequence_uniforms(self, count, steps, seed=None):
+        """Returns a (count, steps) matrix of uniform numbers in [0,1), row i is the
+            stream of a SplitMix64 generator seeded by a hash of (seed, i), so every
+            row is an independent stream computed for all the rows at once.
+        """
+        if seed is None:
+            seed = random.getrandbits(64)
+        streams = splitmix64(splitmix64(np.array([seed % 2 ** 64], dtype=np.uint64)) + np.arange(count, dtype=np.uint64))
+        states = streams[:, None] + np.arange(1, steps + 1, dtype=np.uint64)[None, :] * np.uint64(SPLITMIX64_GAMMA)
+        return (splitmix64(states) >> np.uint64(11)) * (1.0 / 2 ** 53)
+
+    def context_words(self, context):
+        """Returns the tokens of a seed context, as generate() splits it.
+        """
+        context = context.lower()
+        if self.split_by_char:
+            return list(context)
+        return context.split(" ")
+
+    def join_words(self, words):
+        """Returns the generated tokens as a string.
+        """
+        if self.split_by_char:
+            return "".join(words)
+        return " ".join(words)
+        
         
     # def add_special_char(self,text):
     #     #: add n-1 <S> in the beggining for the evaluate smooth
@@ -230,6 +817,735 @@ class Ngram_Language_Model:
 
 
 
+class Packed_Ngram_Language_Model(Ngram_Language_Model):
+    """Array backed storage of the Ngram_Language_Model.
+        Tokens are interned to integer ids and every ngram is packed to one fixed size key,
+        its ids as big-endian uint32 words (a numpy void), so the keys sort like the tuples
+        of ids and any n and vocabulary size fit. The ngrams and the (n-1)-grams are kept as
+        sorted key arrays with a parallel count array instead of string Counters, so the
+        model takes about 4n+16 bytes per ngram. get_model() and evaluate() return the
+        same values as the string based model.
+    """
+
+    def __init__(self, n=3, chars=False):
+        """Initializing a packed language model object.
+        Arges:
+            n (int): the length of the markov unit (the n of the n-gram). Defaults to 3.
+            chars (bool): True iff the model consists of ngrams of characters rather then word tokens.
+                          Defaults to False
+        """
+        super().__init__(n, chars)
+        self.vocabulary = {}
+        self.tokens = []
+        self.ngram_keys = np.zeros(0, dtype=key_dtype(n))
+        self.ngram_counts = np.zeros(0, dtype=np.int64)
+        self.ngram_cum_counts = np.zeros(0, dtype=np.int64)
+        self.context_keys = np.zeros(0, dtype=key_dtype(n - 1))
+        self.context_counts = np.zeros(0, dtype=np.int64)
+        self.model_defultdict = None #: decoded on the first get_model()
+
+    def build_model(self, text):
+        """populates the sorted key and count arrays of all ngrams in the specified text.
+
+            Args:
+                text (str): the text to construct the model from.
+        """
+        self.vocabulary = {}
+        self.lower_order_models = {}
+        self.model_defultdict = None
+        ids = np.fromiter((self.vocabulary.setdefault(word, len(self.vocabulary)) for word in self.corpus_tokens(text)),
+                          dtype=np.int64)
+        self.total_words_in_corpos = len(ids)
+        self.tokens = list(self.vocabulary.keys())
+        self.head = [self.tokens[token_id] for token_id in ids[:self.n_grams].tolist()]
+        self.carry = [self.tokens[token_id] for token_id in ids[-self.n_grams:].tolist()] if len(ids) else []
+        self.pending_text = ""
+        self.pending_token = None
+        self.text_started = len(ids) > 0
+        if len(self.tokens) > KEY_ID_LIMIT:
+            raise ValueError("vocabulary of %d tokens is too large for 32 bit token ids" % len(self.tokens))
+
+        #: same windows as the string model, the (n-1)-grams skip the last window
+        windows = len(ids) - self.n_grams + 1
+        self.ngram_keys, self.ngram_counts = self.count_ngram_windows(ids, self.n_grams, windows)
+        self.context_keys, self.context_counts = self.count_ngram_windows(ids, self.n_grams - 1, windows - 1)
+        self.ngram_cum_counts = np.cumsum(self.ngram_counts)
+
+    def from_model(self, lm):
+        """populates the packed arrays from the counts of a string based model
+            (for example a model built with update() or merge() of Ngram_Language_Model).
+
+            Args:
+                lm (Ngram_Language_Model): a built model.
+
+            Returns:
+                The packed model (self).
+        """
+        self.n_grams = lm.n_grams
+        self.split_by_char = lm.split_by_char
+        self.join_note = lm.join_note
+        self.total_words_in_corpos = lm.total_words_in_corpos
+        self.head = list(lm.head)
+        self.carry = list(lm.carry)
+        self.pending_text = lm.pending_text
+        self.pending_token = lm.pending_token
+        self.text_started = lm.text_started
+        self.vocabulary = {}
+        self.lower_order_models = {}
+        self.model_defultdict = None
+        for key in lm.model:
+            for word in key.split(self.join_note):
+                self.vocabulary.setdefault(word, len(self.vocabulary))
+        self.tokens = list(self.vocabulary.keys())
+        if len(self.tokens) > KEY_ID_LIMIT:
+            raise ValueError("vocabulary of %d tokens is too large for 32 bit token ids" % len(self.tokens))
+
+        self.ngram_keys, self.ngram_counts = self.pack_counter(lm.model, self.n_grams)
+        self.context_keys, self.context_counts = self.pack_counter(lm.model_n_min_1, self.n_grams - 1)
+        self.ngram_cum_counts = np.cumsum(self.ngram_counts)
+        return self
+
+    def pack_counter(self, counter, length):
+        """Returns the sorted packed keys of a Counter of joined ngrams of the specified length and their counts.
+        """
+        if length == 0 or not counter:
+            return np.zeros(0, dtype=key_dtype(length)), np.zeros(0, dtype=np.int64)
+        rows = np.array([[self.vocabulary[word] for word in key.split(self.join_note)] for key in counter], dtype=np.int64)
+        counts = np.fromiter(counter.values(), dtype=np.int64, count=len(counter))
+        return sort_keys(rows, counts)
+
+    def unpack(self, keys, counts, length):
+        """Returns a dict of the joined ngrams of packed keys of the specified length and their counts.
+        """
+        if keys.size == 0:
+            return {}
+        return {self.join_note.join([self.tokens[token_id] for token_id in row]): count
+                for row,count in zip(key_ids(keys, length).tolist(), counts.tolist())}
+
+    def to_model(self):
+        """Returns a string based Ngram_Language_Model with the counts of the packed arrays,
+            the first and last words and the waiting text so it can go on with update() or merge().
+        """
+        lm = Ngram_Language_Model(self.n_grams, self.split_by_char)
+        lm.join_note = self.join_note
+        lm.model = Counter(self.unpack(self.ngram_keys, self.ngram_counts, self.n_grams))
+        lm.model_n_min_1 = Counter(self.unpack(self.context_keys, self.context_counts, self.n_grams - 1))
+        lm.total_words_in_corpos = self.total_words_in_corpos
+        lm.head = list(self.head)
+        lm.carry = list(self.carry)
+        lm.pending_text = self.pending_text
+        lm.pending_token = self.pending_token
+        lm.text_started = self.text_started
+        return lm
+
+    def save(self, path):
+        """writes the model to one binary file that load() can memory-map.
+            the file is a magic line, a json header (n, chars, totals and the offset of
+            every array) and the arrays themselves, each aligned to 64 bytes: the sorted
+            ngram keys, counts and cumulative counts, the (n-1)-gram keys and counts and
+            the vocabulary as utf-8 bytes with their offsets.
+
+            Args:
+                path (str): the file to write.
+        """
+        encoded_tokens = [token.encode('utf-8') for token in self.tokens]
+        arrays = {
+            "ngram_keys": self.ngram_keys,
+            "ngram_counts": self.ngram_counts,
+            "ngram_cum_counts": self.ngram_cum_counts,
+            "context_keys": self.context_keys,
+            "context_counts": self.context_counts,
+            "token_offsets": np.cumsum([0] + [len(token) for token in encoded_tokens], dtype=np.int64),
+            "token_bytes": np.frombuffer(b"".join(encoded_tokens), dtype=np.uint8),
+        }
+        header = {"n": self.n_grams, "chars": self.split_by_char, "join_note": self.join_note,
+                  "total_words_in_corpos": self.total_words_in_corpos,
+                  "head": self.head, "carry": self.carry, "pending_text": self.pending_text,
+                  "pending_token": self.pending_token, "text_started": self.text_started, "arrays": {}}
+        offset = 0
+        for name,array in arrays.items():
+            header["arrays"][name] = [array.dtype.str, len(array), offset]
+            offset += -(-array.nbytes // 64) * 64
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = -(-(len(MODEL_FILE_MAGIC) + 8 + len(header_bytes)) // 64) * 64
+
+        with open(path, 'wb') as f:
+            f.write(MODEL_FILE_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for name,array in arrays.items():
+                f.seek(data_start + header["arrays"][name][2])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_start + offset)
+
+    def load(self, path, mmap=True):
+        """populates the model from a file written by save().
+
+            Args:
+                path (str): the file to read.
+                mmap (bool): True to memory-map the arrays (read only, shared by all the
+                             processes that load the same file) instead of reading them.
+                             Defaults to True
+
+            Returns:
+                The loaded model (self).
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(MODEL_FILE_MAGIC)) != MODEL_FILE_MAGIC:
+                raise ValueError("%s is not a saved language model" % path)
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = -(-(len(MODEL_FILE_MAGIC) + 8 + header_length) // 64) * 64
+
+        arrays = {}
+        for name,(dtype,length,offset) in header["arrays"].items():
+            if length == 0:
+                arrays[name] = np.zeros(0, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + offset, shape=(length,))
+            else:
+                arrays[name] = np.fromfile(path, dtype=dtype, count=length, offset=data_start + offset)
+
+        self.n_grams = header["n"]
+        self.split_by_char = header["chars"]
+        self.join_note = header["join_note"]
+        self.total_words_in_corpos = header["total_words_in_corpos"]
+        self.head = header.get("head", [])
+        self.carry = header.get("carry", [])
+        self.pending_text = header.get("pending_text", "")
+        self.pending_token = header.get("pending_token")
+        self.text_started = header.get("text_started", self.total_words_in_corpos > 0)
+        self.lower_order_models = {}
+        self.model_defultdict = None
+        self.ngram_keys = arrays["ngram_keys"]
+        self.ngram_counts = arrays["ngram_counts"]
+        self.ngram_cum_counts = arrays["ngram_cum_counts"]
+        self.context_keys = arrays["context_keys"]
+        self.context_counts = arrays["context_counts"]
+        token_bytes = arrays["token_bytes"].tobytes()
+        token_offsets = arrays["token_offsets"].tolist()
+        self.tokens = [token_bytes[start:end].decode('utf-8') for start,end in zip(token_offsets, token_offsets[1:])]
+        self.vocabulary = {token: token_id for token_id,token in enumerate(self.tokens)}
+        return self
+
+    def update(self, chunks):
+        """adds the ngrams of a stream of text chunks to the model, like Ngram_Language_Model.update().
+            the arrays can not grow in place, so the counts are unpacked to a string based model
+            (see to_model()), the chunks are counted there and the arrays are packed again. every
+            call costs a pass over the whole model, stream many chunks per call.
+
+            Args:
+                chunks (iterable): the text chunks (str) to add to the model.
+        """
+        lm = self.to_model()
+        lm.add_tokens(lm.stream_tokens(chunks))
+        self.from_model(lm)
+
+    def close(self):
+        """counts the text that waits for the next update() as the end of the text (see Ngram_Language_Model.close()).
+        """
+        if self.pending_token is not None or self.pending_text:
+            lm = self.to_model()
+            lm.count_pending()
+            self.from_model(lm)
+
+    def merge(self, other):
+        """adds the counts of another model to this model, as if the text of the other model
+            followed the text of this model (see Ngram_Language_Model.merge()). the counts are
+            merged on string based models and packed again.
+
+            Args:
+                other (Ngram_Language_Model): a model with the same n and chars, packed or not.
+
+            Returns:
+                The merged model (self).
+        """
+        lm = self.to_model()
+        lm.merge(other.to_model() if isinstance(other, Packed_Ngram_Language_Model) else other)
+        return self.from_model(lm)
+
+    def count_ngram_windows(self, ids, length, windows):
+        """Returns the sorted packed keys of the first windows of the specified length and their counts.
+
+            Args:
+                ids (np.array): the token ids of the text.
+                length (int): the length of the windows.
+                windows (int): the number of windows to count.
+
+            Returns:
+                tuple of np.array. (keys,counts)
+        """
+        if length == 0 or windows <= 0:
+            return np.zeros(0, dtype=key_dtype(length)), np.zeros(0, dtype=np.int64)
+        return sort_keys(sliding_window_view(ids, length)[:windows], np.ones(windows, dtype=np.int64))
+
+    def pack(self, ids, length, windows):
+        """Returns the packed keys of the first windows of the specified length.
+        """
+        return pack_ids(sliding_window_view(ids, length)[:windows])
+
+    def lookup(self, keys, counts, query):
+        """Returns the counts of the query keys (0 for keys that are not in the model).
+
+            Args:
+                keys (np.array): sorted keys of the model.
+                counts (np.array): counts parallel to the keys.
+                query (np.array): keys to look for.
+
+            Returns:
+                np.array. the counts of the query keys.
+        """
+        if keys.size == 0:
+            return np.zeros(len(query), dtype=np.int64)
+        index = np.minimum(np.searchsorted(keys, query), keys.size - 1)
+        return np.where(keys[index] == query, counts[index], 0)
+
+    def encode(self, words):
+        """Returns the token ids of the words and a mask of the out of vocabulary words.
+        """
+        ids = np.fromiter((self.vocabulary.get(word, -1) for word in words), dtype=np.int64, count=len(words))
+        oov = ids < 0
+        return np.where(oov, 0, ids), oov
+
+    def count(self, words, keys, counts):
+        """Returns the count of one ngram (or context) of the words, without the array
+            overhead of window_counts.
+        """
+        ids = []
+        for word in words:
+            token_id = self.vocabulary.get(word)
+            if token_id is None:
+                return 0
+            ids.append(token_id)
+        key = pack_ids(np.array([ids], dtype=np.int64))
+        index = int(keys.searchsorted(key)[0])
+        if index < keys.size and keys[index] == key[0]:
+            return int(counts[index])
+        return 0
+
+    def window_counts(self, words, length, keys, counts):
+        """Returns the counts of every window of the specified length in the words.
+        """
+        windows = len(words) - length + 1
+        if windows <= 0:
+            return np.zeros(0, dtype=np.int64)
+        ids, oov = self.encode(words)
+        found = self.lookup(keys, counts, self.pack(ids, length, windows))
+        #: a window with an out of vocabulary word is never in the model
+        oov_in_window = np.convolve(oov, np.ones(length, dtype=np.int64), mode='valid') > 0
+        found[oov_in_window] = 0
+        return found
+
+    def get_model(self):
+        """Returns the model as a dictionary of the form {ngram:count}
+            the dictionary is decoded from the arrays on the first call and kept until the model changes.
+        """
+        if self.model_defultdict is None:
+            self.model_defultdict = defaultdict(int)
+            self.model_defultdict.update(self.unpack(self.ngram_keys, self.ngram_counts, self.n_grams))
+        return self.model_defultdict
+
+    def get_probabilities(self):
+        """Returns the probability and the smoothed probability of every ngram of the model,
+            as a dictionary of the form {ngram:(probability, smoothed)} (see probability() and smooth()).
+            the context counts of all the ngrams are looked up at once (the probability of the last
+            ngram of the text is inf if its context is never followed by a word).
+        """
+        counts = self.ngram_counts
+        if self.n_grams > 1:
+            contexts = self.lookup(self.context_keys, self.context_counts,
+                                   pack_ids(key_ids(self.ngram_keys, self.n_grams)[:, :-1]))
+            with np.errstate(divide='ignore'):
+                probabilities = counts / contexts
+        else:
+            contexts = 0
+            probabilities = counts / self.total_words_in_corpos
+        smoothed = (counts + 1) / (contexts + self.ngram_keys.size)
+        return dict(zip(self.get_model(), zip(probabilities.tolist(), smoothed.tolist())))
+
+    def evaluate(self,text):
+        """Returns the log-likelihod of the specified text to be generated by the model.
+           Laplace smoothing should be applied if necessary.
+
+           Args:
+               text (str): Text to ebaluate.
+
+           Returns:
+               Float. The float should reflect the (log) probability.
+        """
+        if not isinstance(text, str): #: already tokenized
+            text = list(text)
+        elif self.split_by_char:
+            text = list(text)
+        else:
+            text = text.split(" ")
+
+        counts_n_gram = self.window_counts(text, self.n_grams, self.ngram_keys, self.ngram_counts).tolist()
+        if self.n_grams > 1:
+            counts_n_min_1_gram = self.window_counts(text[:-1], self.n_grams - 1, self.context_keys, self.context_counts).tolist()
+        else:
+            counts_n_min_1_gram = [0] * len(counts_n_gram)
+
+        smooth = False
+        likelihod = 1
+        for count_n_gram,count_n_min_1_gram in zip(counts_n_gram, counts_n_min_1_gram):
+            if count_n_gram == 0:
+                smooth = True
+
+            if smooth:
+                likelihod *= (count_n_gram + 1) / (count_n_min_1_gram + self.ngram_keys.size)
+            elif self.n_grams > 1:
+                likelihod *= (count_n_gram/count_n_min_1_gram)
+            else:
+                likelihod *= (count_n_gram/self.total_words_in_corpos)
+
+        return math.log(likelihod)
+
+    def evaluate_many(self, texts):
+        """Returns the log-likelihods of the specified texts, like evaluate() for each text.
+           the windows of a text are looked up together and summed in log space.
+
+           Args:
+               texts (iterable): Texts (str) to evaluate.
+
+           Returns:
+               np.array. The (log) probability of every text.
+        """
+        scores = []
+        for text in texts:
+            if not isinstance(text, str): #: already tokenized
+                text = list(text)
+            elif self.split_by_char:
+                text = list(text)
+            else:
+                text = text.split(" ")
+            
+            counts_n_gram = self.window_counts(text, self.n_grams, self.ngram_keys, self.ngram_counts)
+            if self.n_grams > 1:
+                counts_n_min_1_gram = self.window_counts(text[:-1], self.n_grams - 1, self.context_keys, self.context_counts)
+            else:
+                counts_n_min_1_gram = np.zeros(len(counts_n_gram), dtype=np.int64)
+            
+            #: every window from the first unseen ngram on is smoothed
+            unseen = np.flatnonzero(counts_n_gram == 0)
+            first_smoothed = unseen[0] if unseen.size else len(counts_n_gram)
+            seen = counts_n_gram[:first_smoothed]
+            if self.n_grams > 1:
+                probabilities = seen / counts_n_min_1_gram[:first_smoothed]
+            else:
+                probabilities = seen / self.total_words_in_corpos
+            smoothed = (counts_n_gram[first_smoothed:] + 1) / (counts_n_min_1_gram[first_smoothed:] + self.ngram_keys.size)
+            scores.append(np.log(probabilities).sum() + np.log(smoothed).sum())
+        return np.array(scores)
+
+    def probability(self, ngram):
+        """Returns the (not smoothed) probability of the specified ngram.
+
+            Args:
+                ngram (list): the ngram words.
+
+            Returns:
+                float. The probability, None if the ngram is not in the model.
+        """
+        count_n_gram = self.count(ngram, self.ngram_keys, self.ngram_counts)
+        if count_n_gram == 0:
+            return None
+        if self.n_grams > 1:
+            return count_n_gram / self.count(ngram[:-1], self.context_keys, self.context_counts)
+        return count_n_gram / self.total_words_in_corpos
+
+    def smooth(self, ngram):
+        """Returns the smoothed (Laplace) probability of the specified ngram.
+
+            Args:
+                ngram (list): the ngram to have it's probability smoothed
+
+            Returns:
+                float. The smoothed probability.
+        """
+        count_n_gram = self.count(ngram, self.ngram_keys, self.ngram_counts) + 1
+        if self.n_grams > 1:
+            count_n_min_1_gram = self.count(ngram[:-1], self.context_keys, self.context_counts)
+        else:
+            count_n_min_1_gram = 0
+        return count_n_gram / (count_n_min_1_gram + self.ngram_keys.size)
+
+    def build_next_token_index(self):
+        """the sorted keys are already grouped by context, nothing to build.
+        """
+
+    def search_next_phrase(self,phrase):
+        """append the next token to the phrase.
+
+            all the ngrams that start with the phrase context are one contiguous range of
+            the sorted keys, the next token is sampled from the cumulative counts of the range.
+            (a phrase shorter then n-1 tokens is completed with the token that follows it,
+            not like the string model that samples the last token of the ngram)
+
+            Args:
+                phrase (list): the phrase we need to check for calculate next phrase
+        """
+        phrase_part = phrase[-self.n_grams+1:]
+        ids = [self.vocabulary.get(word, -1) for word in phrase_part]
+        if -1 not in ids:
+            low,high = self.context_ranges(np.array([ids], dtype=np.int64).reshape(1, len(ids)))
+            if high[0] > low[0]: #: found next word
+                phrase.append(self.tokens[self.sample_key(low[0], high[0])[len(ids)]])
+                return
+
+        #: check if model exhausted by the idea of having only 1 oov in the begging of the context
+        phrase.extend(self.sample_ngram())
+        if len(phrase) > (self.n_grams -1):
+            self.generate_bool = False
+
+    def sample_key(self, low, high):
+        """Returns the token ids of a key sampled by its count from the keys in range [low,high).
+        """
+        before = int(self.ngram_cum_counts[low - 1]) if low > 0 else 0
+        point = before + random.random() * (int(self.ngram_cum_counts[high - 1]) - before)
+        index = np.searchsorted(self.ngram_cum_counts, point, side='right')
+        return key_ids(self.ngram_keys[index:index + 1], self.n_grams)[0].tolist()
+
+    def context_ranges(self, contexts):
+        """Returns the ranges [low,high) of the sorted ngram keys that start with every row of context ids.
+
+            Args:
+                contexts (np.array): the token ids of the contexts, one context per row.
+
+            Returns:
+                tuple of np.array. (low,high)
+        """
+        fill = self.n_grams - contexts.shape[1]
+        first = np.hstack([contexts, np.zeros((len(contexts), fill), dtype=np.int64)])
+        last = np.hstack([contexts, np.full((len(contexts), fill), KEY_ID_LIMIT - 1, dtype=np.int64)])
+        return (np.searchsorted(self.ngram_keys, pack_ids(first)),
+                np.searchsorted(self.ngram_keys, pack_ids(last), side='right'))
+
+    def sample_ngram(self):
+        """Returns the tokens of an ngram sampled from the model by its counts.
+        """
+        return [self.tokens[token_id] for token_id in self.sample_key(0, self.ngram_keys.size)]
+
+    def generate_batch(self, contexts, n=20, seed=None):
+        """Returns a generated string for every context, like generate() for each context.
+            the state of a sequence is the ids of its last n-1 tokens, all the ngrams
+            that follow it are one range of the sorted keys, so every step samples the next
+            token of all the sequences with searchsorted over the cumulative counts.
+            every sequence draws from its own random stream (spawned from seed).
+
+            Args:
+                contexts (list): the seed contexts (str), None to sample the context from the model.
+                n (int): the length of the strings to be generated.
+                seed (int): the seed of the random streams. Defaults to None
+
+            Return:
+                list. The generated texts.
+        """
+        uniforms = self.sequence_uniforms(len(contexts), n + 1, seed)
+        sequences = []
+        states = np.zeros((len(contexts), self.n_grams - 1), dtype=np.int64)
+        alive = np.zeros(len(contexts), dtype=bool)
+        sampled = [] #: sequences without a context start from a sampled ngram
+        for sequence_index,context in enumerate(contexts):
+            words = []
+            if context:
+                words = self.context_words(context)
+                ids = [self.vocabulary.get(word, -1) for word in words[len(words)-self.n_grams+1:]] if self.n_grams > 1 else []
+                if -1 not in ids and len(ids) == self.n_grams - 1:
+                    states[sequence_index] = ids
+                    alive[sequence_index] = True
+            elif self.ngram_keys.size:
+                sampled.append(sequence_index)
+            sequences.append(words)
+        if sampled:
+            points = (uniforms[sampled, 0] * int(self.ngram_cum_counts[-1])).astype(np.int64)
+            rows = key_ids(self.ngram_keys[np.searchsorted(self.ngram_cum_counts, points, side='right')], self.n_grams)
+            for sequence_index,row in zip(sampled, rows.tolist()):
+                sequences[sequence_index] = [self.tokens[token_id] for token_id in row]
+            states[sampled] = rows[:, 1:]
+            alive[sampled] = True
+        
+        lengths = np.array([len(words) for words in sequences], dtype=np.int64)
+        generated = np.full((len(contexts), n), -1, dtype=np.int64)
+        for step in range(n):
+            active = np.flatnonzero(alive & (lengths + step < n))
+            if active.size == 0:
+                break
+            low,high = self.context_ranges(states[active])
+            #: a context that is not in the model ends its sequence
+            alive[active[high == low]] = False
+            found = high > low
+            active,low,high = active[found],low[found],high[found]
+            before = np.where(low > 0, self.ngram_cum_counts[np.maximum(low - 1, 0)], 0)
+            points = before + (uniforms[active, step + 1] * (self.ngram_cum_counts[high - 1] - before)).astype(np.int64)
+            rows = key_ids(self.ngram_keys[np.searchsorted(self.ngram_cum_counts, points, side='right')], self.n_grams)
+            generated[active, step] = rows[:, -1]
+            states[active] = rows[:, 1:]
+        
+        return [self.join_words(words + [self.tokens[token_id] for token_id in row if token_id >= 0])
+                for words,row in zip(sequences, generated.tolist())]
+
+
+
+
+MODEL_FILE_MAGIC = b"NGRAMLM2\n"
+KEY_ID_DTYPE = np.dtype('>u4') #: big-endian, so the bytes of a packed key sort like its ids
+KEY_ID_LIMIT = 2 ** 32
+#: the tokens of normalize_text(text).split(" ") read straight from the text: a punctuation mark,
+#: or a run of plain characters that may hold single whitespace characters (not spaces) between them
+TOKEN_PATTERN = re.compile(r'[.,!?()]|(?:[^\s.,!?()]|(?<![\s.,!?()])[^\S ](?![\s.,!?()]))+')
+SPLITMIX64_GAMMA = 0x9E3779B97F4A7C15
+
+
+def splitmix64(values):
+    """Returns the SplitMix64 mix of an array of uint64 values.
+    """
+    values = values + np.uint64(SPLITMIX64_GAMMA)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def key_dtype(length):
+    """Returns the numpy dtype of the packed keys of ngrams of the specified length.
+    """
+    return np.dtype((np.void, KEY_ID_DTYPE.itemsize * max(length, 1)))
+
+
+def pack_ids(rows):
+    """Returns the packed keys of an array of token ids, one ngram per row.
+    """
+    rows = np.ascontiguousarray(rows, dtype=KEY_ID_DTYPE)
+    return rows.view(key_dtype(rows.shape[1])).reshape(len(rows))
+
+
+def key_ids(keys, length):
+    """Returns the token ids of packed keys of ngrams of the specified length, one ngram per row.
+    """
+    return np.ascontiguousarray(keys).view(KEY_ID_DTYPE).reshape(len(keys), length).astype(np.int64)
+
+
+def sort_keys(rows, counts):
+    """Returns the sorted packed keys of the distinct rows of token ids and the summed counts of every key.
+    """
+    order = np.lexsort(rows.T[::-1])
+    rows,counts = rows[order],counts[order]
+    starts = np.flatnonzero(np.concatenate(([True], np.any(rows[1:] != rows[:-1], axis=1))))
+    return pack_ids(rows[starts]), np.add.reduceat(counts, starts)
+
+
+def split_at_token_boundary(text):
+    """Returns the text split in two at the last space between two plain characters.
+       normalize_text works on each part alone as on the whole text, so the head can be
+       tokenized while the tail (maybe a cut word) waits for the next chunk.
+
+       Args:
+           text (str): the text to split
+
+       Returns:
+           tuple. (head,tail), head is empty if there is no such space.
+    """
+    index = text.rfind(" ")
+    while index > 0:
+        if index + 1 < len(text) and is_plain_char(text[index-1]) and is_plain_char(text[index+1]):
+            return text[:index+1],text[index+1:]
+        index = text.rfind(" ", 0, index)
+    return "",text
+
+
+def iter_tokens(chunks, chars=False):
+    """yields the tokens of a text (or a stream of text chunks) lazily in one pass.
+       the words are the same as normalize_text(text).split(" "), without building the
+       normalized text and the list of words.
+
+       Args:
+           chunks (str or iterable): the text or a stream of text chunks.
+           chars (bool): True to yield the characters of the text. Defaults to False
+    """
+    if isinstance(chunks, str):
+        chunks = [chunks]
+    if chars:
+        for chunk in chunks:
+            yield from chunk
+        return
+    
+    remainder = ""
+    started = False
+    for chunk in chunks:
+        text,remainder = split_at_token_boundary(remainder + chunk)
+        if text:
+            yield from text_tokens(text, first=not started)
+            started = True
+    yield from text_tokens(remainder, first=not started, last=True)
+
+
+def text_tokens(text, first=False, last=False):
+    """yields the tokens of a part of a text cut on token boundaries (see split_at_token_boundary).
+
+       Args:
+           text (str): the part of the text.
+           first (bool): True for the first part, the split leaves an empty token before a first space. Defaults to False
+           last (bool): True for the last part, the split leaves an empty token after a final space
+                        (and for an empty text). Defaults to False
+    """
+    if first and normalize_text(text[:2]).startswith(" "):
+        yield ""
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        yield match.group()
+    if last and (not text or normalize_text(text[-2:]).endswith(" ")):
+        yield ""
+
+
+def drop_last(tokens):
+    """yields all the tokens but the last one.
+    """
+    tokens = iter(tokens)
+    previous = next(tokens, None)
+    for token in tokens:
+        yield previous
+        previous = token
+
+
+def is_plain_char(char):
+    """Returns True iff normalize_text does not pad or collapse the char.
+    """
+    return not char.isspace() and char not in ".,!?()"
+
+
+def count_shard(shard):
+    """Returns the ngram and (n-1)-gram Counters of one shard of a parallel build_model, not pruned.
+
+       Args:
+           shard (tuple): (n, join note, the words before the shard, the words of the shard)
+
+       Returns:
+           tuple. (ngram Counter, (n-1)-gram Counter)
+    """
+    n,join_note,carry,words = shard
+    lm = Ngram_Language_Model(n)
+    lm.join_note = join_note
+    lm.count_windows(carry + words, len(carry))
+    return lm.model,lm.model_n_min_1
+
+
+def read_text_chunks(paths, chunk_size=1 << 20):
+    """yields the text of the files chunk_size characters at a time, with a space between
+       two files so the last word of a file and the first word of the next one stay apart.
+
+       Args:
+           paths (iterable): the files to read.
+           chunk_size (int): the number of characters per chunk.
+    """
+    for index,path in enumerate(paths):
+        if index:
+            yield " "
+        with open(path, 'r') as f:
+            chunk = f.read(chunk_size)
+            while chunk:
+                yield chunk
+                chunk = f.read(chunk_size)
+
+
             
             
 def normalize_text(text):
@@ -0,0 +1,224 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import timeit
+import tracemalloc
+import ex1
+
+corpus_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ex_2', 'test_corpus.txt')
+with open(corpus_path, 'r') as f:
+    corpus = f.read()
+
+
+def benchmark_generate(n=3, chars=False, fractions=(0.125, 0.25, 0.5, 1), tokens=2000):
+    """print the generated tokens/sec of the model for growing prefixes of the corpus.
+    """
+    for fraction in fractions:
+        lm = ex1.Ngram_Language_Model(n=n, chars=chars)
+        lm.build_model(corpus[:int(len(corpus) * fraction)])
+        generated = 0
+        start = timeit.default_timer()
+        while generated < tokens:
+            lm.generate_bool = True
+            generated_text = lm.generate(n=50)
+            generated += len(generated_text) if chars else len(generated_text.split(" "))
+        stop = timeit.default_timer()
+        print('n=%d chars=%s model size=%d | %.0f tokens/sec' % (n, chars, len(lm.model), generated / (stop - start)))
+
+
+def benchmark_memory(n=3, chars=False, copies=4):
+    """print the memory held by the string model and the packed model after build_model.
+    """
+    for model_class in (ex1.Ngram_Language_Model, ex1.Packed_Ngram_Language_Model):
+        tracemalloc.start()
+        lm = model_class(n=n, chars=chars)
+        lm.build_model(corpus * copies)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('%s n=%d chars=%s | %d KB held, %d KB peak' % (model_class.__name__, n, chars, current // 1024, peak // 1024))
+
+
+def benchmark_parallel_build(n=3, chars=False, copies=8):
+    """print the build_model time and the speedup over one worker for growing worker counts.
+    """
+    text = corpus * copies
+    workers_counts = sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+    base_time = None
+    for workers in workers_counts:
+        lm = ex1.Ngram_Language_Model(n=n, chars=chars)
+        start = timeit.default_timer()
+        lm.build_model(text, workers=workers)
+        build_time = timeit.default_timer() - start
+        base_time = base_time or build_time
+        print('build_model n=%d chars=%s workers=%d | %.2f sec, speedup %.2fx' % (n, chars, workers, build_time, base_time / build_time))
+
+
+def benchmark_evaluate_many(n=3, texts_count=5000, window=7):
+    """print texts/sec of evaluate() called per text against one evaluate_many() call.
+        the texts are short windows of the corpus, like the windows spell_check scores.
+    """
+    lm = ex1.Ngram_Language_Model(n=n)
+    lm.build_model(corpus)
+    words = ex1.normalize_text(corpus).split(" ")
+    random.seed(0)
+    starts = [random.randrange(len(words) - window) for _ in range(texts_count // 10)]
+    texts = [" ".join(words[start:start + window]) for start in starts] * 10
+
+    start = timeit.default_timer()
+    for text in texts:
+        lm.evaluate(text)
+    per_call_time = timeit.default_timer() - start
+    start = timeit.default_timer()
+    lm.evaluate_many(texts)
+    batch_time = timeit.default_timer() - start
+    print('evaluate n=%d | %.0f texts/sec per call, %.0f texts/sec evaluate_many' % (n, len(texts) / per_call_time, len(texts) / batch_time))
+
+
+def benchmark_load(n=3, chars=False, copies=8):
+    """print the time to build the packed model from text against loading its saved file.
+    """
+    lm = ex1.Packed_Ngram_Language_Model(n=n, chars=chars)
+    start = timeit.default_timer()
+    lm.build_model(corpus * copies)
+    build_time = timeit.default_timer() - start
+    path = os.path.join(tempfile.mkdtemp(), 'model.lm')
+    lm.save(path)
+    for mmap in (True, False):
+        start = timeit.default_timer()
+        ex1.Packed_Ngram_Language_Model().load(path, mmap=mmap)
+        load_time = timeit.default_timer() - start
+        print('n=%d chars=%s %d bytes | build %.1f ms, load (mmap=%s) %.1f ms' % (n, chars, os.path.getsize(path), build_time * 1000, mmap, load_time * 1000))
+    os.remove(path)
+
+
+def benchmark_generate_batch(n=3, chars=False, sequences=5000, length=20):
+    """print sequences/sec of generate() called per sequence against one generate_batch() call.
+    """
+    for model_class in (ex1.Ngram_Language_Model, ex1.Packed_Ngram_Language_Model):
+        lm = model_class(n=n, chars=chars)
+        lm.build_model(corpus)
+        lm.generate_batch([None], n=length, seed=0) #: builds the generation arrays
+        start = timeit.default_timer()
+        for _ in range(sequences // 10):
+            lm.generate_bool = True
+            lm.generate(n=length)
+        per_call_time = (timeit.default_timer() - start) * 10
+        start = timeit.default_timer()
+        lm.generate_batch([None] * sequences, n=length, seed=0)
+        batch_time = timeit.default_timer() - start
+        print('%s n=%d chars=%s | %.0f sequences/sec per call, %.0f sequences/sec generate_batch' % (model_class.__name__, n, chars, sequences / per_call_time, sequences / batch_time))
+
+
+def measure(operation):
+    """Returns (seconds, peak bytes, result) of one call to operation.
+        the time is taken on a plain run and the peak memory on a second run under tracemalloc.
+    """
+    start = timeit.default_timer()
+    result = operation()
+    seconds = timeit.default_timer() - start
+    tracemalloc.start()
+    operation()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+def sample_texts(text, chars, count=500, length=10):
+    """Returns count random windows of the text, length tokens each.
+    """
+    random.seed(0)
+    if chars:
+        starts = [random.randrange(max(len(text) - length, 1)) for _ in range(count)]
+        return [text[start:start + length] for start in starts]
+    words = ex1.normalize_text(text).split(" ")
+    starts = [random.randrange(max(len(words) - length, 1)) for _ in range(count)]
+    return [" ".join(words[start:start + length]) for start in starts]
+
+
+def run_suite(fractions=(0.25, 0.5, 1), orders=(1, 2, 3, 4, 5), model_classes=(ex1.Ngram_Language_Model, ex1.Packed_Ngram_Language_Model),
+              generated_tokens=1000, output=None):
+    """measures build_model, evaluate, generate and get_model for every model class, n,
+        word and char mode and growing prefixes of the corpus. every measure is printed and
+        appended as one json line to output (if set), so runs can be compared over time
+        ("run" is the start time of the run). "tokens" is the number of tokens the operation
+        handled (ngrams for get_model), "tokens_per_sec" is None if the timer measured 0 seconds.
+
+        Returns:
+            list. the records of the measures.
+    """
+    records = []
+    run = time.strftime('%Y-%m-%dT%H:%M:%S')
+    out = open(output, 'a') if output else None
+    for model_class in model_classes:
+        for chars in (False, True):
+            for n in orders:
+                for fraction in fractions:
+                    text = corpus[:int(len(corpus) * fraction)]
+                    texts = sample_texts(text, chars)
+                    lm = model_class(n=n, chars=chars)
+
+                    def build():
+                        model = model_class(n=n, chars=chars)
+                        model.build_model(text)
+                        return model.total_words_in_corpos
+                    measures = [("build_model", build)]
+
+                    def evaluate():
+                        for sample in texts:
+                            lm.evaluate(sample)
+                        return sum(len(sample) if chars else len(sample.split(" ")) for sample in texts)
+                    measures.append(("evaluate", evaluate))
+
+                    def generate():
+                        random.seed(0)
+                        generated = 0
+                        while generated < generated_tokens:
+                            lm.generate_bool = True
+                            generated_text = lm.generate(n=50)
+                            generated += len(generated_text) if chars else len(generated_text.split(" "))
+                        return generated
+                    measures.append(("generate", generate))
+                    measures.append(("get_model", lambda: len(lm.get_model())))
+
+                    try:
+                        lm.build_model(text)
+                    except ValueError as error: #: the packed model can not hold more then 2**32 tokens
+                        print('%s n=%d chars=%s corpus=%d | skipped: %s' % (model_class.__name__, n, chars, len(text), error))
+                        continue
+                    for operation,function in measures:
+                        seconds, peak, tokens = measure(function)
+                        record = {"run": run, "model": model_class.__name__, "operation": operation, "n": n, "chars": chars,
+                                  "corpus_chars": len(text), "model_size": len(lm.get_model()), "tokens": tokens,
+                                  "seconds": seconds, "tokens_per_sec": tokens / seconds if seconds else None,
+                                  "peak_kb": peak // 1024}
+                        records.append(record)
+                        speed = '%.0f tokens/sec' % record["tokens_per_sec"] if seconds else 'too fast to time'
+                        print('%s %s n=%d chars=%s corpus=%d | %.4f sec, %s, %d KB peak' % (record["model"], operation, n, chars, len(text), seconds, speed, record["peak_kb"]))
+                        if out:
+                            out.write(json.dumps(record) + "\n")
+                            out.flush()
+    if out:
+        out.close()
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmarks of the n-gram language model')
+    parser.add_argument('--suite', action='store_true', help='run the full suite (all operations, n=1..5, word and char mode)')
+    parser.add_argument('--output', help='json lines file the suite records are appended to')
+    args = parser.parse_args()
+    if args.suite:
+        run_suite(output=args.output)
+        raise SystemExit
+    benchmark_generate(n=3)
+    benchmark_generate(n=4, chars=True)
+    benchmark_memory(n=3)
+    benchmark_memory(n=4, chars=True)
+    benchmark_parallel_build(n=3)
+    benchmark_evaluate_many(n=3)
+    benchmark_load(n=3)
+    benchmark_generate_batch(n=3)
@@ -0,0 +1,246 @@
+import os
+import math
+import tempfile
+import ex1
+
+
+def test_build_model_twice():
+    """building a model again gives the model of the last text only, like a new model.
+    """
+    for n in (1, 2, 3):
+        lm = ex1.Ngram_Language_Model(n=n)
+        lm.build_model('a b c . ')
+        lm.build_model('x y z . ')
+        new_lm = ex1.Ngram_Language_Model(n=n)
+        new_lm.build_model('x y z . ')
+        assert dict(lm.get_model()) == dict(new_lm.get_model())
+        assert lm.model_n_min_1 == new_lm.model_n_min_1
+        assert lm.total_words_in_corpos == new_lm.total_words_in_corpos
+        assert lm.head == new_lm.head
+        assert lm.carry == new_lm.carry
+        assert lm.evaluate('x y z') == new_lm.evaluate('x y z')
+
+
+def test_update_after_build_model():
+    """update() keeps adding to the counts of build_model.
+    """
+    lm = ex1.Ngram_Language_Model(n=1)
+    lm.build_model('a b c . ')
+    lm.update(['x y z . '])
+    lm.close()
+    assert lm.total_words_in_corpos == 8
+    assert lm.get_model()['.'] == 2
+
+
+def test_update_word_cut_between_calls():
+    """a word cut between two update() calls is counted once, whole.
+    """
+    for model_class in (ex1.Ngram_Language_Model, ex1.Packed_Ngram_Language_Model):
+        lm = model_class(n=2)
+        lm.update(['the quick bro'])
+        lm.update(['wn fox jumps . '])
+        lm.close()
+        new_lm = model_class(n=2)
+        new_lm.build_model('the quick brown fox jumps . ')
+        assert dict(lm.get_model()) == dict(new_lm.get_model())
+        assert lm.total_words_in_corpos == new_lm.total_words_in_corpos
+
+        lm = model_class(n=2)
+        lm.update(['a b c'])
+        lm.update([' d e f . '])
+        lm.close()
+        new_lm = model_class(n=2)
+        new_lm.build_model('a b c d e f . ')
+        assert dict(lm.get_model()) == dict(new_lm.get_model())
+
+
+def test_update_from_files():
+    """the last word of a file and the first word of the next file are two words.
+    """
+    directory = tempfile.mkdtemp()
+    paths = []
+    for index,text in enumerate(['a b c', 'd e f . ']):
+        paths.append(os.path.join(directory, '%d.txt' % index))
+        with open(paths[-1], 'w') as f:
+            f.write(text)
+    for n in (1, 2, 3):
+        lm = ex1.Ngram_Language_Model(n=n)
+        lm.update_from_files(paths, chunk_size=2)
+        lm.close()
+        new_lm = ex1.Ngram_Language_Model(n=n)
+        new_lm.build_model('a b c d e f . ')
+        assert dict(lm.get_model()) == dict(new_lm.get_model())
+
+
+def test_merge():
+    """merging the models of two halves of a text (cut between two words) gives the model of the text.
+    """
+    text = 'the quick brown fox jumps over the lazy dog . the dog sleeps . '
+    for model_class in (ex1.Ngram_Language_Model, ex1.Packed_Ngram_Language_Model):
+        for n in (1, 2, 3):
+            lm = model_class(n=n)
+            lm.update(['the quick bro', 'wn fox jumps '])
+            other = model_class(n=n)
+            other.update(['over the lazy dog . the d', 'og sleeps . '])
+            lm.merge(other)
+            lm.close()
+            new_lm = model_class(n=n)
+            new_lm.build_model(text)
+            assert dict(lm.get_model()) == dict(new_lm.get_model())
+            assert lm.total_words_in_corpos == new_lm.total_words_in_corpos
+            assert lm.evaluate('the lazy dog') == new_lm.evaluate('the lazy dog')
+
+
+def test_parallel_pruning_does_not_depend_on_workers():
+    """the summed shard counts are pruned once, so every worker count gives the same pruned model.
+    """
+    text = ' '.join('w%d w%d . ' % (i % 7, i % 5) for i in range(400))
+    for limits in ({'min_count': 3}, {'max_entries': 20}):
+        models = []
+        for workers in (1, 2, 3, 5):
+            lm = ex1.Ngram_Language_Model(n=2, **limits)
+            lm.build_model(text, workers=workers)
+            models.append((dict(lm.get_model()), dict(lm.model_n_min_1)))
+        #: one process prunes max_entries while counting too
+        parallel_models = models[1:] if 'max_entries' in limits else models
+        assert all(model == parallel_models[0] for model in parallel_models)
+
+
+def test_get_probabilities():
+    """get_probabilities() gives the probability() and smooth() of every ngram of the model.
+    """
+    text = 'the quick brown fox jumps over the lazy dog . the dog sleeps . '
+    for model_class in (ex1.Ngram_Language_Model, ex1.Packed_Ngram_Language_Model):
+        for n in (1, 2, 3):
+            lm = model_class(n=n)
+            lm.build_model(text)
+            probabilities = lm.get_probabilities()
+            assert set(probabilities) == set(lm.get_model())
+            for key,(probability,smoothed) in probabilities.items():
+                assert smoothed == lm.smooth(key.split(lm.join_note))
+                if probability == math.inf: #: the context of the last ngram of the text, probability() divides by 0
+                    assert key == 'dog sleeps .'[-len(key):]
+                    continue
+                assert probability == lm.probability(key.split(lm.join_note))
+
+
+#: evaluate() of the model of TEXT before the packed, streaming and parallel builds, for n = 1, 2, 3
+TEXT = 'the quick brown fox jumps over the lazy dog . the dog sleeps . '
+OLD_EVALUATE = {1: {'the lazy dog': -6.125412519617721, 'the dog jumps': -6.125412519617721, 'a cat': -4.605170185988091},
+                2: {'the lazy dog': -1.0986122886681098, 'the dog jumps': -3.80666248977032, 'a cat': -2.5649493574615367},
+                3: {'the lazy dog': 0.0, 'the dog jumps': -2.5649493574615367, 'a cat': 0.0}}
+OLD_MODEL_SIZE = {1: 10, 2: 13, 3: 12}
+
+
+def built_models(n):
+    """Returns models of TEXT built by every way of building one.
+    """
+    lm = ex1.Ngram_Language_Model(n=n)
+    lm.build_model(TEXT)
+    packed_lm = ex1.Packed_Ngram_Language_Model(n=n)
+    packed_lm.build_model(TEXT)
+    parallel_lm = ex1.Ngram_Language_Model(n=n)
+    parallel_lm.build_model(TEXT, workers=2)
+    streamed_lm = ex1.Ngram_Language_Model(n=n)
+    streamed_lm.update(['the quick bro', 'wn fox jumps over the lazy dog . the dog sleeps . '])
+    streamed_lm.close()
+    streamed_packed_lm = ex1.Packed_Ngram_Language_Model(n=n)
+    streamed_packed_lm.update(['the quick brown fox jumps over the la', 'zy dog . the dog sleeps . '])
+    streamed_packed_lm.close()
+    return [lm, packed_lm, parallel_lm, streamed_lm, streamed_packed_lm]
+
+
+def test_built_models_match_old_model():
+    """the packed, parallel and streaming builds count and evaluate like the model did before them.
+    """
+    for n in (1, 2, 3):
+        models = built_models(n)
+        for lm in models:
+            assert dict(lm.get_model()) == dict(models[0].get_model())
+            assert len(lm.get_model()) == OLD_MODEL_SIZE[n]
+            assert lm.total_words_in_corpos == 14
+            for text,score in OLD_EVALUATE[n].items():
+                assert lm.evaluate(text) == score
+
+
+def test_evaluate_many():
+    """evaluate_many() gives the old evaluate() of every text (up to the rounding of the log sum).
+    """
+    for n in (1, 2, 3):
+        for lm in built_models(n)[:2]:
+            scores = lm.evaluate_many(list(OLD_EVALUATE[n]))
+            assert all(math.isclose(score, old_score, abs_tol=1e-12)
+                       for score,old_score in zip(scores, OLD_EVALUATE[n].values()))
+
+
+def test_save_and_load():
+    """a saved packed model loads (memory mapped or not) to the same counts and scores.
+    """
+    path = os.path.join(tempfile.mkdtemp(), 'model.npz')
+    for n in (1, 2, 3):
+        lm = built_models(n)[1]
+        lm.save(path)
+        for mmap in (True, False):
+            loaded_lm = ex1.Packed_Ngram_Language_Model(n=n)
+            loaded_lm.load(path, mmap=mmap)
+            assert dict(loaded_lm.get_model()) == dict(lm.get_model())
+            for text,score in OLD_EVALUATE[n].items():
+                assert loaded_lm.evaluate(text) == score
+
+
+def test_generate_batch():
+    """a text with a single next word for every context is generated like the old generate() did,
+        and a seed gives the same batch again.
+    """
+    for model_class in (ex1.Ngram_Language_Model, ex1.Packed_Ngram_Language_Model):
+        for n in (2, 3):
+            lm = model_class(n=n)
+            lm.build_model('a b c d e f g h . ')
+            assert lm.generate('a b', n=6) == 'a b c d e f'
+            assert lm.generate_batch(['a b', 'c d'], n=6, seed=1) == ['a b c d e f', 'c d e f g h']
+        lm = model_class(n=2)
+        lm.build_model(TEXT)
+        batch = lm.generate_batch([None, 'the', 'the dog'], n=8, seed=7)
+        assert batch == lm.generate_batch([None, 'the', 'the dog'], n=8, seed=7)
+        for text in batch:
+            words = text.split()
+            assert all(lm.get_model()[' '.join(words[i:i + 2])] for i in range(len(words) - 1))
+
+
+def test_caches_follow_the_model():
+    """the cached model dictionary, lower order models and next token index are built again for a new text.
+    """
+    for model_class in (ex1.Ngram_Language_Model, ex1.Packed_Ngram_Language_Model):
+        lm = model_class(n=3)
+        lm.build_model(TEXT)
+        assert lm.get_model()['the lazy dog'] == 1
+        unigram_lm = lm.lower_order_model(1)
+        #: the old unigram fallback of the spell checker, built on the text of all the ngrams
+        #: (with a space after the last word, a word cut at the end of a text is not counted)
+        old_unigram_lm = ex1.Ngram_Language_Model(n=1)
+        old_unigram_lm.build_model(' '.join(key for key,count in lm.get_model().items() for _ in range(count)) + ' ')
+        assert dict(unigram_lm.get_model()) == dict(old_unigram_lm.get_model())
+        assert lm.lower_order_model(1) is unigram_lm
+        assert lm.generate('the lazy', n=4) == 'the lazy dog .'
+        lm.build_model('a b c d e f g h . ')
+        assert 'the lazy dog' not in lm.get_model()
+        assert lm.lower_order_model(1) is not unigram_lm
+        assert set(lm.lower_order_model(1).get_model()) == set('abcdefgh.')
+        assert lm.generate('a b', n=4) == 'a b c d'
+        assert set(lm.get_probabilities()) == set(lm.get_model())
+
+
+if __name__ == '__main__':
+    test_build_model_twice()
+    test_update_after_build_model()
+    test_update_word_cut_between_calls()
+    test_update_from_files()
+    test_merge()
+    test_parallel_pruning_does_not_depend_on_workers()
+    test_get_probabilities()
+    test_built_models_match_old_model()
+    test_evaluate_many()
+    test_save_and_load()
+    test_generate_batch()
+    test_caches_follow_the_model()
+    print('ok')
@@ -1,21 +1,31 @@
 import re
-from collections import Counter,defaultdict,namedtuple
+import sys
+import json
+from collections import Counter,defaultdict,namedtuple,OrderedDict
 from collections import deque
+from itertools import accumulate,islice
+from bisect import bisect_left
 import random
 import math
-import operator
+import multiprocessing
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import timeit
 class Ngram_Language_Model:
     """The class implements a Markov Language Model that learns amodel from a given text.
         It supoprts language generation and the evaluation of a given string.
         The class can be applied on both word level and caracter level.
     """
 
-    def __init__(self, n=3, chars=False):
+    def __init__(self, n=3, chars=False, min_count=1, max_entries=None, max_bytes=None):
         """Initializing a language model object.
         Arges:
             n (int): the length of the markov unit (the n of the n-gram). Defaults to 3.
             chars (bool): True iff the model consists of ngrams of characters rather then word tokens.
                           Defaults to False
+            min_count (int): ngrams counted less then min_count times are pruned from the model. Defaults to 1
+            max_entries (int): the maximal number of ngrams kept in the model. Defaults to None (no limit)
+            max_bytes (int): a memory budget for the count tables. Defaults to None (no limit)
         """
         self.n_grams = n
         self.split_by_char = chars
@@ -27,39 +37,50 @@ class Ngram_Language_Model:
         # self.special_word = "<S>"
         self.oov = True
         self.generate_bool = True
-    def build_model(self, text):  #should be called build_model
+        self.next_token_index = {}
+        self.ngram_distribution = ([],[])
+        self.short_context_index = {} #: seed shorter then n-1 -> next tokens, see short_context_distribution()
+        self.sorted_keys = None #: (keys, model order), built on the first short seed
+        self.head = [] #: first n words, for merge
+        self.carry = [] #: last n words, carried to the next chunk
+        self.pending_text = "" #: the text after the last token boundary, waits for the next chunk
+        self.pending_token = None #: the last token read, counted once a token follows it
+        self.text_started = False #: True once the first token of the text was read
+        self.min_count = min_count
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.prune_interval = 100000 #: windows counted between two checks of the limits
+        self.generation_arrays = None #: built on the first generate_batch
+        self.lower_order_models = {} #: n -> model derived from the counts, see lower_order_model()
+    def build_model(self, text, workers=1):  #should be called build_model
         """populates a dictionary counting all ngrams in the specified text.
         
             Args:
                 text (str): the text to construct the model from.
+                workers (int): the number of processes counting the ngrams. Defaults to 1.
         """
    
         
-        if self.split_by_char:
-            list_of_words = list(text)
-            self.join_note = "#@"
-        else:
-            list_of_words = normalize_text(text).split(" ")
-            list_of_words = list_of_words[:-1]
-        
+        #: a new model of the text, update() is the one that adds to the counts
+        self.model = Counter()
+        self.model_n_min_1 = Counter()
+        self.total_words_in_corpos = 0
+        self.head = []
+        self.carry = []
+        self.pending_text = ""
+        self.pending_token = None
         
-               
-        self.total_words_in_corpos = len(list_of_words) #: for normalization
+        #: the tokens are read lazily from the text, only the parallel mode needs them all
+        tokens = self.corpus_tokens(text)
         
         #: add <s> in the begging for calculate window easy
         # self.add_special_char(list_of_words)
         
-        if self.n_grams == 1: #: easy case uni-gram
-            self.model = Counter(list_of_words)
+        if workers > 1:
+            self.count_parallel(list(tokens), workers)
         else:
-            for first_window_index in range(len(list_of_words) - self.n_grams+1):
-                word_window = list_of_words[first_window_index:first_window_index+self.n_grams]
-                string_window = self.join_note.join(word_window)
-                self.model[string_window] += 1
-            for first_window_index in range(len(list_of_words) - (self.n_grams)):
-                word_window = list_of_words[first_window_index:first_window_index+(self.n_grams-1)]
-                string_window = self.join_note.join(word_window)
-                self.model_n_min_1[string_window] += 1
+            self.add_tokens(tokens)
+        self.text_started = self.total_words_in_corpos > 0
         
         
         
@@ -70,21 +91,376 @@ class Ngram_Language_Model:
         #     if self.special_word not in key:
         #         self.model_without_special_word[key] = value
         
-        self.model_defultdict = counter_to_defultdict(self.model)
-        self.sorted_model = dict(self.model.most_common())
+        self.finish_model()
 
+    def update(self, chunks):
+        """adds the ngrams of a stream of text chunks to the model.
             
-                
+            the chunks are normalized and counted one at a time. the text after the last
+            token boundary (maybe a cut word) and the last token wait for the next chunk,
+            also of the next update() call, and the last n words are carried over, so no
+            word or window is lost on a boundary. close() counts what waits at the end of
+            the text. on a new model update(chunks) and close() count the same ngrams as
+            build_model("".join(chunks)).
+            
+            Args:
+                chunks (iterable): the text chunks (str) to add to the model.
+        """
+        self.add_tokens(self.stream_tokens(chunks))
+        self.finish_model()
+
+    def close(self):
+        """counts the text that waits for the next update() as the end of the text.
+            like build_model the last token (the empty token after a final space) is not counted.
+        """
+        self.count_pending()
+        self.finish_model()
+
+    def stream_tokens(self, chunks):
+        """Returns a generator of the tokens of the chunks that are known to be complete,
+            all the tokens before the last token boundary but the last one. the rest waits
+            in pending_text and pending_token.
+
+            Args:
+                chunks (str or iterable): the text or a stream of text chunks.
+        """
+        if isinstance(chunks, str):
+            chunks = [chunks]
+        if self.split_by_char:
+            self.join_note = "#@"
+            for chunk in chunks:
+                yield from chunk
+            return
+        for chunk in chunks:
+            text,self.pending_text = split_at_token_boundary(self.pending_text + chunk)
+            if not text:
+                continue
+            first = not self.text_started
+            self.text_started = True
+            for token in text_tokens(text, first=first):
+                if self.pending_token is not None:
+                    yield self.pending_token
+                self.pending_token = token
+
+    def count_pending(self):
+        """counts the pending token and text as the end of the text, without the last token.
+        """
+        tokens = [] if self.pending_token is None else [self.pending_token]
+        if not self.split_by_char:
+            tokens.extend(text_tokens(self.pending_text, first=not self.text_started, last=True))
+        self.add_tokens(tokens[:-1])
+        self.pending_text = ""
+        self.pending_token = None
+        self.text_started = self.total_words_in_corpos > 0
+
+    def corpus_tokens(self, chunks):
+        """Returns a generator of the tokens that build_model counts in the text:
+            the characters in char mode, else the normalized words without the last
+            one (the empty token after the final space of normalize_text).
+
+            Args:
+                chunks (str or iterable): the text or a stream of text chunks.
+        """
+        if self.split_by_char:
+            self.join_note = "#@"
+            return iter_tokens(chunks, chars=True)
+        return drop_last(iter_tokens(chunks))
+
+    def add_tokens(self, tokens, block_size=10000):
+        """counts a stream of tokens block_size tokens at a time.
+
+            Args:
+                tokens (iterable): the next tokens of the text.
+                block_size (int): the number of tokens counted together.
+        """
+        tokens = iter(tokens)
+        block = list(islice(tokens, block_size))
+        while block:
+            self.add_words(block)
+            block = list(islice(tokens, block_size))
+
+    def update_from_files(self, paths, chunk_size=1 << 20):
+        """adds the ngrams of the specified files to the model, reading chunk_size characters at a time.
+            the last words of the files wait for the next update() or close() like the end of any chunk.
+
+            Args:
+                paths (iterable): the text files to add to the model, read as one stream (a file ends a word).
+                chunk_size (int): the number of characters read per chunk.
+        """
+        self.update(read_text_chunks(paths, chunk_size))
+
+    def merge(self, other):
+        """adds the counts of another partially built model to this model, as if
+            the text of the other model followed the text of this model. the texts meet on
+            a token boundary: the text that waits in this model is counted as the end of
+            its text first, the windows that cross the boundary are counted from the
+            carried words of both models, and the text that waits in the other model
+            waits in the merged model.
+
+            Args:
+                other (Ngram_Language_Model): a model with the same n and chars.
+
+            Returns:
+                The merged model (self).
+        """
+        if other.n_grams != self.n_grams or other.split_by_char != self.split_by_char:
+            raise ValueError("can only merge models with the same n and chars")
+        self.join_note = other.join_note
+        self.count_pending()
         
+        window = self.carry + other.head
+        self.count_windows(window, len(self.carry), boundary=len(self.carry))
+        self.model.update(other.model)
+        self.model_n_min_1.update(other.model_n_min_1)
+        self.total_words_in_corpos += other.total_words_in_corpos
+        self.head = (self.head + other.head)[:self.n_grams]
+        self.carry = (self.carry + other.carry)[-self.n_grams:]
+        self.pending_text = other.pending_text
+        self.pending_token = other.pending_token
+        self.text_started = self.text_started or other.text_started
+        self.finish_model()
+        return self
+
+    def add_words(self, words):
+        """counts the windows that end in the specified words, continuing the carried words.
+
+            Args:
+                words (list): the next words of the text.
+        """
+        self.count_windows(self.carry + words, len(self.carry))
+        self.track_words(words)
+
+    def track_words(self, words):
+        """updates the head, the carried words and the number of words after counting words.
+        """
+        if len(self.head) < self.n_grams:
+            self.head = (self.head + words)[:self.n_grams]
+        self.carry = (self.carry + words[-self.n_grams:])[-self.n_grams:]
+        self.total_words_in_corpos += len(words)
+
+    def count_windows(self, words, start, boundary=None):
+        """counts the ngrams and (n-1)-grams of the words that end at index start or later.
+            like build_model the (n-1)-gram of a window is counted only if a word follows the window.
+
+            Args:
+                words (list): the words, words[:start] were already counted.
+                start (int): the index of the first new word.
+                boundary (int): if set, count only the windows that start before this index
+                                (the windows that the two sides of a merge could not count).
+        """
+        if self.n_grams == 1 and boundary is None: #: easy case uni-gram
+            self.model.update(words[start:])
+            self.prune_to_limits()
+            return
+        step = self.prune_interval if self.is_pruning() else max(len(words), 1)
+        for block_start in range(start, len(words), step):
+            for end in range(block_start, min(block_start + step, len(words))):
+                if end >= self.n_grams - 1 and (boundary is None or end - boundary < self.n_grams - 1):
+                    self.model[self.join_note.join(words[end-self.n_grams+1:end+1])] += 1
+                if self.n_grams > 1 and end >= self.n_grams and (boundary is None or end - boundary < self.n_grams):
+                    self.model_n_min_1[self.join_note.join(words[end-self.n_grams:end-1])] += 1
+            self.prune_to_limits()
+
+    def count_parallel(self, list_of_words, workers):
+        """counts the ngrams of the words with a pool of processes.
+            the words are cut to one shard per worker, every shard gets the n words before
+            it so the windows that cross a shard boundary are counted exactly once, and the
+            Counters of the shards are summed into the model. the shards are not pruned, in
+            pruning mode finish_model prunes the summed counts once, so the model does not
+            depend on the number of workers.
+
+            Args:
+                list_of_words (list): the words of the text.
+                workers (int): the number of processes.
+        """
+        shard_size = max(1, -(-len(list_of_words) // workers))
+        shards = []
+        for start in range(0, len(list_of_words), shard_size):
+            carry = (self.carry + list_of_words[:start])[-self.n_grams:]
+            shards.append((self.n_grams, self.join_note, carry, list_of_words[start:start + shard_size]))
         
-            
-            
+        with multiprocessing.Pool(workers) as pool:
+            for model,model_n_min_1 in pool.imap(count_shard, shards):
+                self.model.update(model)
+                self.model_n_min_1.update(model_n_min_1)
+        self.track_words(list_of_words)
+
+    def is_pruning(self):
+        """Returns True iff the model is built in pruning mode.
+        """
+        return self.min_count > 1 or self.max_entries is not None or self.max_bytes is not None
+
+    def table_bytes(self):
+        """Returns the estimated memory of the count tables, the dicts and the average
+            size of (a sample of) the keys and counts.
+        """
+        size = 0
+        for table in (self.model, self.model_n_min_1):
+            size += sys.getsizeof(table)
+            sample = list(islice(table.items(), 100))
+            if sample:
+                entry_size = sum(sys.getsizeof(key) + sys.getsizeof(value) for key,value in sample) / len(sample)
+                size += int(len(table) * entry_size)
+        return size
+
+    def prune_to_limits(self):
+        """prunes the count tables while counting if they passed max_entries or max_bytes.
+            the ngrams are pruned to half of the limit (so counting can go on for a while
+            before the next prune) by the smallest count threshold that gets there, and the
+            (n-1)-grams are pruned by the same threshold.
+        """
+        target = None
+        if self.max_entries is not None and len(self.model) > self.max_entries:
+            target = self.max_entries // 2
+        if self.max_bytes is not None:
+            size = self.table_bytes()
+            if size > self.max_bytes:
+                bytes_target = int(len(self.model) * self.max_bytes / size) // 2
+                target = bytes_target if target is None else min(target, bytes_target)
+        if target is None:
+            return
+        
+        #: smallest threshold that keeps at most target ngrams
+        counts_histogram = Counter(self.model.values())
+        kept = len(self.model)
+        threshold = 1
+        for count in sorted(counts_histogram):
+            if kept <= target and threshold >= self.min_count:
+                break
+            kept -= counts_histogram[count]
+            threshold = count + 1
+        self.prune(threshold)
+
+    def prune(self, threshold):
+        """removes the ngrams and (n-1)-grams counted less then threshold times.
+
+            Args:
+                threshold (int): the minimal count to keep.
+        """
+        self.model = Counter({key: value for key,value in self.model.items() if value >= threshold})
+        self.model_n_min_1 = Counter({key: value for key,value in self.model_n_min_1.items() if value >= threshold})
+
+    def finish_model(self):
+        """populates the tables derived from the counts (get_model dict, sorted model and context index).
+            in pruning mode the tables are pruned like while counting if they passed max_entries
+            or max_bytes (summed parallel or merged counts), the ngrams under min_count are
+            pruned, the model is cut to the max_entries most common ngrams, and every kept
+            ngram keeps a context count at
+            least as big as the counts of its kept continuations, so evaluate never divides by
+            a pruned (n-1)-gram and smooth() works on the pruned tables as on a full model.
+        """
+        if self.is_pruning():
+            self.prune_to_limits()
+            if self.min_count > 1:
+                self.prune(self.min_count)
+            if self.max_entries is not None and len(self.model) > self.max_entries:
+                self.model = Counter(dict(self.model.most_common(self.max_entries)))
+            if self.n_grams > 1:
+                continuation_counts = Counter()
+                for key,value in self.model.items():
+                    continuation_counts[key.rsplit(self.join_note, 1)[0]] += value
+                for context,value in continuation_counts.items():
+                    if self.model_n_min_1[context] < value:
+                        self.model_n_min_1[context] = value
+        self.model_defultdict = counter_to_defultdict(self.model)
+        self.sorted_model = dict(self.model.most_common())
+        self.build_next_token_index()
+        self.generation_arrays = None
+        self.lower_order_models = {}
 
     def get_model(self):
         """Returns the model as a dictionary of the form {ngram:count}
         """
         return self.model_defultdict
 
+    def get_probabilities(self):
+        """Returns the probability and the smoothed probability of every ngram of the model,
+            as a dictionary of the form {ngram:(probability, smoothed)} (see probability() and smooth()).
+            the probability of the last ngram of the text is inf if its context is never followed by a word.
+        """
+        probabilities = {}
+        for key in self.model:
+            ngram = key.split(self.join_note)
+            try:
+                probability = self.probability(ngram)
+            except ZeroDivisionError:
+                probability = math.inf
+            probabilities[key] = (probability, self.smooth(ngram))
+        return probabilities
+
+    def lower_order_model(self, n=1):
+        """Returns a model of a lower order derived from the ngram counts, without the text.
+            every ngram adds its count to each of the n-grams inside it, so the model counts
+            the same as a model built on the text of all the ngrams (with no windows that
+            cross two ngrams). the model is cached until this model changes.
+
+            Args:
+                n (int): the order of the derived model, smaller than the order of this model. Defaults to 1
+
+            Returns:
+                Ngram_Language_Model.
+        """
+        if not 0 < n < self.n_grams:
+            raise ValueError("can only derive a model of order 1 to %d" % (self.n_grams - 1))
+        if n not in self.lower_order_models:
+            lm = Ngram_Language_Model(n, chars=self.split_by_char)
+            lm.join_note = self.join_note
+            for key,count in self.get_model().items():
+                words = key.split(self.join_note)
+                for start in range(len(words) - n + 1):
+                    lm.model[self.join_note.join(words[start:start + n])] += count
+                    #: like count_windows, a context is counted only if a word follows the window
+                    if n > 1 and start + n < len(words):
+                        lm.model_n_min_1[self.join_note.join(words[start:start + n - 1])] += count
+                lm.total_words_in_corpos += count * len(words)
+            lm.finish_model()
+            self.lower_order_models[n] = lm
+        return self.lower_order_models[n]
+
+    def build_next_token_index(self):
+        """populates the context index used by generate.
+
+            every context (the first n-1 tokens of an ngram, the empty string for uni-gram)
+            is mapped to the tokens that follow it and their cumulative counts, so the next
+            token is sampled with one dict lookup and a bisect instead of a scan of the model.
+        """
+        distribution = defaultdict(dict)
+        for key,value in self.model.items():
+            list_key = key.split(self.join_note)
+            distribution[self.join_note.join(list_key[:-1])][list_key[-1]] = value
+
+        self.next_token_index = {}
+        for context,next_tokens in distribution.items():
+            self.next_token_index[context] = (list(next_tokens.keys()), list(accumulate(next_tokens.values())))
+        self.ngram_distribution = (list(self.model.keys()), list(accumulate(self.model.values())))
+        self.short_context_index = {}
+        self.sorted_keys = None
+
+    def short_context_distribution(self, context):
+        """Returns the tokens that may follow a seed shorter then n-1 tokens and their
+            cumulative counts. like the scan of the model before the context index, these
+            are the last tokens of the ngrams whose text starts with the seed, in the order
+            of the model and with the count of the last such ngram. the ngrams are found by
+            a bisect of the sorted keys and the distribution is kept per seed.
+
+            Args:
+                context (str): the joined tokens of the seed.
+        """
+        if context not in self.short_context_index:
+            if self.sorted_keys is None:
+                keys = list(self.model.keys())
+                order = sorted(range(len(keys)), key=keys.__getitem__)
+                self.sorted_keys = ([keys[position] for position in order], order)
+            keys,order = self.sorted_keys
+            low = high = bisect_left(keys, context)
+            while high < len(keys) and keys[high].startswith(context):
+                high += 1
+            distribution_dict = {}
+            for position,key in sorted(zip(order[low:high], keys[low:high])):
+                distribution_dict[key.split(self.join_note)[-1]] = self.model[key]
+            self.short_context_index[context] = (list(distribution_dict.keys()), list(accumulate(distribution_dict.values())))
+        return self.short_context_index[context]
+
     def generate(self, context=None, n=20):
         """Returns a string of the specified length, generated by applying the language model
         to the specified seed context. If no context is specified the context should be sampled
@@ -114,11 +490,11 @@ class Ngram_Language_Model:
             genrated_text = context
            
         else: #: context dosent exist
-            genrated_text = random.choices(list(self.model.keys()), weights=list(self.model.values()), k=1)[0].split(" ")
+            genrated_text = self.sample_ngram()
         
         if self.n_grams == 1:
             while(len(genrated_text) < n and self.generate_bool):
-                random_choise = random.choices(list(self.model.keys()), weights=list(self.model.values()), k=1)[0].split(" ")[0]
+                random_choise = self.sample_ngram()[0]
                 genrated_text.append(random_choise)
         else:
             while(len(genrated_text) < n and self.generate_bool):
@@ -142,7 +518,9 @@ class Ngram_Language_Model:
                Float. The float should reflect the (log) probability.
         """
         
-        if self.split_by_char:
+        if not isinstance(text, str): #: already tokenized
+            text = list(text)
+        elif self.split_by_char:
             text = list(text)
         else:
             text = text.split(" ")
@@ -172,6 +550,80 @@ class Ngram_Language_Model:
             
         return math.log(likelihod)
 
+    def evaluate_many(self, texts):
+        """Returns the log-likelihods of the specified texts, like evaluate() for each text.
+           the probabilities are summed in log space (no underflow on long texts) and the
+           log probability of every window is computed once for the whole batch.
+
+           Args:
+               texts (iterable): Texts (str) to evaluate.
+
+           Returns:
+               np.array. The (log) probability of every text.
+        """
+        log_probabilities = {} #: window -> log probability, None if the window is not in the model
+        log_smoothed = {} #: window -> smoothed log probability
+        scores = []
+        for text in texts:
+            if not isinstance(text, str): #: already tokenized
+                text = list(text)
+            elif self.split_by_char:
+                text = list(text)
+            else:
+                text = text.split(" ")
+            
+            smooth = False
+            log_likelihod = 0.0
+            for first_window_index in range(len(text)-self.n_grams+1):
+                words = text[first_window_index:first_window_index+self.n_grams]
+                window = self.join_note.join(words)
+                if not smooth:
+                    if window not in log_probabilities:
+                        log_probabilities[window] = self.log_probability(words)
+                    if log_probabilities[window] is not None:
+                        log_likelihod += log_probabilities[window]
+                        continue
+                    smooth = True
+                
+                if window not in log_smoothed:
+                    log_smoothed[window] = math.log(self.smooth(words))
+                log_likelihod += log_smoothed[window]
+            scores.append(log_likelihod)
+        return np.array(scores)
+
+    def probability(self, ngram):
+        """Returns the (not smoothed) probability of the specified ngram, the factor
+            evaluate() multiplies for it before any window was smoothed.
+
+            Args:
+                ngram (list): the ngram words.
+
+            Returns:
+                float. The probability, None if the ngram is not in the model.
+        """
+        count_n_gram = self.model[self.join_note.join(ngram)]
+        if count_n_gram == 0:
+            return None
+        if self.n_grams > 1:
+            count_n_min_1_gram = self.model_n_min_1[self.join_note.join(ngram[:-1])]
+        else:
+            count_n_min_1_gram = self.total_words_in_corpos
+        return count_n_gram/count_n_min_1_gram
+
+    def log_probability(self, ngram):
+        """Returns the log of the (not smoothed) probability of the specified ngram.
+
+            Args:
+                ngram (list): the ngram words.
+
+            Returns:
+                float. The log probability, None if the ngram is not in the model.
+        """
+        probability = self.probability(ngram)
+        if probability is None:
+            return None
+        return math.log(probability)
+
     def smooth(self, ngram):
         """Returns the smoothed (Laplace) probability of the specified ngram.
 
@@ -184,51 +636,915 @@ class Ngram_Language_Model:
         count_n_gram = self.model[self.join_note.join(ngram)] +1
         count_n_min_1_gram = self.model_n_min_1[self.join_note.join(ngram[:-1])] + len(self.model)
 
-        smoothed_probability = (count_n_gram/count_n_min_1_gram)
-        
-        return smoothed_probability
-        
-    def search_next_phrase(self,phrase):
-        """Returns the smoothed (Laplace) probability of the specified ngram.
-            
-            check the next word distribution from the model.
-            
-            in addition we check if we have oov more then once to see if the model
-            exhausted.
-            
-            Args:
-                phrase (str): the phrase we need to check for calculate next phrase
+        smoothed_probability = (count_n_gram/count_n_min_1_gram)
+        
+        return smoothed_probability
+        
+    def search_next_phrase(self,phrase):
+        """append the next token to the phrase.
+            
+            check the next word distribution of the phrase context in the context index.
+            a phrase shorter then n-1 tokens is not a context of the index, it is sampled
+            like before the index: the last token of an ngram that starts with the phrase text
+            (see short_context_distribution).
+            
+            in addition we check if we have oov more then once to see if the model
+            exhausted.
+            
+            Args:
+                phrase (list): the phrase we need to check for calculate next phrase
+
+  
+        """
+        phrase_part = phrase[-self.n_grams+1:]
+        context = self.join_note.join(phrase_part)
+        
+        if len(phrase_part) < self.n_grams - 1: #: seed shorter then n-1
+            next_tokens,cum_weights = self.short_context_distribution(context)
+            if next_tokens: #: found next word
+                phrase.append(random.choices(next_tokens, cum_weights=cum_weights, k=1)[0])
+                return
+        elif context in self.next_token_index: #: found next word
+            next_tokens,cum_weights = self.next_token_index[context]
+            phrase.append(random.choices(next_tokens, cum_weights=cum_weights, k=1)[0])
+            return
+        
+        #: check if model exhausted by the idea of having only 1 oov in the begging of the context
+        phrase.extend(self.sample_ngram())
+        if len(phrase) > (self.n_grams -1):
+            self.generate_bool = False
+        
+    def sample_ngram(self):
+        """Returns the tokens of an ngram sampled from the model by its counts.
+        """
+        ngrams,cum_weights = self.ngram_distribution
+        return random.choices(ngrams, cum_weights=cum_weights, k=1)[0].split(self.join_note)
+
+    def generate_batch(self, contexts, n=20, seed=None):
+        """Returns a generated string for every context, like generate() for each context.
+        
+            the sequences are generated in lockstep: the contexts of the model are the states
+            of an automaton, every step samples the next token of all the sequences with one
+            searchsorted over the cumulative counts and moves them to their next state.
+            every sequence draws from its own random stream (spawned from seed), so it is
+            reproducible whatever the other sequences of the batch are. a sequence stops when
+            it reaches a context that is not in the model (or a seed context of less then n-1 tokens).
+
+            Args:
+                contexts (list): the seed contexts (str), None to sample the context from the model.
+                n (int): the length of the strings to be generated.
+                seed (int): the seed of the random streams. Defaults to None
+
+            Return:
+                list. The generated texts.
+        """
+        arrays = self.get_generation_arrays()
+        uniforms = self.sequence_uniforms(len(contexts), n + 1, seed)
+        sequences = []
+        states = np.full(len(contexts), -1, dtype=np.int64)
+        sampled = [] #: sequences without a context start from a sampled ngram
+        for sequence_index,context in enumerate(contexts):
+            words = []
+            if context:
+                words = self.context_words(context)
+                context_key = self.join_note.join(words[-self.n_grams+1:]) if self.n_grams > 1 else ""
+                states[sequence_index] = arrays["context_ids"].get(context_key, -1)
+            elif arrays["cum_counts"].size:
+                sampled.append(sequence_index)
+            sequences.append(words)
+        if sampled:
+            points = (uniforms[sampled, 0] * arrays["cum_counts"][-1]).astype(np.int64)
+            entries = np.searchsorted(arrays["cum_counts"], points, side='right')
+            for sequence_index,entry in zip(sampled, entries.tolist()):
+                sequences[sequence_index] = arrays["contexts"][arrays["entry_context"][entry]] + [arrays["tokens"][arrays["entry_tokens"][entry]]]
+            states[sampled] = arrays["next_state"][entries]
+        
+        lengths = np.array([len(words) for words in sequences], dtype=np.int64)
+        generated = np.full((len(contexts), n), -1, dtype=np.int64)
+        for step in range(n):
+            active = np.flatnonzero((states >= 0) & (lengths + step < n))
+            if active.size == 0:
+                break
+            active_states = states[active]
+            points = arrays["before"][active_states] + (uniforms[active, step + 1] * arrays["totals"][active_states]).astype(np.int64)
+            entries = np.searchsorted(arrays["cum_counts"], points, side='right')
+            generated[active, step] = arrays["entry_tokens"][entries]
+            states[active] = arrays["next_state"][entries]
+        
+        return [self.join_words(words + [arrays["tokens"][token_id] for token_id in row if token_id >= 0])
+                for words,row in zip(sequences, generated.tolist())]
+
+    def get_generation_arrays(self):
+        """Returns the arrays of the generation automaton, built from the context index.
+            every (context, next token) pair of the index is one entry of the flat arrays:
+            its token id, its count (as a global cumulative count) and the state (context id)
+            reached after the token, -1 if that context is not in the model.
+        """
+        if self.generation_arrays is not None:
+            return self.generation_arrays
+        
+        contexts = list(self.next_token_index.keys())
+        context_ids = {context: context_id for context_id,context in enumerate(contexts)}
+        token_ids = {}
+        entry_tokens = []
+        entry_context = []
+        next_state = []
+        counts = []
+        before = []
+        for context_id,context in enumerate(contexts):
+            context_words = context.split(self.join_note) if self.n_grams > 1 else []
+            next_tokens,cum_weights = self.next_token_index[context]
+            before.append(len(counts))
+            previous = 0
+            for token,cum_weight in zip(next_tokens, cum_weights):
+                entry_tokens.append(token_ids.setdefault(token, len(token_ids)))
+                entry_context.append(context_id)
+                next_state.append(context_ids.get(self.join_note.join((context_words + [token])[1:]), -1) if self.n_grams > 1 else 0)
+                counts.append(cum_weight - previous)
+                previous = cum_weight
+        
+        cum_counts = np.cumsum(np.array(counts, dtype=np.int64))
+        starts = np.array(before, dtype=np.int64)
+        ends = np.append(starts[1:], len(counts)).astype(np.int64)
+        before_counts = np.where(starts > 0, cum_counts[np.maximum(starts - 1, 0)], 0) if len(counts) else starts
+        self.generation_arrays = {
+            "contexts": [context.split(self.join_note) if self.n_grams > 1 else [] for context in contexts],
+            "context_ids": context_ids,
+            "tokens": list(token_ids.keys()),
+            "entry_tokens": np.array(entry_tokens, dtype=np.int64),
+            "entry_context": np.array(entry_context, dtype=np.int64),
+            "next_state": np.array(next_state, dtype=np.int64),
+            "cum_counts": cum_counts,
+            "before": before_counts,
+            "totals": cum_counts[ends - 1] - before_counts if len(counts) else starts,
+        }
+        return self.generation_arrays
+
+    def sequence_uniforms(self, count, steps, seed=None):
+        """Returns a (count, steps) matrix of uniform numbers in [0,1), row i is the
+            stream of a SplitMix64 generator seeded by a hash of (seed, i), so every
+            row is an independent stream computed for all the rows at once.
+        """
+        if seed is None:
+            seed = random.getrandbits(64)
+        streams = splitmix64(splitmix64(np.array([seed % 2 ** 64], dtype=np.uint64)) + np.arange(count, dtype=np.uint64))
+        states = streams[:, None] + np.arange(1, steps + 1, dtype=np.uint64)[None, :] * np.uint64(SPLITMIX64_GAMMA)
+        return (splitmix64(states) >> np.uint64(11)) * (1.0 / 2 ** 53)
+
+    def context_words(self, context):
+        """Returns the tokens of a seed context, as generate() splits it.
+        """
+        context = context.lower()
+        if self.split_by_char:
+            return list(context)
+        return context.split(" ")
+
+    def join_words(self, words):
+        """Returns the generated tokens as a string.
+        """
+        if self.split_by_char:
+            return "".join(words)
+        return " ".join(words)
+        
+        
+    # def add_special_char(self,text):
+    #     #: add n-1 <S> in the beggining for the evaluate smooth
+    #     for _ in range(self.n_grams - 1):
+    #         text.insert(0,self.special_word)
+            
+        
+            
+
+
+
+
+class Packed_Ngram_Language_Model(Ngram_Language_Model):
+    """Array backed storage of the Ngram_Language_Model.
+        Tokens are interned to integer ids and every ngram is packed to one fixed size key,
+        its ids as big-endian uint32 words (a numpy void), so the keys sort like the tuples
+        of ids and any n and vocabulary size fit. The ngrams and the (n-1)-grams are kept as
+        sorted key arrays with a parallel count array instead of string Counters, so the
+        model takes about 4n+16 bytes per ngram. get_model() and evaluate() return the
+        same values as the string based model.
+    """
+
+    def __init__(self, n=3, chars=False):
+        """Initializing a packed language model object.
+        Arges:
+            n (int): the length of the markov unit (the n of the n-gram). Defaults to 3.
+            chars (bool): True iff the model consists of ngrams of characters rather then word tokens.
+                          Defaults to False
+        """
+        super().__init__(n, chars)
+        self.vocabulary = {}
+        self.tokens = []
+        self.ngram_keys = np.zeros(0, dtype=key_dtype(n))
+        self.ngram_counts = np.zeros(0, dtype=np.int64)
+        self.ngram_cum_counts = np.zeros(0, dtype=np.int64)
+        self.context_keys = np.zeros(0, dtype=key_dtype(n - 1))
+        self.context_counts = np.zeros(0, dtype=np.int64)
+        self.model_defultdict = None #: decoded on the first get_model()
+
+    def build_model(self, text):
+        """populates the sorted key and count arrays of all ngrams in the specified text.
+
+            Args:
+                text (str): the text to construct the model from.
+        """
+        self.vocabulary = {}
+        self.lower_order_models = {}
+        self.model_defultdict = None
+        ids = np.fromiter((self.vocabulary.setdefault(word, len(self.vocabulary)) for word in self.corpus_tokens(text)),
+                          dtype=np.int64)
+        self.total_words_in_corpos = len(ids)
+        self.tokens = list(self.vocabulary.keys())
+        self.head = [self.tokens[token_id] for token_id in ids[:self.n_grams].tolist()]
+        self.carry = [self.tokens[token_id] for token_id in ids[-self.n_grams:].tolist()] if len(ids) else []
+        self.pending_text = ""
+        self.pending_token = None
+        self.text_started = len(ids) > 0
+        if len(self.tokens) > KEY_ID_LIMIT:
+            raise ValueError("vocabulary of %d tokens is too large for 32 bit token ids" % len(self.tokens))
+
+        #: same windows as the string model, the (n-1)-grams skip the last window
+        windows = len(ids) - self.n_grams + 1
+        self.ngram_keys, self.ngram_counts = self.count_ngram_windows(ids, self.n_grams, windows)
+        self.context_keys, self.context_counts = self.count_ngram_windows(ids, self.n_grams - 1, windows - 1)
+        self.ngram_cum_counts = np.cumsum(self.ngram_counts)
+
+    def from_model(self, lm):
+        """populates the packed arrays from the counts of a string based model
+            (for example a model built with update() or merge() of Ngram_Language_Model).
+
+            Args:
+                lm (Ngram_Language_Model): a built model.
+
+            Returns:
+                The packed model (self).
+        """
+        self.n_grams = lm.n_grams
+        self.split_by_char = lm.split_by_char
+        self.join_note = lm.join_note
+        self.total_words_in_corpos = lm.total_words_in_corpos
+        self.head = list(lm.head)
+        self.carry = list(lm.carry)
+        self.pending_text = lm.pending_text
+        self.pending_token = lm.pending_token
+        self.text_started = lm.text_started
+        self.vocabulary = {}
+        self.lower_order_models = {}
+        self.model_defultdict = None
+        for key in lm.model:
+            for word in key.split(self.join_note):
+                self.vocabulary.setdefault(word, len(self.vocabulary))
+        self.tokens = list(self.vocabulary.keys())
+        if len(self.tokens) > KEY_ID_LIMIT:
+            raise ValueError("vocabulary of %d tokens is too large for 32 bit token ids" % len(self.tokens))
+
+        self.ngram_keys, self.ngram_counts = self.pack_counter(lm.model, self.n_grams)
+        self.context_keys, self.context_counts = self.pack_counter(lm.model_n_min_1, self.n_grams - 1)
+        self.ngram_cum_counts = np.cumsum(self.ngram_counts)
+        return self
+
+    def pack_counter(self, counter, length):
+        """Returns the sorted packed keys of a Counter of joined ngrams of the specified length and their counts.
+        """
+        if length == 0 or not counter:
+            return np.zeros(0, dtype=key_dtype(length)), np.zeros(0, dtype=np.int64)
+        rows = np.array([[self.vocabulary[word] for word in key.split(self.join_note)] for key in counter], dtype=np.int64)
+        counts = np.fromiter(counter.values(), dtype=np.int64, count=len(counter))
+        return sort_keys(rows, counts)
+
+    def unpack(self, keys, counts, length):
+        """Returns a dict of the joined ngrams of packed keys of the specified length and their counts.
+        """
+        if keys.size == 0:
+            return {}
+        return {self.join_note.join([self.tokens[token_id] for token_id in row]): count
+                for row,count in zip(key_ids(keys, length).tolist(), counts.tolist())}
+
+    def to_model(self):
+        """Returns a string based Ngram_Language_Model with the counts of the packed arrays,
+            the first and last words and the waiting text so it can go on with update() or merge().
+        """
+        lm = Ngram_Language_Model(self.n_grams, self.split_by_char)
+        lm.join_note = self.join_note
+        lm.model = Counter(self.unpack(self.ngram_keys, self.ngram_counts, self.n_grams))
+        lm.model_n_min_1 = Counter(self.unpack(self.context_keys, self.context_counts, self.n_grams - 1))
+        lm.total_words_in_corpos = self.total_words_in_corpos
+        lm.head = list(self.head)
+        lm.carry = list(self.carry)
+        lm.pending_text = self.pending_text
+        lm.pending_token = self.pending_token
+        lm.text_started = self.text_started
+        return lm
+
+    def save(self, path):
+        """writes the model to one binary file that load() can memory-map.
+            the file is a magic line, a json header (n, chars, totals and the offset of
+            every array) and the arrays themselves, each aligned to 64 bytes: the sorted
+            ngram keys, counts and cumulative counts, the (n-1)-gram keys and counts and
+            the vocabulary as utf-8 bytes with their offsets.
+
+            Args:
+                path (str): the file to write.
+        """
+        encoded_tokens = [token.encode('utf-8') for token in self.tokens]
+        arrays = {
+            "ngram_keys": self.ngram_keys,
+            "ngram_counts": self.ngram_counts,
+            "ngram_cum_counts": self.ngram_cum_counts,
+            "context_keys": self.context_keys,
+            "context_counts": self.context_counts,
+            "token_offsets": np.cumsum([0] + [len(token) for token in encoded_tokens], dtype=np.int64),
+            "token_bytes": np.frombuffer(b"".join(encoded_tokens), dtype=np.uint8),
+        }
+        header = {"n": self.n_grams, "chars": self.split_by_char, "join_note": self.join_note,
+                  "total_words_in_corpos": self.total_words_in_corpos,
+                  "head": self.head, "carry": self.carry, "pending_text": self.pending_text,
+                  "pending_token": self.pending_token, "text_started": self.text_started, "arrays": {}}
+        offset = 0
+        for name,array in arrays.items():
+            header["arrays"][name] = [array.dtype.str, len(array), offset]
+            offset += -(-array.nbytes // 64) * 64
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = -(-(len(MODEL_FILE_MAGIC) + 8 + len(header_bytes)) // 64) * 64
+
+        with open(path, 'wb') as f:
+            f.write(MODEL_FILE_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for name,array in arrays.items():
+                f.seek(data_start + header["arrays"][name][2])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_start + offset)
+
+    def load(self, path, mmap=True):
+        """populates the model from a file written by save().
+
+            Args:
+                path (str): the file to read.
+                mmap (bool): True to memory-map the arrays (read only, shared by all the
+                             processes that load the same file) instead of reading them.
+                             Defaults to True
+
+            Returns:
+                The loaded model (self).
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(MODEL_FILE_MAGIC)) != MODEL_FILE_MAGIC:
+                raise ValueError("%s is not a saved language model" % path)
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = -(-(len(MODEL_FILE_MAGIC) + 8 + header_length) // 64) * 64
+
+        arrays = {}
+        for name,(dtype,length,offset) in header["arrays"].items():
+            if length == 0:
+                arrays[name] = np.zeros(0, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + offset, shape=(length,))
+            else:
+                arrays[name] = np.fromfile(path, dtype=dtype, count=length, offset=data_start + offset)
+
+        self.n_grams = header["n"]
+        self.split_by_char = header["chars"]
+        self.join_note = header["join_note"]
+        self.total_words_in_corpos = header["total_words_in_corpos"]
+        self.head = header.get("head", [])
+        self.carry = header.get("carry", [])
+        self.pending_text = header.get("pending_text", "")
+        self.pending_token = header.get("pending_token")
+        self.text_started = header.get("text_started", self.total_words_in_corpos > 0)
+        self.lower_order_models = {}
+        self.model_defultdict = None
+        self.ngram_keys = arrays["ngram_keys"]
+        self.ngram_counts = arrays["ngram_counts"]
+        self.ngram_cum_counts = arrays["ngram_cum_counts"]
+        self.context_keys = arrays["context_keys"]
+        self.context_counts = arrays["context_counts"]
+        token_bytes = arrays["token_bytes"].tobytes()
+        token_offsets = arrays["token_offsets"].tolist()
+        self.tokens = [token_bytes[start:end].decode('utf-8') for start,end in zip(token_offsets, token_offsets[1:])]
+        self.vocabulary = {token: token_id for token_id,token in enumerate(self.tokens)}
+        return self
+
+    def update(self, chunks):
+        """adds the ngrams of a stream of text chunks to the model, like Ngram_Language_Model.update().
+            the arrays can not grow in place, so the counts are unpacked to a string based model
+            (see to_model()), the chunks are counted there and the arrays are packed again. every
+            call costs a pass over the whole model, stream many chunks per call.
+
+            Args:
+                chunks (iterable): the text chunks (str) to add to the model.
+        """
+        lm = self.to_model()
+        lm.add_tokens(lm.stream_tokens(chunks))
+        self.from_model(lm)
+
+    def close(self):
+        """counts the text that waits for the next update() as the end of the text (see Ngram_Language_Model.close()).
+        """
+        if self.pending_token is not None or self.pending_text:
+            lm = self.to_model()
+            lm.count_pending()
+            self.from_model(lm)
+
+    def merge(self, other):
+        """adds the counts of another model to this model, as if the text of the other model
+            followed the text of this model (see Ngram_Language_Model.merge()). the counts are
+            merged on string based models and packed again.
+
+            Args:
+                other (Ngram_Language_Model): a model with the same n and chars, packed or not.
+
+            Returns:
+                The merged model (self).
+        """
+        lm = self.to_model()
+        lm.merge(other.to_model() if isinstance(other, Packed_Ngram_Language_Model) else other)
+        return self.from_model(lm)
+
+    def count_ngram_windows(self, ids, length, windows):
+        """Returns the sorted packed keys of the first windows of the specified length and their counts.
+
+            Args:
+                ids (np.array): the token ids of the text.
+                length (int): the length of the windows.
+                windows (int): the number of windows to count.
+
+            Returns:
+                tuple of np.array. (keys,counts)
+        """
+        if length == 0 or windows <= 0:
+            return np.zeros(0, dtype=key_dtype(length)), np.zeros(0, dtype=np.int64)
+        return sort_keys(sliding_window_view(ids, length)[:windows], np.ones(windows, dtype=np.int64))
+
+    def pack(self, ids, length, windows):
+        """Returns the packed keys of the first windows of the specified length.
+        """
+        return pack_ids(sliding_window_view(ids, length)[:windows])
+
+    def lookup(self, keys, counts, query):
+        """Returns the counts of the query keys (0 for keys that are not in the model).
+
+            Args:
+                keys (np.array): sorted keys of the model.
+                counts (np.array): counts parallel to the keys.
+                query (np.array): keys to look for.
+
+            Returns:
+                np.array. the counts of the query keys.
+        """
+        if keys.size == 0:
+            return np.zeros(len(query), dtype=np.int64)
+        index = np.minimum(np.searchsorted(keys, query), keys.size - 1)
+        return np.where(keys[index] == query, counts[index], 0)
+
+    def encode(self, words):
+        """Returns the token ids of the words and a mask of the out of vocabulary words.
+        """
+        ids = np.fromiter((self.vocabulary.get(word, -1) for word in words), dtype=np.int64, count=len(words))
+        oov = ids < 0
+        return np.where(oov, 0, ids), oov
+
+    def count(self, words, keys, counts):
+        """Returns the count of one ngram (or context) of the words, without the array
+            overhead of window_counts.
+        """
+        ids = []
+        for word in words:
+            token_id = self.vocabulary.get(word)
+            if token_id is None:
+                return 0
+            ids.append(token_id)
+        key = pack_ids(np.array([ids], dtype=np.int64))
+        index = int(keys.searchsorted(key)[0])
+        if index < keys.size and keys[index] == key[0]:
+            return int(counts[index])
+        return 0
+
+    def window_counts(self, words, length, keys, counts):
+        """Returns the counts of every window of the specified length in the words.
+        """
+        windows = len(words) - length + 1
+        if windows <= 0:
+            return np.zeros(0, dtype=np.int64)
+        ids, oov = self.encode(words)
+        found = self.lookup(keys, counts, self.pack(ids, length, windows))
+        #: a window with an out of vocabulary word is never in the model
+        oov_in_window = np.convolve(oov, np.ones(length, dtype=np.int64), mode='valid') > 0
+        found[oov_in_window] = 0
+        return found
+
+    def get_model(self):
+        """Returns the model as a dictionary of the form {ngram:count}
+            the dictionary is decoded from the arrays on the first call and kept until the model changes.
+        """
+        if self.model_defultdict is None:
+            self.model_defultdict = defaultdict(int)
+            self.model_defultdict.update(self.unpack(self.ngram_keys, self.ngram_counts, self.n_grams))
+        return self.model_defultdict
+
+    def get_probabilities(self):
+        """Returns the probability and the smoothed probability of every ngram of the model,
+            as a dictionary of the form {ngram:(probability, smoothed)} (see probability() and smooth()).
+            the context counts of all the ngrams are looked up at once (the probability of the last
+            ngram of the text is inf if its context is never followed by a word).
+        """
+        counts = self.ngram_counts
+        if self.n_grams > 1:
+            contexts = self.lookup(self.context_keys, self.context_counts,
+                                   pack_ids(key_ids(self.ngram_keys, self.n_grams)[:, :-1]))
+            with np.errstate(divide='ignore'):
+                probabilities = counts / contexts
+        else:
+            contexts = 0
+            probabilities = counts / self.total_words_in_corpos
+        smoothed = (counts + 1) / (contexts + self.ngram_keys.size)
+        return dict(zip(self.get_model(), zip(probabilities.tolist(), smoothed.tolist())))
+
+    def evaluate(self,text):
+        """Returns the log-likelihod of the specified text to be generated by the model.
+           Laplace smoothing should be applied if necessary.
+
+           Args:
+               text (str): Text to ebaluate.
+
+           Returns:
+               Float. The float should reflect the (log) probability.
+        """
+        if not isinstance(text, str): #: already tokenized
+            text = list(text)
+        elif self.split_by_char:
+            text = list(text)
+        else:
+            text = text.split(" ")
+
+        counts_n_gram = self.window_counts(text, self.n_grams, self.ngram_keys, self.ngram_counts).tolist()
+        if self.n_grams > 1:
+            counts_n_min_1_gram = self.window_counts(text[:-1], self.n_grams - 1, self.context_keys, self.context_counts).tolist()
+        else:
+            counts_n_min_1_gram = [0] * len(counts_n_gram)
+
+        smooth = False
+        likelihod = 1
+        for count_n_gram,count_n_min_1_gram in zip(counts_n_gram, counts_n_min_1_gram):
+            if count_n_gram == 0:
+                smooth = True
+
+            if smooth:
+                likelihod *= (count_n_gram + 1) / (count_n_min_1_gram + self.ngram_keys.size)
+            elif self.n_grams > 1:
+                likelihod *= (count_n_gram/count_n_min_1_gram)
+            else:
+                likelihod *= (count_n_gram/self.total_words_in_corpos)
+
+        return math.log(likelihod)
+
+    def evaluate_many(self, texts):
+        """Returns the log-likelihods of the specified texts, like evaluate() for each text.
+           the windows of a text are looked up together and summed in log space.
+
+           Args:
+               texts (iterable): Texts (str) to evaluate.
+
+           Returns:
+               np.array. The (log) probability of every text.
+        """
+        scores = []
+        for text in texts:
+            if not isinstance(text, str): #: already tokenized
+                text = list(text)
+            elif self.split_by_char:
+                text = list(text)
+            else:
+                text = text.split(" ")
+            
+            counts_n_gram = self.window_counts(text, self.n_grams, self.ngram_keys, self.ngram_counts)
+            if self.n_grams > 1:
+                counts_n_min_1_gram = self.window_counts(text[:-1], self.n_grams - 1, self.context_keys, self.context_counts)
+            else:
+                counts_n_min_1_gram = np.zeros(len(counts_n_gram), dtype=np.int64)
+            
+            #: every window from the first unseen ngram on is smoothed
+            unseen = np.flatnonzero(counts_n_gram == 0)
+            first_smoothed = unseen[0] if unseen.size else len(counts_n_gram)
+            seen = counts_n_gram[:first_smoothed]
+            if self.n_grams > 1:
+                probabilities = seen / counts_n_min_1_gram[:first_smoothed]
+            else:
+                probabilities = seen / self.total_words_in_corpos
+            smoothed = (counts_n_gram[first_smoothed:] + 1) / (counts_n_min_1_gram[first_smoothed:] + self.ngram_keys.size)
+            scores.append(np.log(probabilities).sum() + np.log(smoothed).sum())
+        return np.array(scores)
+
+    def probability(self, ngram):
+        """Returns the (not smoothed) probability of the specified ngram.
+
+            Args:
+                ngram (list): the ngram words.
+
+            Returns:
+                float. The probability, None if the ngram is not in the model.
+        """
+        count_n_gram = self.count(ngram, self.ngram_keys, self.ngram_counts)
+        if count_n_gram == 0:
+            return None
+        if self.n_grams > 1:
+            return count_n_gram / self.count(ngram[:-1], self.context_keys, self.context_counts)
+        return count_n_gram / self.total_words_in_corpos
+
+    def smooth(self, ngram):
+        """Returns the smoothed (Laplace) probability of the specified ngram.
+
+            Args:
+                ngram (list): the ngram to have it's probability smoothed
+
+            Returns:
+                float. The smoothed probability.
+        """
+        count_n_gram = self.count(ngram, self.ngram_keys, self.ngram_counts) + 1
+        if self.n_grams > 1:
+            count_n_min_1_gram = self.count(ngram[:-1], self.context_keys, self.context_counts)
+        else:
+            count_n_min_1_gram = 0
+        return count_n_gram / (count_n_min_1_gram + self.ngram_keys.size)
+
+    def build_next_token_index(self):
+        """the sorted keys are already grouped by context, nothing to build.
+        """
+
+    def search_next_phrase(self,phrase):
+        """append the next token to the phrase.
+
+            all the ngrams that start with the phrase context are one contiguous range of
+            the sorted keys, the next token is sampled from the cumulative counts of the range.
+            (a phrase shorter then n-1 tokens is completed with the token that follows it,
+            not like the string model that samples the last token of the ngram)
+
+            Args:
+                phrase (list): the phrase we need to check for calculate next phrase
+        """
+        phrase_part = phrase[-self.n_grams+1:]
+        ids = [self.vocabulary.get(word, -1) for word in phrase_part]
+        if -1 not in ids:
+            low,high = self.context_ranges(np.array([ids], dtype=np.int64).reshape(1, len(ids)))
+            if high[0] > low[0]: #: found next word
+                phrase.append(self.tokens[self.sample_key(low[0], high[0])[len(ids)]])
+                return
+
+        #: check if model exhausted by the idea of having only 1 oov in the begging of the context
+        phrase.extend(self.sample_ngram())
+        if len(phrase) > (self.n_grams -1):
+            self.generate_bool = False
+
+    def sample_key(self, low, high):
+        """Returns the token ids of a key sampled by its count from the keys in range [low,high).
+        """
+        before = int(self.ngram_cum_counts[low - 1]) if low > 0 else 0
+        point = before + random.random() * (int(self.ngram_cum_counts[high - 1]) - before)
+        index = np.searchsorted(self.ngram_cum_counts, point, side='right')
+        return key_ids(self.ngram_keys[index:index + 1], self.n_grams)[0].tolist()
+
+    def context_ranges(self, contexts):
+        """Returns the ranges [low,high) of the sorted ngram keys that start with every row of context ids.
+
+            Args:
+                contexts (np.array): the token ids of the contexts, one context per row.
+
+            Returns:
+                tuple of np.array. (low,high)
+        """
+        fill = self.n_grams - contexts.shape[1]
+        first = np.hstack([contexts, np.zeros((len(contexts), fill), dtype=np.int64)])
+        last = np.hstack([contexts, np.full((len(contexts), fill), KEY_ID_LIMIT - 1, dtype=np.int64)])
+        return (np.searchsorted(self.ngram_keys, pack_ids(first)),
+                np.searchsorted(self.ngram_keys, pack_ids(last), side='right'))
+
+    def sample_ngram(self):
+        """Returns the tokens of an ngram sampled from the model by its counts.
+        """
+        return [self.tokens[token_id] for token_id in self.sample_key(0, self.ngram_keys.size)]
+
+    def generate_batch(self, contexts, n=20, seed=None):
+        """Returns a generated string for every context, like generate() for each context.
+            the state of a sequence is the ids of its last n-1 tokens, all the ngrams
+            that follow it are one range of the sorted keys, so every step samples the next
+            token of all the sequences with searchsorted over the cumulative counts.
+            every sequence draws from its own random stream (spawned from seed).
+
+            Args:
+                contexts (list): the seed contexts (str), None to sample the context from the model.
+                n (int): the length of the strings to be generated.
+                seed (int): the seed of the random streams. Defaults to None
+
+            Return:
+                list. The generated texts.
+        """
+        uniforms = self.sequence_uniforms(len(contexts), n + 1, seed)
+        sequences = []
+        states = np.zeros((len(contexts), self.n_grams - 1), dtype=np.int64)
+        alive = np.zeros(len(contexts), dtype=bool)
+        sampled = [] #: sequences without a context start from a sampled ngram
+        for sequence_index,context in enumerate(contexts):
+            words = []
+            if context:
+                words = self.context_words(context)
+                ids = [self.vocabulary.get(word, -1) for word in words[len(words)-self.n_grams+1:]] if self.n_grams > 1 else []
+                if -1 not in ids and len(ids) == self.n_grams - 1:
+                    states[sequence_index] = ids
+                    alive[sequence_index] = True
+            elif self.ngram_keys.size:
+                sampled.append(sequence_index)
+            sequences.append(words)
+        if sampled:
+            points = (uniforms[sampled, 0] * int(self.ngram_cum_counts[-1])).astype(np.int64)
+            rows = key_ids(self.ngram_keys[np.searchsorted(self.ngram_cum_counts, points, side='right')], self.n_grams)
+            for sequence_index,row in zip(sampled, rows.tolist()):
+                sequences[sequence_index] = [self.tokens[token_id] for token_id in row]
+            states[sampled] = rows[:, 1:]
+            alive[sampled] = True
+        
+        lengths = np.array([len(words) for words in sequences], dtype=np.int64)
+        generated = np.full((len(contexts), n), -1, dtype=np.int64)
+        for step in range(n):
+            active = np.flatnonzero(alive & (lengths + step < n))
+            if active.size == 0:
+                break
+            low,high = self.context_ranges(states[active])
+            #: a context that is not in the model ends its sequence
+            alive[active[high == low]] = False
+            found = high > low
+            active,low,high = active[found],low[found],high[found]
+            before = np.where(low > 0, self.ngram_cum_counts[np.maximum(low - 1, 0)], 0)
+            points = before + (uniforms[active, step + 1] * (self.ngram_cum_counts[high - 1] - before)).astype(np.int64)
+            rows = key_ids(self.ngram_keys[np.searchsorted(self.ngram_cum_counts, points, side='right')], self.n_grams)
+            generated[active, step] = rows[:, -1]
+            states[active] = rows[:, 1:]
+        
+        return [self.join_words(words + [self.tokens[token_id] for token_id in row if token_id >= 0])
+                for words,row in zip(sequences, generated.tolist())]
+
+
+
+
+MODEL_FILE_MAGIC = b"NGRAMLM2\n"
+KEY_ID_DTYPE = np.dtype('>u4') #: big-endian, so the bytes of a packed key sort like its ids
+KEY_ID_LIMIT = 2 ** 32
+#: the tokens of normalize_text(text).split(" ") read straight from the text: a punctuation mark,
+#: or a run of plain characters that may hold single whitespace characters (not spaces) between them
+TOKEN_PATTERN = re.compile(r'[.,!?()]|(?:[^\s.,!?()]|(?<![\s.,!?()])[^\S ](?![\s.,!?()]))+')
+SPLITMIX64_GAMMA = 0x9E3779B97F4A7C15
+
+
+def splitmix64(values):
+    """Returns the SplitMix64 mix of an array of uint64 values.
+    """
+    values = values + np.uint64(SPLITMIX64_GAMMA)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def key_dtype(length):
+    """Returns the numpy dtype of the packed keys of ngrams of the specified length.
+    """
+    return np.dtype((np.void, KEY_ID_DTYPE.itemsize * max(length, 1)))
+
+
+def pack_ids(rows):
+    """Returns the packed keys of an array of token ids, one ngram per row.
+    """
+    rows = np.ascontiguousarray(rows, dtype=KEY_ID_DTYPE)
+    return rows.view(key_dtype(rows.shape[1])).reshape(len(rows))
+
+
+def key_ids(keys, length):
+    """Returns the token ids of packed keys of ngrams of the specified length, one ngram per row.
+    """
+    return np.ascontiguousarray(keys).view(KEY_ID_DTYPE).reshape(len(keys), length).astype(np.int64)
+
+
+def sort_keys(rows, counts):
+    """Returns the sorted packed keys of the distinct rows of token ids and the summed counts of every key.
+    """
+    order = np.lexsort(rows.T[::-1])
+    rows,counts = rows[order],counts[order]
+    starts = np.flatnonzero(np.concatenate(([True], np.any(rows[1:] != rows[:-1], axis=1))))
+    return pack_ids(rows[starts]), np.add.reduceat(counts, starts)
+
+
+def split_at_token_boundary(text):
+    """Returns the text split in two at the last space between two plain characters.
+       normalize_text works on each part alone as on the whole text, so the head can be
+       tokenized while the tail (maybe a cut word) waits for the next chunk.
+
+       Args:
+           text (str): the text to split
+
+       Returns:
+           tuple. (head,tail), head is empty if there is no such space.
+    """
+    index = text.rfind(" ")
+    while index > 0:
+        if index + 1 < len(text) and is_plain_char(text[index-1]) and is_plain_char(text[index+1]):
+            return text[:index+1],text[index+1:]
+        index = text.rfind(" ", 0, index)
+    return "",text
+
+
+def iter_tokens(chunks, chars=False):
+    """yields the tokens of a text (or a stream of text chunks) lazily in one pass.
+       the words are the same as normalize_text(text).split(" "), without building the
+       normalized text and the list of words.
+
+       Args:
+           chunks (str or iterable): the text or a stream of text chunks.
+           chars (bool): True to yield the characters of the text. Defaults to False
+    """
+    if isinstance(chunks, str):
+        chunks = [chunks]
+    if chars:
+        for chunk in chunks:
+            yield from chunk
+        return
+    
+    remainder = ""
+    started = False
+    for chunk in chunks:
+        text,remainder = split_at_token_boundary(remainder + chunk)
+        if text:
+            yield from text_tokens(text, first=not started)
+            started = True
+    yield from text_tokens(remainder, first=not started, last=True)
+
+
+def text_tokens(text, first=False, last=False):
+    """yields the tokens of a part of a text cut on token boundaries (see split_at_token_boundary).
+
+       Args:
+           text (str): the part of the text.
+           first (bool): True for the first part, the split leaves an empty token before a first space. Defaults to False
+           last (bool): True for the last part, the split leaves an empty token after a final space
+                        (and for an empty text). Defaults to False
+    """
+    if first and normalize_text(text[:2]).startswith(" "):
+        yield ""
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        yield match.group()
+    if last and (not text or normalize_text(text[-2:]).endswith(" ")):
+        yield ""
+
+
+def drop_last(tokens):
+    """yields all the tokens but the last one.
+    """
+    tokens = iter(tokens)
+    previous = next(tokens, None)
+    for token in tokens:
+        yield previous
+        previous = token
+
+
+def is_plain_char(char):
+    """Returns True iff normalize_text does not pad or collapse the char.
+    """
+    return not char.isspace() and char not in ".,!?()"
+
+
+def count_shard(shard):
+    """Returns the ngram and (n-1)-gram Counters of one shard of a parallel build_model, not pruned.
+
+       Args:
+           shard (tuple): (n, join note, the words before the shard, the words of the shard)
+
+       Returns:
+           tuple. (ngram Counter, (n-1)-gram Counter)
+    """
+    n,join_note,carry,words = shard
+    lm = Ngram_Language_Model(n)
+    lm.join_note = join_note
+    lm.count_windows(carry + words, len(carry))
+    return lm.model,lm.model_n_min_1
 
-  
-        """
-        distribution_dict = {}
-        
-        
-        phrase_part = phrase[-self.n_grams+1:]
-        
-        for key,value in self.model.items():
-            list_key = key.split(self.join_note)
-            if self.join_note.join(list_key).startswith(self.join_note.join(phrase_part)):
-                distribution_dict[list_key[-1]] = value
-        if distribution_dict: #: found next word
-            phrase.append(random.choices(list(distribution_dict.keys()), weights=list(distribution_dict.values()), k=1)[0])
-            return
-        
-        #: check if model exhausted by the idea of having only 1 oov in the begging of the context
-        phrase.extend(random.choices(list(self.model.keys()), weights=list(self.model.values()), k=1)[0].split(" "))
-        if len(phrase) > (self.n_grams -1):
-            self.generate_bool = False
-        
-        
-    # def add_special_char(self,text):
-    #     #: add n-1 <S> in the beggining for the evaluate smooth
-    #     for _ in range(self.n_grams - 1):
-    #         text.insert(0,self.special_word)
-            
-        
-            
 
+def read_text_chunks(paths, chunk_size=1 << 20):
+    """yields the text of the files chunk_size characters at a time, with a space between
+       two files so the last word of a file and the first word of the next one stay apart.
 
+       Args:
+           paths (iterable): the files to read.
+           chunk_size (int): the number of characters per chunk.
+    """
+    for index,path in enumerate(paths):
+        if index:
+            yield " "
+        with open(path, 'r') as f:
+            chunk = f.read(chunk_size)
+            while chunk:
+                yield chunk
+                chunk = f.read(chunk_size)
 
 
 class Spell_Checker:
@@ -236,13 +1552,19 @@ class Spell_Checker:
         are done in the Noisy Channel framework, based on a language model and
         an error distribution model.
     """
-    def __init__(self,lm = None):
+    def __init__(self,lm = None,candidate_cache_size = 10000,prune_candidates = True,channel_cache_size = 100000):
         """Initializing a spell checker object with a language model as an
         instance  variable. The language model should suppport the evaluate()
         and the get_model() functions as defined in assignment #1.
 
         Args:
             lm: a language model object. Defaults to None
+            candidate_cache_size (int): the max number of tokens to keep candidates for
+                between spell_check calls (least recently used are dropped). Defaults to 10000
+            prune_candidates (bool): skip the language model of the candidates that can not beat
+                the best candidate so far or the word kept (same corrections, fewer model calls). Defaults to True
+            channel_cache_size (int): the max number of (word, candidate) channel probabilities to keep
+                between spell_check calls (least recently used are dropped). Defaults to 100000
         """
         if lm:
             self.lm = lm
@@ -250,6 +1572,14 @@ class Spell_Checker:
             self.lm = Ngram_Language_Model()
         
         self.alpha = 0.95
+        self.candidate_cache_size = candidate_cache_size
+        self.index_model = None #: the model the prepared index was built for
+        self.prune_candidates = prune_candidates
+        self.channel_cache_size = channel_cache_size
+        self.clear_candidate_cache()
+        self.clear_channel_cache()
+        self.clear_pruning_info()
+        self.stats = self.newStats()
     def build_model(self, text, n=3):
         """Returns a language model object built on the specified text. The language
             model should support evaluate() and the get_model() functions as defined
@@ -264,6 +1594,7 @@ class Spell_Checker:
         """
         self.lm.n_grams = n #: set n for the model
         self.lm.build_model(text)
+        self.prepare_index()
         return self.lm
     
     def add_language_model(self,lm):
@@ -274,8 +1605,117 @@ class Spell_Checker:
                 ls: a language model object
         """
         self.lm = lm  
+        self.prepare_index()
+
+    def prepare_index(self):
+        """Builds the vocabulary, the word counts and the candidates index of the language model.
+            They are reused by every spell_check call until another model is attached, so call
+            add_language_model() again after updating the model in place.
+            (Left for the first spell_check call if the model is not built yet)
+        """
+        self.clear_candidate_cache()
+        wordDict = self.lm.get_model()
+        if not wordDict:
+            self.index_model = None
+            return
+        self.allWords = set([key.split()[0] for key in wordDict.keys()])
+        #: ids of every word of the model (the texts are scored as id lists)
+        self.id_words = sorted(set(word for key in wordDict.keys() for word in key.split()))
+        self.word_ids = {word : index for index,word in enumerate(self.id_words)}
+        self.model_n = len(next(iter(wordDict)).split())
+        self.countWords = Counter()
+        for key,value in wordDict.items():
+            self.countWords["#"+key.split()[0]]+=value
+        self.build_char_tables()
+        self.scorer = windowScorer(self.lm,self.model_n,self.word_ids,self.id_words)
+        self.graph = editGraph(self.allWords)
+        self.index_model = self.lm
+
+    def unigram_model(self,lm):
+        """Returns a unigram model of the words of all the ngrams of a language model that
+            can not derive one (has no lower_order_model()), built once per model.
+
+            Args:
+                lm: a language model object
+        """
+        if getattr(self,"unigram_source",None) is not lm:
+            self.unigram_lm = Ngram_Language_Model(n = 1)
+            self.unigram_lm.build_model(" ".join([item for key,count in lm.get_model().items() for item in [key]*count]))
+            self.unigram_source = lm
+        return self.unigram_lm
+
+    def clear_candidate_cache(self):
+        """Drops the cached candidates (the vocabulary of the language model changed)
+            and resets the hit/miss counters.
+        """
+        self.candidate_cache = OrderedDict()
+        self.candidate_cache_hits = 0
+        self.candidate_cache_misses = 0
+
+    def candidate_cache_info(self):
+        """Returns the candidate cache counters, to size the cache for a stream of texts.
+
+            Returns:
+                dict with the hits, misses, current size and max size of the cache.
+        """
+        return {"hits" : self.candidate_cache_hits, "misses" : self.candidate_cache_misses,
+                "size" : len(self.candidate_cache), "max_size" : self.candidate_cache_size}
+    
+    def clear_channel_cache(self):
+        """Drops the cached channel probabilities (the error tables or the vocabulary changed)
+            and resets the hit/miss counters.
+        """
+        self.channel_cache = OrderedDict()
+        self.channel_cache_hits = 0
+        self.channel_cache_misses = 0
+
+    def channel_cache_info(self):
+        """Returns the channel probability cache counters.
+
+            Returns:
+                dict with the hits, misses, hit rate, current size and max size of the cache.
+        """
+        lookups = self.channel_cache_hits + self.channel_cache_misses
+        return {"hits" : self.channel_cache_hits, "misses" : self.channel_cache_misses,
+                "hit_rate" : self.channel_cache_hits / lookups if lookups else 0.0,
+                "size" : len(self.channel_cache), "max_size" : self.channel_cache_size}
+
+    @staticmethod
+    def newStats():
+        """Returns empty spell_check stats, see spell_check_stats().
+        """
+        return {"tokens" : 0, "candidates" : 0, "scored" : 0, "pruned" : 0, "lm_calls" : 0,
+                "candidate_cache_hits" : 0, "channel_cache_hits" : 0, "channel_cache_misses" : 0,
+                "seconds" : dict.fromkeys(("index","candidates","edit_distance","channel","lm","rescore","total"),0.0)}
+
+    def spell_check_stats(self):
+        """Returns the counters and the time per phase of the last spell_check call.
+
+            Returns:
+                dict with the number of tokens, of candidates generated, scored by the language model
+                and pruned, of language model calls and of candidate and channel cache hits, and
+                "seconds", the time of every phase: index (preparing the model), candidates,
+                edit_distance (aligning the candidates), channel (the channel probabilities), lm
+                (scoring the windows or the lattice search), rescore (the whole text rescoring)
+                and total.
+        """
+        return self.stats
+
+    def clear_pruning_info(self):
+        """Resets the counters of the scored and pruned candidates.
+        """
+        self.scored_candidates = 0
+        self.pruned_candidates = 0
+
+    def pruning_info(self):
+        """Returns the candidate pruning counters (of all the spell_check calls since the last reset).
+
+            Returns:
+                dict with the number of candidates scored by the language model and the number pruned.
+        """
+        return {"scored" : self.scored_candidates, "pruned" : self.pruned_candidates}
     
-    def learn_error_tables(self,error_file):
+    def learn_error_tables(self,error_file,workers = 1,chunk_size = 1000,progress = None):
         """Returns a nested dictionary {str:dict} where str is in:
                 <'deletion', 'insertion', 'transposition', 'substitution'> and the
                 inner dict {str: int} represents the confution matrix of the
@@ -294,29 +1734,41 @@ class Spell_Checker:
                 Args:
                     errors_file (str): full path to the errors file. File format, TSV:
                                         <error>    <correct>
+                    workers (int): the number of processes aligning the pairs. Defaults to 1
+                    chunk_size (int): the number of lines aligned per task. Defaults to 1000
+                    progress (callable): called with the number of lines aligned so far after every chunk.
+                                        Defaults to None
     
     
                 Returns:
                     A dictionary of confusion "matrices" by error type (dict).
             """
         self.error_table = self.createDict()
+        alignedLines = 0
 
-        #: read file
-        f = open(error_file, 'r')
-        for line in f:
-            
+        #: read file, a chunk of lines at a time
+        with open(error_file, 'r') as f:
             # Split on any whitespace (including tab characters)
-            row = line.split()
-            # Convert strings to numeric values:
-            wrong = row[0]
-            correct = row[1]
-            #create error table for calculate distnce operators
-            table = EditDist(wrong,correct) #:toAdd : transposition implamantation.
-            table.setErrorWordTable(self.error_table)
-            table.fillTable()
-            self.error_table = table.getOpeartions()
-            # Append to our list of lists:
-        f.close()
+            chunks = iter(lambda: [tuple(line.split()[:2]) for line in islice(f, chunk_size)], [])
+            if workers > 1:
+                pool = multiprocessing.Pool(workers)
+                #: only workers*2 chunks are read ahead, so the file is never held in memory
+                tables = (table for window in iter(lambda: list(islice(chunks, workers * 2)), [])
+                          for table in pool.imap(align_error_chunk, window))
+            else:
+                pool = None
+                tables = map(align_error_chunk, chunks)
+            try:
+                for pairsCount,errorTable in tables:
+                    for errorType,counter in errorTable.items():
+                        self.error_table[errorType].update(counter)
+                    alignedLines += pairsCount
+                    if progress:
+                        progress(alignedLines)
+            finally:
+                if pool:
+                    pool.close()
+                    pool.join()
         return self.error_table
     def add_error_tables(self, error_tables):
         """ Adds the speficied dictionary of error tables as an instance variable.
@@ -324,9 +1776,74 @@ class Spell_Checker:
 
             Args:
                 error_tables (dict): a dictionary of error tables in the format
-                returned by  learn_error_tables()
+                returned by  learn_error_tables(), or Confusion_Matrices (e.g. loaded from a file)
+        """
+        if isinstance(error_tables, Confusion_Matrices):
+            self.error_table = error_tables.error_tables()
+            self.confusion = error_tables
+            self.confusion_source = self.error_table
+            self.confusion.prepare_channel(None)
+        else:
+            self.error_table = error_tables
+
+    def channel_matrices(self):
+        """Returns the Confusion_Matrices of the error tables, with the channel probabilities
+            of the current vocabulary. rebuilt only when the error tables or the vocabulary change.
+        """
+        if getattr(self,"confusion_source",None) is not self.error_table:
+            self.confusion = Confusion_Matrices(self.error_table)
+            self.confusion_source = self.error_table
+        if self.confusion.channel_index is not self.char_index:
+            self.confusion.prepare_channel(self.char_index,self.char_unigram_counts,self.char_bigram_counts)
+            self.clear_channel_cache()
+        return self.confusion
+
+    def channelProbabilities(self,word,correctWords,probabiltyDict,log = False):
+        """ Returns the channel probability of every candidate of a word. the probabilities are
+            cached by (word, candidate, log) until the error tables or the vocabulary change, the
+            missing ones are aligned all at once.
+            (replace the error tables with add_error_tables() rather than updating them in place)
+
+            Args:
+                word (str): the word to correct.
+                correctWords (list): the candidates.
+                probabiltyDict (dict): the probability of every error (see createDict).
+                log (bool): True for the log probabilities (-inf for 0). Defaults to False
+
+            Returns:
+                list of the probabilities, in the order of correctWords.
         """
-        self.error_table = error_tables
+        clock = timeit.default_timer
+        seconds = self.stats["seconds"]
+        start = clock()
+        self.channel_matrices() #: clears the cache if the tables changed
+        cache = self.channel_cache
+        channels = []
+        missing = []
+        for position,correctWord in enumerate(correctWords):
+            channel = cache.get((word,correctWord,log))
+            if channel is None:
+                missing.append(position)
+            else:
+                cache.move_to_end((word,correctWord,log))
+            channels.append(channel)
+        self.channel_cache_hits += len(correctWords) - len(missing)
+        self.channel_cache_misses += len(missing)
+        self.stats["channel_cache_hits"] += len(correctWords) - len(missing)
+        self.stats["channel_cache_misses"] += len(missing)
+        if missing:
+            #: align the word against all the missing candidates at once
+            aligned = clock()
+            allOpeartions = EditDist.batchOpeartions("#"+word,["#"+correctWords[position] for position in missing])
+            seconds["edit_distance"] += clock() - aligned
+            start += clock() - aligned #: the channel time does not include the alignment
+            for position,dictErrorType in zip(missing,allOpeartions):
+                channel = channels[position] = self.fillProbabiltyNoiseChannelDict(probabiltyDict,correctWords[position],word,dictErrorType,log)
+                cache[(word,correctWords[position],log)] = channel
+            while len(cache) > self.channel_cache_size:
+                cache.popitem(last = False)
+        seconds["channel"] += clock() - start
+        return channels
 
 
 
@@ -341,7 +1858,7 @@ class Spell_Checker:
                Float. The float should reflect the (log) probability.
         """
         return self.lm.evaluate(text)
-    def spell_check(self,text,alpha):
+    def spell_check(self,text,alpha,decoder = "rows",beam_width = 8,max_corrections = None):
         """ Returns the most probable fix for the specified text. Use a simple
              noisy channel model if the number of tokens in the specified text is
              smaller than the length (n) of the language model.
@@ -354,55 +1871,73 @@ class Spell_Checker:
              Args:
                  text (str): the text to spell check.
                  alpha (float): the probability of keeping a lexical word as is.
+                 decoder (str): "rows" to pick the best single correction by rescoring the whole
+                    text once per word, "lattice" for a beam search over the candidates of all
+                    the words (linear in the text length, may correct several words, see
+                    decode_lattice()). Defaults to "rows"
+                 beam_width (int): the hypotheses kept per word by the "lattice" decoder, None for
+                    an exact Viterbi search. Defaults to 8
+                 max_corrections (int): the max number of corrected words of the "lattice" decoder,
+                    None for no limit. Defaults to None
         
              Return:
                  A modified string (or a copy of the original if no corrections are made.)
         """
+        if decoder not in ("rows","lattice"):
+            raise ValueError("unknown decoder %r, expected 'rows' or 'lattice'" % (decoder,))
         self.alpha = alpha
-        overallWordCount = 0
+        clock = timeit.default_timer
+        started = clock()
+        stats = self.stats = self.newStats()
+        seconds = stats["seconds"]
         simpleModleMode = False
-        text = normalize_text(text).split()
+        text = [word for token in iter_tokens(text) for word in token.split()]
         textLength = len(text)
-        #: create unique words and word dict with count
-        wordDict = self.lm.get_model()
-        allWords = set([key.split()[0] for key in wordDict.keys()])
-        N = len(next(iter(wordDict)).split())
+        stats["tokens"] = textLength
+        if self.index_model is not self.lm: #: the model was set directly or built after it was attached
+            self.prepare_index()
+        N = self.model_n
         
         #: 
         if N > textLength:
-            newText = " ".join([item for key,count in wordDict.items() for item in [key]*count])
             oldModel  = self.lm
-            self.add_language_model(Ngram_Language_Model(n =1))
-            self.lm.build_model(newText)
+            #: the unigram model is derived from the counts (and cached by the model), same vocabulary
+            #: so the candidate cache is kept
+            self.lm = oldModel.lower_order_model(1) if hasattr(oldModel,"lower_order_model") else self.unigram_model(oldModel)
             N = 1
             simpleModleMode = True 
         
-        countWords = Counter()
-        for key,value in wordDict.items():
-            countWords["#"+key.split()[0]]+=value
-            overallWordCount+=value
-            
-        #: create related work for each word
-        relatedWordsDict = {}
-        graph = editGraph(allWords)
+        graph = self.graph
+        if simpleModleMode:
+            if getattr(self,"unigram_scorer",None) is None or self.unigram_scorer.lm is not self.lm:
+                self.unigram_scorer = windowScorer(self.lm,N,self.word_ids,self.id_words)
+            scorer = self.unigram_scorer
+        else:
+            scorer = self.scorer
+        scorer.newText()
+        ids = scorer.encode(text)
+        lmCalls = scorer.lmCalls
         # calculate Probabilty Noise Channel by fill dict
-        denominatorCounter = Counter() 
         probabiltyDict = self.createDict()
+        seconds["index"] = clock() - started
         
+        if decoder == "lattice":
+            corrected = self.decode_lattice(text,ids,scorer,N,probabiltyDict,beam_width,max_corrections)
+            if simpleModleMode:
+                self.lm = oldModel
+            stats["lm_calls"] = scorer.lmCalls - lmCalls
+            seconds["total"] = clock() - started
+            return " ".join(corrected)
        
         tableCorrection = []
         for wordIndes,word in enumerate(text):
             if word == ".":
                 continue
             
-            
-            if word not in relatedWordsDict:
-                relatedWordsDict[word] = graph.getAllRelatedWords(word)
-        
-            correctWords = relatedWordsDict[word]
-            if word in correctWords:
-                correctWords.remove(word)
-                
+            start = clock()
+            correctWords = self.getCandidates(word,graph) - {word}
+            seconds["candidates"] += clock() - start
+            stats["candidates"] += len(correctWords)
 
             #: check if there is not any word to replace
             if len(correctWords) == 0:
@@ -418,40 +1953,63 @@ class Spell_Checker:
             
         
             #run over all possible replacment
-                       
-            for correctWord in correctWords:
-                textReplaced = text[:]
-                textReplaced[wordIndes] = correctWord
-                
-                ProbabiltyNoiseChannel = self.fillProbabiltyNoiseChannelDict(probabiltyDict,correctWord,word,countWords,denominatorCounter) 
+            correctWords = list(correctWords)
+            channels = self.channelProbabilities(word,correctWords,probabiltyDict)
+            for ProbabiltyNoiseChannel in channels:
                 ProbabiltyNoiseChannelSum += ProbabiltyNoiseChannel
-                
+            
+            start = clock()
+            #: the word kept, a candidate that can not beat it is never chosen (the row is the kept word either way)
+            if (maxIndex - minIndex) >= N:
+                keepValue = self.alpha * scorer.score(ids,minIndex,maxIndex,wordIndes,ids[wordIndes])
+                upperBound = scorer.bound(ids,minIndex,maxIndex,wordIndes) if self.prune_candidates else 1
+            else:
+                keepValue = self.alpha
+                upperBound = 1
+            normalizer = ProbabiltyNoiseChannelSum /(1- self.alpha) if ProbabiltyNoiseChannelSum else 1
+            #: the most probable errors first, so the bound cuts the tail. a tie goes to the first
+            #: candidate in the set order, as without pruning
+            order = list(range(len(correctWords)))
+            if self.prune_candidates:
+                order.sort(key = lambda position : -channels[position])
+            chosenPosition = -1
+            for step,position in enumerate(order):
+                ProbabiltyNoiseChannel = channels[position]
                 if ProbabiltyNoiseChannel == 0 :
                     continue
+                candidateBound = ProbabiltyNoiseChannel*upperBound
+                if self.prune_candidates and (candidateBound < chosenWord["modelErrorValue"] or candidateBound/normalizer < keepValue):
+                    #: the later candidates have a smaller channel probability, none can win
+                    pruned = sum(1 for rest in order[step:] if channels[rest] > 0)
+                    self.pruned_candidates += pruned
+                    stats["pruned"] += pruned
+                    break
+                correctWord = correctWords[position]
+                self.scored_candidates += 1
+                stats["scored"] += 1
                 
                 if (maxIndex - minIndex) >= N:
-                    ProbabiltyLengModel = math.exp(self.lm.evaluate(" ".join(textReplaced[minIndex:maxIndex])))
+                    ProbabiltyLengModel = scorer.score(ids,minIndex,maxIndex,wordIndes,self.word_ids[correctWord])
                 else:
                     ProbabiltyLengModel = 1
                 modelErrorValue = ProbabiltyNoiseChannel*ProbabiltyLengModel
                 # print(word , correctWord,modelErrorValue) #debug
-                if chosenWord["modelErrorValue"] < modelErrorValue:
+                if chosenWord["modelErrorValue"] < modelErrorValue or (chosenWord["modelErrorValue"] == modelErrorValue and position < chosenPosition):
                     chosenWord["correctWord"] = correctWord
                     chosenWord["modelErrorValue"] = modelErrorValue
                     chosenWord["ProbabiltyNoiseChannel"] = ProbabiltyNoiseChannel
+                    chosenPosition = position
+            #: the keep the word row below gets the channel probability of the last candidate
+            ProbabiltyNoiseChannel = channels[-1]
             #: normalize by 1 -alpha
             if ProbabiltyNoiseChannelSum == 0:
                 chosenWord["modelErrorValue"] = 0
             else: 
-                chosenWord["modelErrorValue"] /= (ProbabiltyNoiseChannelSum /(1- self.alpha))
+                chosenWord["modelErrorValue"] /= normalizer
             
             #: compere to dont replace the word
-            
-            if (maxIndex - minIndex) >= N:
-                    ProbabiltyLengModel = math.exp(self.lm.evaluate(" ".join(text[minIndex:maxIndex])))
-            else:
-                   ProbabiltyLengModel = 1
-            modelErrorValue = self.alpha * ProbabiltyLengModel
+            modelErrorValue = keepValue
+            seconds["lm"] += clock() - start
 
             # print(word , word,modelErrorValue) #debug
             #: the best replacement for this word is itself :)
@@ -467,23 +2025,150 @@ class Spell_Checker:
         
         
         #final words score
+        start = clock()
         bestString = ["",-math.inf]
         # print(tableCorrection)
         for wordRaw in tableCorrection:
-            textReplaced = text[:]
             if wordRaw["index"] > -1:
-                textReplaced[wordRaw["index"]] = wordRaw["correctWord"]
-
-            ProbabiltyLengModel = math.exp(self.lm.evaluate(" ".join(textReplaced)))
+                ProbabiltyLengModel = scorer.score(ids,0,textLength,wordRaw["index"],self.word_ids[wordRaw["correctWord"]])
+            else:
+                ProbabiltyLengModel = scorer.score(ids,0,textLength)
             modelErrorValueFinal = ProbabiltyLengModel* wordRaw["ProbabiltyNoiseChannel"]
             if bestString[1] < modelErrorValueFinal:
-                bestString[0] = textReplaced
+                bestString[0] = wordRaw
                 bestString[1]  = modelErrorValueFinal
+
+        if bestString[0]:
+            wordRaw,bestString[0] = bestString[0],text[:]
+            if wordRaw["index"] > -1:
+                bestString[0][wordRaw["index"]] = wordRaw["correctWord"]
                 
         if simpleModleMode:
-            self.add_language_model = oldModel
+            self.lm = oldModel
+        stats["lm_calls"] = scorer.lmCalls - lmCalls
+        seconds["rescore"] = clock() - start
+        seconds["total"] = clock() - started
 
         return " ".join(bestString[0])
+
+    def decode_lattice(self,text,ids,scorer,n,probabiltyDict,beam_width = 8,max_corrections = None):
+        """ Returns the most probable words of a text by a beam search over a lattice of the
+             candidates of every word. a word is kept with probability alpha or replaced by a
+             candidate with probability (1 - alpha) * channel / sum of the channels of its
+             candidates, and the hypotheses are extended one word at a time with the log
+             probability of the ngram they complete (smoothed after an unseen ngram, as
+             lm.evaluate does). hypotheses with the same last n-1 words are merged (Viterbi).
+
+             Args:
+                 text (list): the words of the text.
+                 ids (list): the ids of the words (scorer.encode(text)).
+                 scorer (windowScorer): the scorer of the language model.
+                 n (int): the order of the language model.
+                 probabiltyDict (dict): the channel probability cache (see createDict).
+                 beam_width (int): the hypotheses kept per word, None for all. Defaults to 8
+                 max_corrections (int): the max number of corrected words, None for no limit. Defaults to None
+
+             Return:
+                 list of the corrected words.
+        """
+        clock = timeit.default_timer
+        stats = self.stats
+        seconds = stats["seconds"]
+        #: (last n-1 ids, smooth, corrections) -> (log probability, (id, previous backpointer))
+        beam = {((),False,0) : (0.0,None)}
+        for index,word in enumerate(text):
+            options = [(ids[index],0,0.0)] #: (id, is a correction, log weight)
+            if word != ".":
+                start = clock()
+                correctWords = list(self.getCandidates(word,self.graph) - {word})
+                seconds["candidates"] += clock() - start
+                stats["candidates"] += len(correctWords)
+                logChannels = self.channelProbabilities(word,correctWords,probabiltyDict,log = True)
+                maxLogChannel = max(logChannels,default = -math.inf)
+                if maxLogChannel > -math.inf and self.alpha > 0:
+                    options[0] = (ids[index],0,math.log(self.alpha))
+                if maxLogChannel > -math.inf and self.alpha < 1:
+                    #: log of (1 - alpha) * channel / sum of the channels, the sum taken in log space
+                    logChannelSum = maxLogChannel + math.log(sum(math.exp(logChannel - maxLogChannel) for logChannel in logChannels))
+                    logWeight = math.log(1 - self.alpha) - logChannelSum
+                    options.extend((self.word_ids[correctWord],1,logWeight + logChannel)
+                                   for correctWord,logChannel in zip(correctWords,logChannels) if logChannel > -math.inf)
+                    if self.alpha == 0:
+                        options.pop(0)
+            
+            start = clock()
+            nextBeam = {}
+            for (context,smooth,corrections),(logProbability,backpointer) in beam.items():
+                for wordId,correction,logWeight in options:
+                    if correction and max_corrections is not None and corrections >= max_corrections:
+                        continue
+                    ngram = context + (wordId,)
+                    score = logProbability + logWeight
+                    nextSmooth = smooth
+                    if len(ngram) == n:
+                        logFactor,nextSmooth = scorer.logFactor(ngram,smooth)
+                        score += logFactor
+                        ngram = ngram[1:]
+                    if word == ".":
+                        nextSmooth = False #: an unseen ngram smooths the rest of its sentence only
+                    state = (ngram,nextSmooth,corrections + correction if max_corrections is not None else 0)
+                    best = nextBeam.get(state)
+                    stats["scored"] += correction
+                    if best is None or best[0] < score:
+                        nextBeam[state] = (score,(wordId,backpointer))
+            if beam_width is not None and len(nextBeam) > beam_width:
+                nextBeam = dict(sorted(nextBeam.items(),key = lambda item : -item[1][0])[:beam_width])
+            beam = nextBeam
+            seconds["lm"] += clock() - start
+        
+        backpointer = max(beam.values(),key = lambda hypothesis : hypothesis[0])[1]
+        corrected = []
+        while backpointer is not None:
+            wordId,backpointer = backpointer
+            corrected.append(wordId)
+        return scorer.decode(corrected[::-1])
+
+    def spell_check_many(self,texts,alpha,workers = 1,chunk_size = 100,progress = None):
+        """ Yields spell_check(text, alpha) of every text, in the order of the texts.
+             The texts are read as a stream. With workers > 1 they are checked by a pool of
+             processes that get a copy of this spell checker (shared copy on write where the
+             processes are forked), with its prepared index, error tables and caches. One
+             imap over all the texts hands them out chunk_size texts per task, so a worker
+             takes the next chunk as soon as it is done (the pool reads the texts ahead).
+
+             Args:
+                 texts (iterable): the texts (str) to spell check, e.g. the lines of a file.
+                 alpha (float): the probability of keeping a lexical word as is.
+                 workers (int): the number of processes. Defaults to 1
+                 chunk_size (int): the number of texts per task. Defaults to 100
+                 progress (callable): called with the number of texts checked so far and the
+                                     texts/sec after every chunk_size texts. Defaults to None
+
+             Return:
+                 generator of the modified strings.
+        """
+        if self.index_model is not self.lm:
+            self.prepare_index() #: once here, not in every worker
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initializer=set_worker_spell_checker, initargs=(self,))
+            checked = pool.imap(spell_check_text, ((text,alpha) for text in texts), chunksize = chunk_size)
+        else:
+            pool = None
+            checked = (self.spell_check(text,alpha) for text in texts)
+        checkedTexts = 0
+        start = timeit.default_timer()
+        try:
+            for fixedText in checked:
+                yield fixedText
+                checkedTexts += 1
+                if progress and checkedTexts % chunk_size == 0:
+                    progress(checkedTexts, checkedTexts / max(timeit.default_timer() - start, 1e-9))
+            if progress and checkedTexts % chunk_size:
+                progress(checkedTexts, checkedTexts / max(timeit.default_timer() - start, 1e-9))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
             
                  
             
@@ -492,14 +2177,76 @@ class Spell_Checker:
                        
                        
     #### added function to class by me
-    def fillProbabiltyNoiseChannelDict(self,probabiltyDict,correct,wrong,countWords,denominatorCounter):
+    def getCandidates(self,word,graph):
+        """ Returns the known words up to 2 edits from word, through the LRU candidate cache
+             Args:
+                 word (str): the word to correct.
+                 graph (editGraph): the candidates index of the current vocabulary.
+
+             Return:
+                set of candidate words (shared with the cache, do not modify)
+        """
+        candidates = self.candidate_cache.get(word)
+        if candidates is not None:
+            self.candidate_cache_hits += 1
+            self.stats["candidate_cache_hits"] += 1
+            self.candidate_cache.move_to_end(word)
+            return candidates
+        self.candidate_cache_misses += 1
+        candidates = graph.getAllRelatedWords(word)
+        self.candidate_cache[word] = candidates
+        if len(self.candidate_cache) > self.candidate_cache_size:
+            self.candidate_cache.popitem(last=False)
+        return candidates
+
+    def build_char_tables(self):
+        """ Builds the frequency weighted char unigram and bigram counts of the vocabulary
+             (the words of countWords, with the "#" prefix), as numpy arrays indexed by char_index.
+             A bigram is counted like str.count does, so runs of the same char are not overlapped.
+        """
+        words = list(self.countWords.keys())
+        alphabet = sorted(set("".join(words)))
+        self.char_index = {char : index for index,char in enumerate(alphabet)}
+        size = len(alphabet)
+        #: all the words in one array of char ids, with the id `size` between words (words have no whitespace)
+        joined = "\n".join(words)
+        codes = np.fromiter((self.char_index.get(char, size) for char in joined), dtype=np.int64, count=len(joined))
+        lengths = np.fromiter((len(word) + 1 for word in words), dtype=np.int64, count=len(words))
+        weights = np.repeat(np.fromiter(self.countWords.values(), dtype=np.float64, count=len(words)), lengths)[:len(codes)]
+        self.char_unigram_counts = np.bincount(codes, weights, minlength=size + 1)[:size].astype(np.int64)
+
+        first,second,pairWeights = codes[:-1],codes[1:],weights[:-1]
+        positions = np.arange(len(codes))
+        runStart = np.maximum.accumulate(np.where(np.r_[True, second != first], positions, 0))[:-1]
+        keep = (first != size) & (second != size) & ((first != second) | ((positions[:-1] - runStart) % 2 == 0))
+        bigrams = first[keep] * size + second[keep]
+        self.char_bigram_counts = np.bincount(bigrams, pairWeights[keep], minlength=size * size).astype(np.int64).reshape(size, size)
+
+    def char_count(self,chars):
+        """ Returns the frequency weighted count of a char or a two chars string in the vocabulary
+             Args:
+                 chars (str): one or two chars.
+
+             Return:
+                int count (0 for chars not in the vocabulary)
+        """
+        indexes = [self.char_index.get(char) for char in chars]
+        if None in indexes:
+            return 0
+        if len(indexes) == 1:
+            return int(self.char_unigram_counts[indexes[0]])
+        return int(self.char_bigram_counts[indexes[0], indexes[1]])
+
+    def fillProbabiltyNoiseChannelDict(self,probabiltyDict,correct,wrong,dictErrorType = None,log = False):
         """ Returns the ProbabiltyNoiseChannel for 2 words 
              Args:
                  probabiltyDict (dict): probabilty NoiseChannel for each word.
                  correct (str):correct word.
                  wrong (str):wrong word.
-                 countWords (dict): occurnce for each word
-                 denominatorCounter (dict): saved denominator for each chars and error type
+                 dictErrorType (dict): the operations of "#"+wrong to "#"+correct if already
+                     computed (see EditDist.batchOpeartions). Defaults to None
+                 log (bool): True for the log probability, the sum of the log_channel of the
+                     errors. Defaults to False
 
         
              Return:
@@ -509,45 +2256,33 @@ class Spell_Checker:
 
         
         #collect char errors
-        table = EditDist("#"+wrong,"#" + correct)
-        table.fillTable()
-        dictErrorType = table.getOpeartions()
+        if dictErrorType is None:
+            table = EditDist("#"+wrong,"#" + correct)
+            table.fillTable()
+            dictErrorType = table.getOpeartions()
         for errorType,charsCountDict in dictErrorType.items():
             for errorChars,value in charsCountDict.items():
                 listOfError.extend([(errorChars,errorType)] * value)
                 
         
-        normalizeDict = {"substitution" : lambda word,chars : word.count(chars[1]),
-                         "insertion" : lambda word,chars : word.count(chars[0]),
-                         "deletion" : lambda word,chars : word.count(chars),
-                         "transposition" : lambda word,chars : word.count(chars)}
+        confusion = self.channel_matrices()
+        if log:
+            #: the log matrices are precomputed, no per call cache needed
+            return sum(confusion.probability(errorType,errorChars,log = True) for errorChars,errorType in listOfError)
         
         probabiltyAll = 1
         for errorChars,errorType in listOfError:
             #: check if this error type and chars were before
             if errorChars not in probabiltyDict[errorType]:
-                #calculate the nominator
-                try:
-                    nominator = self.error_table[errorType][errorChars]
-                except KeyError: 
-                    nominator = 0
-                #calculate the denominator
-                if denominatorCounter[(errorChars,errorType)] == 0:
-                    denominator = 0
-                    for word,count in countWords.items():
-                        denominator += normalizeDict[errorType](word,errorChars) * count
-                    if denominator == 0:
-                        print("error") #debug
-                    denominatorCounter[(errorChars,errorType)] = denominator
-                probabilty = nominator/denominator
-                
-                probabiltyDict[errorType][errorChars] = probabilty
+                #: count/denominator is precomputed in the channel matrices
+                probabiltyDict[errorType][errorChars] = confusion.probability(errorType,errorChars)
             probabiltyAll*= probabiltyDict[errorType][errorChars]
             
             
         return probabiltyAll
     
-    def createDict(self):
+    @staticmethod
+    def createDict():
         """ init error table scheme
             
         
@@ -565,10 +2300,391 @@ class Spell_Checker:
 
 
 
+CONFUSION_FILE_MAGIC = b"CONFMAT1\n"
+ERROR_TYPES = ("substitution", "insertion", "deletion", "transposition")
+
+
+class Confusion_Matrices:
+    """The error tables as dense count matrices, one |alphabet| x |alphabet| matrix per error
+        type (in ERROR_TYPES order) where the 'xy' entry of a table is counts[type, x, y].
+        The alphabet is a-z, '#' and any other char of the tables. Once the char counts of a
+        vocabulary are set, the channel probabilities (count / denominator, and their log)
+        are precomputed as matrices of the same shape, so a lookup is array indexing.
+    """
+
+    def __init__(self, error_tables=None):
+        """Initializing the matrices.
+
+        Args:
+            error_tables (dict): error tables in the format returned by learn_error_tables(). Defaults to None
+        """
+        self.alphabet = ""
+        self.char_index = {}
+        self.counts = np.zeros((len(ERROR_TYPES), 0, 0), dtype=np.int64)
+        self.prepare_channel(None)
+        if error_tables is not None:
+            self.from_error_tables(error_tables)
+
+    def from_error_tables(self, error_tables):
+        """populates the count matrices from error tables.
+
+            Args:
+                error_tables (dict): error tables in the format returned by learn_error_tables().
+
+            Returns:
+                The matrices (self).
+        """
+        chars = set("abcdefghijklmnopqrstuvwxyz#")
+        for table in error_tables.values():
+            for key in table:
+                chars.update(key)
+        self.alphabet = "".join(sorted(chars))
+        self.char_index = {char: index for index,char in enumerate(self.alphabet)}
+        self.counts = np.zeros((len(ERROR_TYPES), len(self.alphabet), len(self.alphabet)), dtype=np.int64)
+        for type_index,error_type in enumerate(ERROR_TYPES):
+            for key,count in error_tables.get(error_type, {}).items():
+                if len(key) == 2:
+                    self.counts[type_index, self.char_index[key[0]], self.char_index[key[1]]] += count
+        self.prepare_channel(None)
+        return self
+
+    def error_tables(self):
+        """Returns the matrices as error tables, a dict of Counters (the non zero entries) by error type.
+        """
+        error_tables = {}
+        for type_index,error_type in enumerate(ERROR_TYPES):
+            error_tables[error_type] = Counter()
+            for row,column in zip(*np.nonzero(self.counts[type_index])):
+                error_tables[error_type][self.alphabet[row] + self.alphabet[column]] = int(self.counts[type_index, row, column])
+        return error_tables
+
+    def prepare_channel(self, char_index, unigram_counts=None, bigram_counts=None):
+        """precomputes the channel probability matrices for the char counts of a vocabulary
+            (see Spell_Checker.build_char_tables). the denominator of a substitution 'xy' is the
+            count of y, of an insertion 'xy' the count of x and of a deletion or a transposition
+            'xy' the count of the bigram. an entry with a zero denominator gets probability 0.
+
+            Args:
+                char_index (dict): the index of every char of the vocabulary, None to drop the probabilities.
+                unigram_counts (np.array): the count of every char.
+                bigram_counts (np.array): the count of every two chars.
+        """
+        self.channel_index = char_index
+        if char_index is None:
+            self.channel = self.log_channel = None
+            return
+        #: the vocabulary counts of the chars of the alphabet, 0 for chars not in the vocabulary
+        indexes = np.array([char_index.get(char, -1) for char in self.alphabet], dtype=np.int64)
+        known = indexes >= 0
+        unigrams = np.where(known, unigram_counts[np.maximum(indexes, 0)] if len(unigram_counts) else 0, 0)
+        bigrams = np.zeros((len(self.alphabet), len(self.alphabet)), dtype=np.int64)
+        bigrams[np.ix_(known, known)] = bigram_counts[np.ix_(indexes[known], indexes[known])]
+        denominators = np.stack([np.broadcast_to(unigrams[None, :], bigrams.shape), #: substitution
+                                 np.broadcast_to(unigrams[:, None], bigrams.shape), #: insertion
+                                 bigrams, bigrams]) #: deletion, transposition
+        self.channel = np.divide(self.counts, denominators, out=np.zeros(self.counts.shape), where=denominators != 0)
+        with np.errstate(divide='ignore'):
+            self.log_channel = np.log(self.channel)
+
+    def probability(self, error_type, chars, log=False):
+        """Returns the channel probability of an error.
+
+            Args:
+                error_type (str): one of ERROR_TYPES.
+                chars (str): the two chars of the error.
+                log (bool): True for the log probability. Defaults to False
+
+            Returns:
+                float. 0 (-inf in log) for chars that are not in the alphabet.
+        """
+        row = self.char_index.get(chars[0])
+        column = self.char_index.get(chars[1])
+        if row is None or column is None:
+            return -math.inf if log else 0.0
+        matrices = self.log_channel if log else self.channel
+        return float(matrices[ERROR_TYPES.index(error_type), row, column])
+
+    def save(self, path):
+        """writes the count matrices to one binary file that load() can memory-map.
+            the file is a magic line, a json header (the alphabet, the shape and the offset
+            of the matrices) and the int64 matrices aligned to 64 bytes.
+
+            Args:
+                path (str): the file to write.
+        """
+        header = {"alphabet": self.alphabet, "error_types": list(ERROR_TYPES), "shape": list(self.counts.shape)}
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = -(-(len(CONFUSION_FILE_MAGIC) + 8 + len(header_bytes)) // 64) * 64
+        with open(path, 'wb') as f:
+            f.write(CONFUSION_FILE_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            f.seek(data_start)
+            f.write(np.ascontiguousarray(self.counts, dtype=np.int64).tobytes())
+
+    def load(self, path, mmap=True):
+        """populates the matrices from a file written by save().
+
+            Args:
+                path (str): the file to read.
+                mmap (bool): True to memory-map the counts (read only) instead of reading them. Defaults to True
+
+            Returns:
+                The loaded matrices (self).
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(CONFUSION_FILE_MAGIC)) != CONFUSION_FILE_MAGIC:
+                raise ValueError("%s is not a saved confusion matrices file" % path)
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = -(-(len(CONFUSION_FILE_MAGIC) + 8 + header_length) // 64) * 64
+        shape = tuple(header["shape"])
+        if mmap and shape[1] > 0:
+            self.counts = np.memmap(path, dtype=np.int64, mode='r', offset=data_start, shape=shape)
+        else:
+            self.counts = np.fromfile(path, dtype=np.int64, count=int(np.prod(shape)), offset=data_start).reshape(shape)
+        self.alphabet = header["alphabet"]
+        self.char_index = {char: index for index,char in enumerate(self.alphabet)}
+        self.prepare_channel(None)
+        return self
+
+
+class windowScorer():
+    """ scores windows of a text (as token ids) like exp(lm.evaluate(window)), where one
+        token of the window may be replaced. the factors of the ngrams are memoized, and the
+        ngrams that end before the replaced token are multiplied once per window.
+    """
+    def __init__(self,lm,n,wordIds,idWords,maxNgrams = 1 << 20):
+        """ init windowScorer
+            Args:
+                 lm: the language model.
+                 n (int): the order of the language model.
+                 wordIds (dict): the id of every word of the model.
+                 idWords (list): the word of every id.
+                 maxNgrams (int): the memo of the model ngrams is cleared when it grows above it.
+                    Defaults to 1 << 20
+        """
+        self.lm = lm
+        self.n = n
+        self.wordIds = wordIds
+        self.idWords = idWords
+        self.maxNgrams = maxNgrams
+        self.ngrams = {} #: ngram ids -> [probability (None if the ngram is not in the model), smoothed or None]
+        self.byNgrams = hasattr(lm,"probability") and hasattr(lm,"smooth")
+        self.maxFactors = None #: (slot, ngram ids without the slot) -> max [probability, smoothed], built by bound()
+        self.unseenFactor = None #: the max smoothed probability of an ngram that is not in the model
+        self.lmCalls = 0 #: the number of calls to the model
+        self.newText()
+
+    def newText(self):
+        """ drops what is only valid for the current text (the ids of the out of vocabulary words
+            and the windows), the factors of the model ngrams are kept.
+        """
+        self.oovIds = {} #: ids of the words that are not in the model, after the model ids
+        self.oovWords = []
+        self.oovNgrams = {} #: like ngrams, for the ngrams with an out of vocabulary word
+        self.prefixes = {} #: (start, stop) -> (likelihod, smooth) of the ngrams starting in range(start, stop)
+        self.scores = {} #: (start, end, replaced index, replacement) -> score
+        if len(self.ngrams) > self.maxNgrams:
+            self.ngrams = {}
+
+    def encode(self,words):
+        """ Returns the token ids of the words, new ids for the words not in the model.
+            Args:
+                 words (list): the words of the text.
+        """
+        ids = []
+        for word in words:
+            index = self.wordIds.get(word)
+            if index is None:
+                index = self.oovIds.get(word)
+            if index is None:
+                index = self.oovIds[word] = len(self.idWords) + len(self.oovWords)
+                self.oovWords.append(word)
+            ids.append(index)
+        return ids
+
+    def decode(self,ngram):
+        """ Returns the words of ngram ids
+        """
+        size = len(self.idWords)
+        return [self.idWords[index] if index < size else self.oovWords[index - size] for index in ngram]
+
+    def factors(self,ngram):
+        """ Returns the memoized [probability, smoothed] of the ngram ids (smoothed is None until needed)
+        """
+        memo = self.ngrams if max(ngram) < len(self.idWords) else self.oovNgrams
+        factors = memo.get(ngram)
+        if factors is None:
+            self.lmCalls += 1
+            factors = memo[ngram] = [self.lm.probability(self.decode(ngram)),None]
+        return factors
+
+    def score(self,ids,start,end,index = -1,replacement = None):
+        """ Returns exp(lm.evaluate()) of the words ids[start:end] where ids[index] is replacement
+            Args:
+                 ids (list): the ids of the text.
+                 start (int): first index of the window.
+                 end (int): the index after the window.
+                 index (int): the index of the replaced token, -1 for no replacement. Defaults to -1
+                 replacement (int): the id of the token at index. Defaults to None
+
+           returns:
+               the probability of the window
+        """
+        key = (start,end,index,replacement)
+        score = self.scores.get(key)
+        if score is not None:
+            return score
+        n = self.n
+        if not self.byNgrams:
+            window = ids[start:end]
+            if index > -1:
+                window[index - start] = replacement
+            self.lmCalls += 1
+            score = self.scores[key] = math.exp(self.lm.evaluate(" ".join(self.decode(window))))
+            return score
+
+        #: the ngrams that end before index do not depend on the replacement
+        firstCovering = max(start,index - n + 1) if index > -1 else end
+        stop = min(firstCovering,end - n + 1)
+        prefix = self.prefixes.get((start,stop))
+        if prefix is None:
+            prefix = self.prefixes[(start,stop)] = self.multiply(1,False,ids[start:stop + n - 1])
+        likelihod,smooth = prefix
+        if firstCovering < end - n + 1:
+            window = ids[firstCovering:end]
+            window[index - firstCovering] = replacement
+            likelihod,smooth = self.multiply(likelihod,smooth,window)
+        score = self.scores[key] = math.exp(math.log(likelihod)) #: the same rounding as exp(lm.evaluate())
+        return score
+
+    def buildMaxFactors(self):
+        """ maps every model ngram with one slot left out, (slot, the other ids), to the max probability
+            and the max smoothed probability of the model ngrams that only differ at the slot
+        """
+        n = self.n
+        self.maxFactors = {}
+        for key,(probability,smoothed) in self.lm.get_probabilities().items():
+            words = key.split()
+            if len(words) != n: #: a token with a space in it, no window of the text is this ngram
+                continue
+            ngram = tuple(self.wordIds[word] for word in words)
+            for slot in range(n):
+                pattern = (slot,) + ngram[:slot] + ngram[slot + 1:]
+                best = self.maxFactors.get(pattern)
+                if best is None:
+                    self.maxFactors[pattern] = [probability,smoothed]
+                    continue
+                if probability > best[0]:
+                    best[0] = probability
+                if smoothed > best[1]:
+                    best[1] = smoothed
+        #: an empty word is never a token, so neither the ngram nor its context is in the model
+        self.unseenFactor = self.lm.smooth([""] * n)
+
+    def maxFactor(self,pattern,smooth):
+        """ Returns the max factor of an ngram that matches the pattern, after ngrams that were (smooth)
+            or were not all in the model: an ngram that is not in the model is smoothed (at most unseenFactor).
+        """
+        best = self.maxFactors.get(pattern)
+        if best is None:
+            return self.unseenFactor
+        #: the replacement decides if the ngram is smoothed, unless an ngram before was not in the model
+        return max(self.unseenFactor,best[1] if smooth else max(best))
+
+    def logFactor(self,ngram,smooth):
+        """ Returns the log factor of ngram ids in lm.evaluate() after ngrams that were (smooth) or
+            were not all in the model, and the smooth state after it.
+            Args:
+                 ngram (tuple): the ids of the ngram.
+                 smooth (bool): True if an ngram before was not in the model.
+
+           returns:
+               (log factor, smooth)
+        """
+        if not self.byNgrams:
+            self.lmCalls += 1
+            return self.lm.evaluate(" ".join(self.decode(ngram))),smooth
+        factors = self.factors(ngram)
+        if factors[0] is None:
+            smooth = True
+        if not smooth:
+            return math.log(factors[0]),False
+        if factors[1] is None:
+            self.lmCalls += 1
+            factors[1] = self.lm.smooth(self.decode(ngram))
+        return math.log(factors[1]),True
+
+    def bound(self,ids,start,end,index):
+        """ Returns an upper bound of score(ids, start, end, index, replacement) for any replacement:
+            the ngrams that end before index do not depend on the replacement, every ngram that covers
+            index is at most the max factor of the model ngrams that only differ at index (or of an
+            ngram that is not in the model) and every ngram after them is at most the larger of its
+            probability and its smoothed probability.
+            Args:
+                 ids (list): the ids of the text.
+                 start (int): first index of the window.
+                 end (int): the index after the window.
+                 index (int): the index of the replaced token.
+
+           returns:
+               the bound of the window probability
+        """
+        if not self.byNgrams or not hasattr(self.lm,"get_probabilities"):
+            return 1
+        n = self.n
+        firstCovering = max(start,index - n + 1)
+        stop = min(firstCovering,end - n + 1)
+        prefix = self.prefixes.get((start,stop))
+        if prefix is None:
+            prefix = self.prefixes[(start,stop)] = self.multiply(1,False,ids[start:stop + n - 1])
+        likelihod,smooth = prefix
+        if self.maxFactors is None:
+            self.buildMaxFactors()
+        for first in range(firstCovering,min(index + 1,end - n + 1)):
+            likelihod *= self.maxFactor((index - first,) + tuple(ids[first:index]) + tuple(ids[index + 1:first + n]),smooth)
+        for first in range(index + 1,end - n + 1):
+            ngram = tuple(ids[first:first + n])
+            factors = self.factors(ngram)
+            if factors[1] is None:
+                self.lmCalls += 1
+                factors[1] = self.lm.smooth(self.decode(ngram))
+            likelihod *= factors[1] if smooth or factors[0] is None else max(factors)
+        return math.exp(math.log(likelihod)) if likelihod > 0 else 0.0
+
+    def multiply(self,likelihod,smooth,ids):
+        """ multiply the likelihod by the factors of all the ngrams of ids, in order, as lm.evaluate does
+            Args:
+                 likelihod (float): the product of the ngrams before.
+                 smooth (bool): True if an ngram before was not in the model.
+                 ids (list): the ids of the words.
+
+           returns:
+               (likelihod, smooth) after the ngrams
+        """
+        n = self.n
+        for first in range(len(ids) - n + 1):
+            factors = self.factors(tuple(ids[first:first + n]))
+            if factors[0] is None:
+                smooth = True
+            if not smooth:
+                likelihod *= factors[0]
+                continue
+            if factors[1] is None:
+                self.lmCalls += 1
+                factors[1] = self.lm.smooth(self.decode(ids[first:first + n]))
+            likelihod *= factors[1]
+        return likelihod,smooth
+
+
 class editGraph():
     """ collect all the words for some edit distance (1 and 2)
             
     """
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    maxDistance = 2
+
     def __init__(self,allWords):
         """ init editGraph
             Args:
@@ -577,6 +2693,70 @@ class editGraph():
    
         """
         self.allWords = allWords
+        self.deletesIndex = self.buildDeletesIndex(allWords)
+
+    def deletes(self,word):
+        """ All the strings made by deleting up to maxDistance chars from `word` (including `word`).
+            Args:
+                 word (str): word to delete from
+
+           return:
+               set of the strings
+        """
+        result = {word}
+        level = {word}
+        for _ in range(self.maxDistance):
+            level = set(w[:i] + w[i + 1:] for w in level for i in range(len(w)))
+            result |= level
+        return result
+
+    def buildDeletesIndex(self,allWords):
+        """ map every deletion string of the vocabulary to the words that produce it.
+            two words are at most maxDistance edits apart only if they share a deletion string,
+            so a query only looks up its own deletions instead of generating all edits2.
+            Args:
+                 allWords (set): all posible words.
+
+           return:
+               dict {deletion string: list of words}
+        """
+        deletesIndex = defaultdict(list)
+        for word in allWords:
+            for deleted in self.deletes(word):
+                deletesIndex[deleted].append(word)
+        return dict(deletesIndex)
+
+    def reverseEdits1(self,word,letters):
+        """ All the strings that `word` is one edit (as done by edits1) away from.
+            Args:
+                 word (str): the word after the edit
+                 letters (str): the chars that may appear in the string before the edit
+
+           return:
+               set of the strings
+        """
+        splits     = [(word[:i], word[i:])    for i in range(len(word) + 1)]
+        inserts    = [L + c + R               for L, R in splits for c in letters] #: undo a delete
+        transposes = [L + R[1] + R[0] + R[2:] for L, R in splits if len(R)>1]
+        replaces   = [L + c + R[1:]           for L, R in splits if R and R[0] in self.letters for c in letters]
+        deletes    = [L + R[1:]               for L, R in splits if R and R[0] in self.letters] #: undo an insert
+        return set(inserts + transposes + replaces + deletes)
+
+    def isRelated(self,word,wordsDist1,candidate):
+        """ check if `candidate` is reachable from `word` with up to two edits1 steps.
+            Args:
+                 word (str): the word to correct
+                 wordsDist1 (set): edits1(word)
+                 candidate (str): a known word that shares a deletion string with `word`
+
+           returns:
+               True if candidate would be returned by edits2 on word
+        """
+        if candidate == word or candidate in wordsDist1:
+            return True
+        #: the middle string of the two edits only holds chars of word and inserted letters
+        letters = set(self.letters).union(word)
+        return not wordsDist1.isdisjoint(self.reverseEdits1(candidate,letters))
     def edits1(self,word):
         """ All edits that are one edit away from `word`.
             Args:
@@ -619,10 +2799,9 @@ class editGraph():
            returns:
                set of all the distance 1 and 2 that are in the word space
         """
+        candidates = set(candidate for deleted in self.deletes(word) for candidate in self.deletesIndex.get(deleted, ()))
         wordsDist1 = self.edits1(word)
-        wordsDist2 = self.edits2(wordsDist1)
-        allRelatedWords = wordsDist1.union(wordsDist2)
-        return self.known(allRelatedWords)
+        return set(candidate for candidate in candidates if self.isRelated(word,wordsDist1,candidate))
         
 
         
@@ -637,18 +2816,19 @@ class editGraph():
 class EditDist():
     """ get the path of the edit distance and the error dict
     """
-    def __init__(self,wrong,correct):
+    def __init__(self,wrong,correct,distTable = None):
         """ 
             Args:
                  wrong (str): wrong word
                  correct (str) : correct word
+                 distTable (list): an already filled table (as filled by fillTables). Defaults to None
 
         """
         self.correct = correct
         self.wrong = wrong
         self.lenCorrect = len(correct) + 1
         self.lenWrong = len(wrong) + 1
-        self.distTable = self.initTable(self.lenWrong,self.lenCorrect)
+        self.distTable = distTable if distTable is not None else self.initTable(self.lenWrong,self.lenCorrect)
         self.initErrorTable()
         
     def initErrorTable(self):
@@ -687,18 +2867,86 @@ class EditDist():
         """
         self.errorWordTable = errorWordTable
         
-    def fillTable(self):
+    def fillTable(self,maxDistance = None):
         """ Calculate the Levenshtein edit-distance with dynamic programing
-        
+            Args:
+                 maxDistance (int): stop once the distance is known to be above it. Defaults to None
+
+           returns:
+               the distance, or None if it is above maxDistance (the table is not complete then)
+        """
+        table = self.fillTables([(self.wrong,self.correct)],maxDistance)[0]
+        if table is None:
+            return None
+        self.distTable = table
+        return table[-1][-1]
+
+    @staticmethod
+    def fillTables(pairs,maxDistance = None):
+        """ Calculate the Levenshtein edit-distance tables of many (wrong, correct) pairs at once.
+            The tables are padded to the longest words and filled row by row with numpy, where a row is
+            min(row above + 1, diagonal + cost) followed by a running min for the insertions.
+            Args:
+                 pairs (list): list of (wrong, correct) tuples
+                 maxDistance (int): stop once all the distances are known to be above it. Defaults to None
+
+           returns:
+               list of tables (as list of lists), None for the pairs above maxDistance
+        """
+        if not pairs:
+            return []
+        lenWrongs = np.array([len(wrong) for wrong,_ in pairs])
+        lenCorrects = np.array([len(correct) for _,correct in pairs])
+        rows, columns = lenWrongs.max() + 1, lenCorrects.max() + 1
+        #: char codes, padded with codes that never match
+        wrongCodes = np.full((len(pairs),rows), -1, dtype=np.int64)
+        correctCodes = np.full((len(pairs),columns), -2, dtype=np.int64)
+        for index,(wrong,correct) in enumerate(pairs):
+            wrongCodes[index,1:len(wrong) + 1] = [ord(char) for char in wrong]
+            correctCodes[index,1:len(correct) + 1] = [ord(char) for char in correct]
+
+        distTables = np.zeros((len(pairs),rows,columns), dtype=np.int64)
+        distTables[:,0,:] = np.arange(columns)
+        distTables[:,:,0] = np.arange(rows)
+        steps = np.arange(columns)
+        alive = np.ones(len(pairs), dtype=bool)
+        for wrong_index in range(1,rows):
+            above = distTables[:,wrong_index - 1,:]
+            row = np.empty_like(above)
+            row[:,0] = wrong_index
+            row[:,1:] = np.minimum(above[:,1:] + 1, #delete
+                                   above[:,:-1] + (correctCodes[:,1:] != wrongCodes[:,wrong_index,None])) #substitution
+            distTables[:,wrong_index,:] = np.minimum.accumulate(row - steps, axis=1) + steps #insertion
+            if maxDistance is not None:
+                #: the smallest value of a row never goes down in the next rows
+                alive &= (lenWrongs < wrong_index) | (distTables[:,wrong_index,:].min(axis=1) <= maxDistance)
+                if not alive.any():
+                    break
+
+        tables = []
+        for index in range(len(pairs)):
+            distance = distTables[index,lenWrongs[index],lenCorrects[index]]
+            if maxDistance is not None and (not alive[index] or distance > maxDistance):
+                tables.append(None)
+            else:
+                tables.append(distTables[index,:lenWrongs[index] + 1,:lenCorrects[index] + 1].tolist())
+        return tables
+
+    @classmethod
+    def batchOpeartions(cls,wrong,corrects,maxDistance = None):
+        """ Align one wrong word against many correct words at once
+            Args:
+                 wrong (str): wrong word
+                 corrects (list): correct words
+                 maxDistance (int): skip the words above this distance. Defaults to None
+
+           returns:
+               list of error tables as returned by getOpeartions (None for the words above maxDistance)
         """
-        for wrong_index in range(1,self.lenWrong):
-            for correct_index in range(1,self.lenCorrect):
-                self.distTable[wrong_index][correct_index] = min([
-                    self.distTable[wrong_index-1][correct_index] + 1, #delete
-                    self.distTable[wrong_index][correct_index-1] + 1, #insertion
-                    self.distTable[wrong_index-1][correct_index-1]+( 1 if self.correct[correct_index-1] !=self.wrong[wrong_index-1] else 0), #substitution
-                    ])
-                # t = self.distTable #too tests
+        tables = cls.fillTables([(wrong,correct) for correct in corrects],maxDistance)
+        return [cls(wrong,correct,table).getOpeartions() if table is not None else None
+                for correct,table in zip(corrects,tables)]
+
     def getReversedPath(self):
         """ Calculate the minimum Levenshtein edit-distance and get the path
 
@@ -707,32 +2955,26 @@ class EditDist():
            returns:
                path as list of tuple of indexs and action
         """
+        distTable = self.distTable
         currentPoint = ((self.lenWrong-1,self.lenCorrect-1),"n")
         path = deque([currentPoint])
         
         while currentPoint[0] != (0,0):
-            point,_ = currentPoint
-            insertion = (point[0]-1,point[1],"insertion")
-            sub = (point[0] - 1, point[1] -1,"substitution" )
-            deletion = (point[0],point[1]-1,"deletion")
-            
-            directions = [sub,deletion,insertion]
-            
-            direction_costs = (
-            (self.distTable[i][j] if (i >= 0 and j >= 0) else float("inf"), (i, j),opeartion)
-            for i, j,opeartion in directions
-        )
-            value,point,op = min(direction_costs, key=operator.itemgetter(0))
+            (i,j),_ = currentPoint
+            #: the cheapest of substitution, deletion and insertion, the first one on ties
+            value,point,op = (distTable[i-1][j-1] if i > 0 and j > 0 else math.inf), (i-1,j-1), "substitution"
+            if j > 0 and distTable[i][j-1] < value:
+                value,point,op = distTable[i][j-1], (i,j-1), "deletion"
+            if i > 0 and distTable[i-1][j] < value:
+                value,point,op = distTable[i-1][j], (i-1,j), "insertion"
             
             if op == "substitution":
-                if value != self.distTable[path[0][0][0]][path[0][0][1]]:
+                if value != distTable[i][j]:
                     path[0] = (path[0][0],"substitution")
             else:
                 path[0] = (path[0][0],op)
-            op = "n"
 
-
-            currentPoint = (point,op)
+            currentPoint = (point,"n")
             path.appendleft(currentPoint)
         return path
     def printTable(self):
@@ -802,6 +3044,48 @@ class EditDist():
 
         return self.errorWordTable
 
+#: the spell checker of a spell_check_many worker process
+worker_spell_checker = None
+
+
+def set_worker_spell_checker(spell_checker):
+    """Sets the spell checker used by spell_check_text (the initializer of the workers).
+    """
+    global worker_spell_checker
+    worker_spell_checker = spell_checker
+
+
+def spell_check_text(task):
+    """Returns the correction of one text, for spell_check_many.
+
+       Args:
+           task (tuple): (text, alpha)
+
+       Returns:
+           the modified string.
+    """
+    text,alpha = task
+    return worker_spell_checker.spell_check(text,alpha)
+
+
+def align_error_chunk(pairs):
+    """Returns the error tables of a chunk of (wrong, correct) pairs, for learn_error_tables.
+
+       Args:
+           pairs (list): list of (wrong, correct) tuples
+
+       Returns:
+           tuple. (the number of pairs, error tables dict as returned by getOpeartions)
+    """
+    errorTable = Spell_Checker.createDict()
+    #create error tables for calculate distnce operators, the whole chunk at once
+    for (wrong,correct),distTable in zip(pairs,EditDist.fillTables(pairs)):
+        table = EditDist(wrong,correct,distTable) #:toAdd : transposition implamantation.
+        table.setErrorWordTable(errorTable)
+        errorTable = table.getOpeartions()
+    return len(pairs),errorTable
+
+
 def counter_to_defultdict(counter):
     """get counter object and transform it to defultdict
 
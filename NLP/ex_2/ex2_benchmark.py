@@ -0,0 +1,142 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import timeit
+import ex2
+
+directory = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(directory, 'test_corpus.txt'), 'r') as f:
+    corpus = f.read()
+with open(os.path.join(directory, 'commmon_errors.txt'), 'r') as f:
+    common_errors = [line.split() for line in f if line.strip()]
+
+
+def corpus_words(n=1):
+    """return the vocabulary of a model built on the corpus (the allWords set of spell_check).
+    """
+    lm = ex2.Ngram_Language_Model(n=n)
+    lm.build_model(corpus)
+    return set(key.split()[0] for key in lm.get_model())
+
+
+def benchmark_candidates(tokens=200, seed=0):
+    """print the per-token latency of the edits1+edits2 candidates against the deletion index.
+    """
+    start = timeit.default_timer()
+    graph = ex2.editGraph(corpus_words())
+    print('deletion index: %d words, %d deletions | %.2f sec to build' % (len(graph.allWords), len(graph.deletesIndex), timeit.default_timer() - start))
+    words = [row[0] for row in random.Random(seed).sample(common_errors, tokens)]
+
+    def edits_candidates(word):
+        wordsDist1 = graph.edits1(word)
+        return graph.known(wordsDist1.union(graph.edits2(wordsDist1)))
+
+    for name, candidates in (('edits1+edits2', edits_candidates), ('deletion index', graph.getAllRelatedWords)):
+        start = timeit.default_timer()
+        for word in words:
+            candidates(word)
+        stop = timeit.default_timer()
+        print('%s | %.3f ms/token' % (name, (stop - start) * 1000 / len(words)))
+
+
+def benchmark_learn_error_tables(copies=20, chunk_size=1000):
+    """print the lines/sec of learn_error_tables on a scaled up commmon_errors.txt for growing worker counts.
+    """
+    with tempfile.TemporaryDirectory() as directory_path:
+        path = os.path.join(directory_path, 'errors.txt')
+        with open(path, 'w') as f:
+            for _ in range(copies):
+                f.writelines('\t'.join(row) + '\n' for row in common_errors)
+        lines = len(common_errors) * copies
+        workers_counts = sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+        base_time = None
+        for workers in workers_counts:
+            progress = lambda aligned: print('\r%d/%d lines' % (aligned, lines), end='', flush=True)
+            start = timeit.default_timer()
+            ex2.Spell_Checker().learn_error_tables(path, workers=workers, chunk_size=chunk_size, progress=progress)
+            learn_time = timeit.default_timer() - start
+            base_time = base_time or learn_time
+            print('\rlearn_error_tables lines=%d workers=%d | %.2f sec, %.0f lines/sec, speedup %.2fx' % (lines, workers, learn_time, lines / learn_time, base_time / learn_time))
+
+
+def benchmark_spell_check_many(n=3, lines=200, chunk_size=10):
+    """print the lines/sec of spell_check_many over the first lines of the corpus for growing worker counts.
+    """
+    spell_checker = ex2.Spell_Checker()
+    spell_checker.build_model(corpus, n)
+    spell_checker.learn_error_tables(os.path.join(directory, 'commmon_errors.txt'))
+    texts = [line for line in corpus.split('\n') if line.strip()][:lines]
+    workers_counts = sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+    base_time = None
+    for workers in workers_counts:
+        checker = ex2.Spell_Checker(spell_checker.lm) #: cold caches for every run
+        checker.add_error_tables(spell_checker.error_table)
+        progress = lambda checked, lines_per_sec: print('\r%d/%d lines, %.1f lines/sec' % (checked, len(texts), lines_per_sec), end='', flush=True)
+        start = timeit.default_timer()
+        for _ in checker.spell_check_many(texts, 0.95, workers=workers, chunk_size=chunk_size, progress=progress):
+            pass
+        check_time = timeit.default_timer() - start
+        base_time = base_time or check_time
+        print('\rspell_check_many n=%d lines=%d workers=%d | %.2f sec, %.1f lines/sec, speedup %.2fx' % (n, len(texts), workers, check_time, len(texts) / check_time, base_time / check_time))
+
+
+def inject_error(word, rnd):
+    """return the word with one random substitution, deletion, insertion or transposition.
+    """
+    index = rnd.randrange(len(word))
+    char = rnd.choice(ex2.editGraph.letters)
+    error = rnd.choice(('substitution', 'deletion', 'insertion', 'transposition') if index + 1 < len(word) else ('substitution', 'deletion', 'insertion'))
+    if error == 'substitution':
+        return word[:index] + char + word[index + 1:]
+    if error == 'deletion':
+        return word[:index] + word[index + 1:]
+    if error == 'insertion':
+        return word[:index] + char + word[index:]
+    return word[:index] + word[index + 1] + word[index] + word[index + 2:]
+
+
+def benchmark_spell_check_phases(n=3, lines=200, seed=0):
+    """replay the first lines of the corpus with one injected error per line through spell_check
+    (both decoders) and print the tokens/sec, the corrected lines and the spell_check_stats() per phase.
+    """
+    spell_checker = ex2.Spell_Checker()
+    spell_checker.build_model(corpus, n)
+    spell_checker.learn_error_tables(os.path.join(directory, 'commmon_errors.txt'))
+    rnd = random.Random(seed)
+    texts, expected = [], []
+    for line in corpus.split('\n'):
+        words = [word for token in ex2.iter_tokens(line) for word in token.split()]
+        positions = [index for index, word in enumerate(words) if word.isalpha() and len(word) > 2]
+        if not 4 < len(words) < 14 or not positions:
+            continue
+        expected.append(' '.join(words))
+        index = rnd.choice(positions)
+        words[index] = inject_error(words[index], rnd)
+        texts.append(' '.join(words))
+        if len(texts) == lines:
+            break
+    for decoder in ('rows', 'lattice'):
+        checker = ex2.Spell_Checker(spell_checker.lm) #: cold caches for every run
+        checker.add_error_tables(spell_checker.error_table)
+        totals = ex2.Spell_Checker.newStats()
+        corrected = 0
+        for text, line in zip(texts, expected):
+            corrected += checker.spell_check(text, 0.95, decoder=decoder) == line
+            for key, value in checker.spell_check_stats().items():
+                if key == 'seconds':
+                    for phase, phase_time in value.items():
+                        totals['seconds'][phase] += phase_time
+                else:
+                    totals[key] += value
+        seconds = totals.pop('seconds')
+        print('spell_check n=%d decoder=%s lines=%d | %.0f tokens/sec, %d/%d lines corrected' % (n, decoder, len(texts), totals['tokens'] / seconds['total'], corrected, len(texts)))
+        print('    ' + ', '.join('%s %.3f sec (%.0f%%)' % (phase, phase_time, 100 * phase_time / seconds['total']) for phase, phase_time in seconds.items() if phase != 'total'))
+        print('    ' + ', '.join('%s %d' % item for item in totals.items()))
+
+
+if __name__ == '__main__':
+    benchmark_candidates()
+    benchmark_learn_error_tables()
+    benchmark_spell_check_many()
+    benchmark_spell_check_phases()
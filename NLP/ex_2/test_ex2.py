@@ -0,0 +1,164 @@
+import os
+import math
+import tempfile
+import ex2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS = open(os.path.join(HERE, 'test_corpus.txt')).read()
+ERRORS = ex2.Spell_Checker().learn_error_tables(os.path.join(HERE, 'commmon_errors.txt'))
+TEXTS = ['my faily is the besg .', 'the projct gutenberg ebook of the federalist papers',
+         'it is the duty of the peple', 'the poer of the union .', 'besg', 'a b c d']
+#: the corrections of TEXTS (alpha 0.95 and 0.5) before the spell checker indexes, caches and pruning
+OLD_CORRECTIONS = {
+    2: [('my family is the besg .', 'my family is the besg .'),
+        ('the projct gutenberg ebook of the federalist papers', 'the projct gutenberg ebook of the federalist papers'),
+        ('it is the duty of the people', 'it is the duty of the people'),
+        ('the poer of the union .', 'the poor of the union .'),
+        ('besg', 'best'),
+        ('a b c d', 'a b c d')],
+    3: [('my family is the besg .', 'my family is the besg .'),
+        ('the projct gutenberg ebook of the federalist papers', 'the projct gutenberg ebook of the federalist papers'),
+        ('it is the duty of the peple', 'it is the duty of the people'),
+        ('the poer of the union .', 'the poer of the union .'),
+        ('besg', 'best'),
+        ('a b c d', 'a b c d')]}
+#: the distance and the errors (the non zero counts) of the old EditDist of (wrong, correct) pairs
+OLD_EDITS = {('#xoen', '#oxen'): (2, {'transposition': {'ox': 1}}),
+             ('#besg', '#best'): (1, {'substitution': {'gt': 1}}),
+             ('#acress', '#actress'): (1, {'deletion': {'ct': 1}}),
+             ('#peple', '#people'): (1, {'deletion': {'eo': 1}}),
+             ('#a', '#abc'): (2, {'deletion': {'ab': 1, 'bc': 1}})}
+
+
+def spell_checker(n, model_class=ex2.Ngram_Language_Model, error_tables=ERRORS, **options):
+    """Returns a spell checker of an n-gram model of the test corpus and the common errors.
+    """
+    spc = ex2.Spell_Checker(model_class(n=n), **options)
+    spc.lm.build_model(CORPUS)
+    spc.add_language_model(spc.lm)
+    spc.add_error_tables(error_tables)
+    return spc
+
+
+def corrections(spc, texts=TEXTS):
+    """Returns the spell_check of every text with alpha 0.95 and 0.5.
+    """
+    return [(spc.spell_check(text, 0.95), spc.spell_check(text, 0.5)) for text in texts]
+
+
+def nonzero(error_tables):
+    """Returns the non zero counts of error tables, by error type.
+    """
+    return {error_type: {chars: count for chars,count in table.items() if count}
+            for error_type,table in error_tables.items() if any(table.values())}
+
+
+def test_corrections_match_old_spell_checker():
+    """the string and the packed models, and error tables loaded from confusion matrices, correct like before.
+    """
+    path = os.path.join(tempfile.mkdtemp(), 'errors.bin')
+    ex2.Confusion_Matrices(ERRORS).save(path)
+    matrices = ex2.Confusion_Matrices().load(path)
+    assert nonzero(matrices.error_tables()) == nonzero(ERRORS)
+    for n in (2, 3):
+        assert corrections(spell_checker(n)) == OLD_CORRECTIONS[n]
+        assert corrections(spell_checker(n, ex2.Packed_Ngram_Language_Model)) == OLD_CORRECTIONS[n]
+        assert corrections(spell_checker(n, error_tables=matrices)) == OLD_CORRECTIONS[n]
+
+
+def test_edit_dist_matches_old_tables():
+    """the numpy tables give the old distances and errors, alone or in a batch, and the cutoff drops the far words.
+    """
+    for (wrong,correct),(distance,errors) in OLD_EDITS.items():
+        table = ex2.EditDist(wrong, correct)
+        assert table.fillTable() == distance
+        assert nonzero(table.getOpeartions()) == errors
+        assert ex2.EditDist(wrong, correct).fillTable(maxDistance=1) == (distance if distance <= 1 else None)
+    corrects = ['#oxen', '#best', '#xoen', '#abc']
+    batch = ex2.EditDist.batchOpeartions('#xoen', corrects)
+    for correct,errors in zip(corrects, batch):
+        table = ex2.EditDist('#xoen', correct)
+        table.fillTable()
+        assert nonzero(errors) == nonzero(table.getOpeartions())
+    assert [errors is None for errors in ex2.EditDist.batchOpeartions('#xoen', corrects, maxDistance=2)] == [False, True, False, True]
+
+
+def test_caches_keep_corrections():
+    """the candidate and channel caches are hit by the next calls and do not change the corrections.
+    """
+    spc = spell_checker(2)
+    uncached = spell_checker(2, candidate_cache_size=0, channel_cache_size=0)
+    assert corrections(spc) == corrections(uncached) == OLD_CORRECTIONS[2]
+    assert corrections(spc) == OLD_CORRECTIONS[2]
+    assert spc.candidate_cache_info()['hits'] > 0
+    assert spc.channel_cache_info()['hits'] > 0
+    assert uncached.candidate_cache_info()['size'] == uncached.channel_cache_info()['size'] == 0
+
+
+def test_window_scores_match_evaluate():
+    """a window scored on token ids is exp(lm.evaluate()) of its words, as the windows were scored before.
+    """
+    for n in (2, 3):
+        spc = spell_checker(n)
+        words = 'it is the duty of the peple of the union'.split()
+        scorer = spc.scorer
+        scorer.newText()
+        ids = scorer.encode(words)
+        for start,end in ((0, 5), (2, 8), (0, len(words))):
+            assert scorer.score(ids, start, end) == math.exp(spc.lm.evaluate(' '.join(words[start:end])))
+            replaced = words[:6] + ['people'] + words[7:]
+            if start <= 6 < end:
+                assert scorer.score(ids, start, end, 6, spc.word_ids['people']) == math.exp(spc.lm.evaluate(' '.join(replaced[start:end])))
+
+
+def test_spell_check_many():
+    """spell_check_many gives the spell_check of every text, in order, with one process or a pool.
+    """
+    spc = spell_checker(2)
+    for workers in (1, 2):
+        assert list(spc.spell_check_many(TEXTS, 0.5, workers=workers, chunk_size=2)) == [corrected for _,corrected in OLD_CORRECTIONS[2]]
+
+
+def test_learn_error_tables_workers():
+    """the error tables learned by a pool of processes are the tables of one process.
+    """
+    error_tables = ex2.Spell_Checker().learn_error_tables(os.path.join(HERE, 'commmon_errors.txt'), workers=2, chunk_size=500)
+    assert nonzero(error_tables) == nonzero(ERRORS)
+
+
+def test_pruning_scores_fewer_candidates():
+    """the pruned candidates could not beat the best candidate or the kept word, so the corrections
+        are the ones of scoring every candidate, with far fewer candidates scored.
+    """
+    for n in (2, 3):
+        pruned = spell_checker(n)
+        scored = spell_checker(n, prune_candidates=False)
+        for text in TEXTS:
+            for alpha in (0.95, 0.5):
+                assert pruned.spell_check(text, alpha) == scored.spell_check(text, alpha)
+        assert pruned.pruning_info()['scored'] * 2 < scored.pruning_info()['scored']
+
+
+def test_lattice_agrees_with_rows():
+    """with one correction per text, like the rows decoder, the lattice decoder picks the same text,
+        and without a limit it can also fix a second word.
+    """
+    for n in (2, 3):
+        spc = spell_checker(n)
+        for text in TEXTS:
+            for alpha in (0.95, 0.5):
+                assert spc.spell_check(text, alpha, decoder='lattice', max_corrections=1) == spc.spell_check(text, alpha)
+        assert spc.spell_check(TEXTS[0], 0.95) == 'my family is the besg .'
+        assert spc.spell_check(TEXTS[0], 0.95, decoder='lattice') == 'my family is the best .'
+
+
+if __name__ == '__main__':
+    test_pruning_scores_fewer_candidates()
+    test_lattice_agrees_with_rows()
+    test_corrections_match_old_spell_checker()
+    test_edit_dist_matches_old_tables()
+    test_caches_keep_corrections()
+    test_window_scores_match_evaluate()
+    test_spell_check_many()
+    test_learn_error_tables_workers()
+    print('ok')
@@ -208,8 +208,7 @@ def hmm_tag_sentence(sentence, A, B):
     Return:
         list: list of pairs
     """
-    viterbi_matrix = viterbi(sentence,A,B)
-    tags = retrace(viterbi_matrix)
+    tags = viterbi_tags(sentence,A,B)
     tagged_sentence = []
     
     assert len(sentence) == len(tags)
@@ -352,6 +351,106 @@ def predict_next_best(word, tag, viterbi_matrix,A,B):
     
     return (tag,best_state_index, probability)
 
+# dense arrays of the HMM, built by hmm_arrays() once per (A, B)
+hmm_cache = {}
+
+def hmm_arrays(A, B):
+    """Returns the HMM as dense log-probability arrays over the tags of allTagCounts
+    (in that order): 'transitions' (TxT, previous tag x tag), 'starts' and 'ends'
+    (the transitions from START and to END), and 'emissions', a memo of the
+    emission vector of every word (see word_emissions()). A transition that was
+    not seen gets the same fallback as predict_next_best(): 1/sum of the log
+    probabilities of the previous tag. The arrays are built once and reused as
+    long as A and B are the same objects.
+
+    Args:
+        A (dict): The HMM Transition probabilities
+        B (dict): the HMM emmission probabilities.
+
+    Return:
+        dict: the arrays, with 'states' (the tags) and 'index' (tag -> row)
+    """
+    if hmm_cache.get('A') is A and hmm_cache.get('B') is B and len(hmm_cache['states']) == len(allTagCounts):
+        return hmm_cache
+
+    states = list(allTagCounts.keys())
+    def fallback(tag):
+        total = sum(A[tag].values())
+        return 1/total if total else -inf #: only one transition (log 1 = 0), nothing else was seen
+
+    transitions = np.empty((len(states), len(states)))
+    ends = np.empty(len(states))
+    for row_index, previous_tag in enumerate(states):
+        missing = fallback(previous_tag)
+        transitions[row_index] = [A[previous_tag].get(tag, missing) for tag in states]
+        ends[row_index] = A[previous_tag].get(END, missing)
+    missing = fallback(START)
+    starts = np.array([A[START].get(tag, missing) for tag in states])
+
+    hmm_cache.clear()
+    hmm_cache.update({'A': A, 'B': B, 'states': states,
+                      'index': {tag: row_index for row_index, tag in enumerate(states)},
+                      'transitions': transitions, 'starts': starts, 'ends': ends, 'emissions': {}})
+    return hmm_cache
+
+def word_emissions(word, arrays, B):
+    """Returns the emission log-probabilities of a word for every tag (a vector
+    in the order of arrays['states']). Like viterbi(), a known word is only
+    scored with the tags seen with it (-inf for the others) and UNK with all tags.
+
+    Args:
+        word (str): a word of perWordTagCounts or UNK
+        arrays (dict): the arrays of the HMM, see hmm_arrays()
+        B (dict): the HMM emmission probabilities.
+
+    Return:
+        np.array: the emission of every tag
+    """
+    emissions = arrays['emissions'].get(word)
+    if emissions is None:
+        emissions = np.full(len(arrays['states']), -inf)
+        tags = arrays['states'] if word == UNK else perWordTagCounts[word].keys()
+        for tag in tags:
+            emissions[arrays['index'][tag]] = B[tag][word]
+        arrays['emissions'][word] = emissions
+    return emissions
+
+def viterbi_tags(sentence, A, B):
+    """Returns the most probable tags of the sentence, the same tags as
+    retrace(viterbi(sentence, A, B)) computed on dense arrays: the emissions of
+    the sentence are gathered into a (length x T) matrix and every column is a
+    max/argmax over the (T x T) sum of the previous column and the transitions,
+    with the argmax kept in a backpointer array. O(n*T^2) in vector operations.
+
+    Args:
+        sentence (list): a list of tokens (the sentence to tag)
+        A (dict): The HMM Transition probabilities
+        B (dict): tthe HMM emmission probabilities.
+
+    Return:
+        list: the tags of the words (same indices)
+    """
+    if not sentence:
+        return []
+    arrays = hmm_arrays(A, B)
+    transitions = arrays['transitions']
+    emissions = np.array([word_emissions(word if word in perWordTagCounts else UNK, arrays, B) for word in sentence])
+
+    backpointers = np.zeros(emissions.shape, dtype=np.intp)
+    column = arrays['starts'] + emissions[0]
+    for i in range(1, len(sentence)):
+        scores = column[:, None] + transitions
+        backpointers[i] = scores.argmax(axis=0)
+        column = scores.max(axis=0) + emissions[i]
+
+    #: the END item and the way back
+    row_index = int(np.argmax(column + arrays['ends']))
+    tags = [row_index]
+    for i in range(len(sentence) - 1, 0, -1):
+        row_index = backpointers[i, row_index]
+        tags.append(row_index)
+    return [arrays['states'][row_index] for row_index in reversed(tags)]
+
 def joint_prob(sentence, A, B):
     """Returns the joint probability of the given sequence of words and tags under
      the HMM model.
@@ -0,0 +1,37 @@
+import os
+import timeit
+import tagger
+
+directory = os.path.dirname(os.path.abspath(__file__))
+train_path = os.path.join(directory, 'data', 'en-ud-train.upos.tsv')
+dev_path = os.path.join(directory, 'data', 'en-ud-dev.upos.tsv')
+
+
+def benchmark_viterbi(sentences=None):
+    """print the sentences/sec and the accuracy of the HMM tagger on the dev set, with the
+    list based viterbi()+retrace() and with the numpy viterbi_tags(), and check that they agree.
+    """
+    train_data = tagger.load_annotated_corpus(train_path)
+    dev_data = tagger.load_annotated_corpus(dev_path)[:sentences]
+    A, B = tagger.learn_params(train_data)[4:]
+    words = [[word for word, tag in sentence] for sentence in dev_data]
+    tokens = sum(len(sentence) for sentence in words)
+
+    engines = (('viterbi+retrace', lambda sentence: tagger.retrace(tagger.viterbi(sentence, A, B))),
+               ('viterbi_tags', lambda sentence: tagger.viterbi_tags(sentence, A, B)))
+    results = {}
+    base_time = None
+    for name, tag in engines:
+        start = timeit.default_timer()
+        results[name] = [tag(sentence) for sentence in words]
+        tag_time = timeit.default_timer() - start
+        base_time = base_time or tag_time
+        correct = sum(tagger.count_correct(gold, list(zip(sentence, tags)))[0]
+                      for gold, sentence, tags in zip(dev_data, words, results[name]))
+        print('%s sentences=%d | %.2f sec, %.0f sentences/sec, accuracy %.4f, speedup %.2fx' % (name, len(words), tag_time, len(words) / tag_time, correct / tokens, base_time / tag_time))
+    disagreements = sum(old != new for old, new in zip(*results.values()))
+    print('sentences tagged differently: %d' % disagreements)
+
+
+if __name__ == '__main__':
+    benchmark_viterbi()
@@ -0,0 +1,30 @@
+import tagger
+
+#: every tag is seen before two tags at least, viterbi() can not score an unseen transition after a single one
+TRAIN = [[('the', 'DET'), ('dog', 'NOUN'), ('barks', 'VERB'), ('.', 'PUNCT')],
+         [('a', 'DET'), ('dog', 'NOUN'), ('runs', 'VERB'), ('fast', 'ADV'), ('.', 'PUNCT')],
+         [('the', 'DET'), ('cat', 'NOUN'), ('.', 'PUNCT'), ('the', 'DET'), ('cat', 'NOUN'), ('runs', 'VERB'), ('.', 'PUNCT')],
+         [('dogs', 'NOUN'), ('run', 'VERB'), ('fast', 'ADV')],
+         [('the', 'DET'), ('run', 'NOUN'), ('was', 'VERB'), ('fast', 'ADJ'), ('.', 'PUNCT')],
+         [('a', 'DET'), ('fast', 'ADJ'), ('cat', 'NOUN'), ('barks', 'VERB'), ('.', 'PUNCT')]]
+SENTENCES = [['the', 'dog', 'runs', '.'],
+             ['a', 'cat', 'barks', 'fast', '.'],
+             ['the', 'run', 'was', 'fast', '.'],
+             ['dogs', 'run', 'fast'],
+             ['the', 'unicorn', 'runs', '.'],
+             ['fast']]
+
+
+def test_viterbi_tags_matches_viterbi():
+    """the numpy viterbi tags every sentence (with an unknown word too) like the list based viterbi() and retrace().
+    """
+    A, B = tagger.learn_params(TRAIN)[4:]
+    for sentence in SENTENCES:
+        tags = tagger.viterbi_tags(sentence, A, B)
+        assert tags == tagger.retrace(tagger.viterbi(sentence, A, B))
+        assert tagger.hmm_tag_sentence(sentence, A, B) == list(zip(sentence, tags))
+
+
+if __name__ == '__main__':
+    test_viterbi_tags_matches_viterbi()
+    print('ok')